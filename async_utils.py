@@ -0,0 +1,55 @@
+import asyncio
+import threading
+import weakref
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+# Long-lived event loop on a daemon thread, shared by every sync caller in the process
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="async-utils-loop", daemon=True).start()
+    return _loop
+
+
+# Run a coroutine from synchronous code (Streamlit script thread, worker threads) and wait for it.
+# Unlike asyncio.run this reuses one loop, so pooled async HTTP connections stay usable between calls
+def run_sync(coro):
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
+
+
+# Lazily creates one object per running event loop; async HTTP clients must not be shared across loops
+class PerLoop:
+    def __init__(self, factory):
+        self.factory = factory
+        self._instances = weakref.WeakKeyDictionary()
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        instance = self._instances.get(loop)
+        if instance is None:
+            instance = self._instances[loop] = self.factory()
+        return instance
+
+
+_DONE = object()
+
+
+async def _next_item(agen):
+    try:
+        return await agen.__anext__()
+    except StopAsyncIteration:
+        return _DONE
+
+
+# Iterate an async generator from synchronous code, one item at a time on the background loop
+def iterate_sync(agen):
+    while True:
+        item = run_sync(_next_item(agen))
+        if item is _DONE:
+            return
+        yield item
@@ -0,0 +1,634 @@
+import re
+import argparse
+import json
+import random
+import time
+
+from retrieval import InvertedIndex
+
+# Vocabulary for the synthetic corpus used when no dataset file is given
+FACTS = [
+    ("GPA", "GPA"), ("computed_age", "computed age"), ("residency_status", "residency status"),
+    ("academic_status", "academic status"), ("student_status", "student status"),
+    ("library_fine", "outstanding library fine"), ("transfer_credits", "transfer credits"),
+    ("incomplete_grades", "number of incomplete grades"), ("course_mode", "course delivery mode"),
+    ("financial_aid_status", "financial aid status"), ("tuition_status", "tuition payment status"),
+    ("SB11", "Student Education Status (SB11)"), ("SB15", "Student Enrollment Status (SB15)"),
+    ("registered_credit_hours", "registered credit hours"), ("honors_program", "honors program status"),
+    ("major", "declared major"), ("email", "email domain"), ("last_name", "last name"),
+]
+OPERATORS = [
+    ("lessThan", "is less than"), ("greaterThan", "is greater than"),
+    ("equal", "is"), ("notEqual", "is not"),
+]
+ACTIONS = [
+    "display a message about it", "flag the record for advisor review", "trigger an academic review",
+    "send a reminder email to the student", "place a hold on their record", "notify the department",
+]
+FILLERS = ["", "currently ", "the ", "for the current semester ", "as recorded by the registrar "]
+
+
+# Build a synthetic dataset in the corrected_dataset.json shape
+def synthetic_corpus(size, seed=0):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        fact, phrase = rng.choice(FACTS)
+        operator, operator_phrase = rng.choice(OPERATORS)
+        value = rng.choice([rng.randint(0, 100), round(rng.uniform(0, 4), 1), "'probation'", "'Y'"])
+        sentence = (
+            f"If {rng.choice(FILLERS)}the student's {phrase} {operator_phrase} {value}, "
+            f"{rng.choice(ACTIONS)}."
+        )
+        corpus.append({
+            "input": sentence,
+            "output": {
+                "conditions": {"fact": fact, "operator": operator, "value": value},
+                "actions": {"message": sentence.split(", ", 1)[1]},
+            },
+        })
+    return corpus
+
+
+def load_corpus(dataset_path, size):
+    if dataset_path:
+        with open(dataset_path, 'r') as file:
+            return json.load(file)
+    return synthetic_corpus(size)
+
+
+# Set of condition facts, used as the relevance label for retrieval hit quality
+def condition_signature(output):
+    conditions = output.get("conditions", {}) if isinstance(output, dict) else {}
+    leaves = conditions.get("all") or conditions.get("any") or [conditions]
+    return frozenset(leaf.get("fact") for leaf in leaves if isinstance(leaf, dict))
+
+
+# The original per-request linear keyword-overlap scan, kept as the baseline
+def linear_keyword_search(prompt, examples, k):
+    keywords = set(prompt.lower().split())
+    scored = [(len(keywords & set(example['input'].lower().split())), i) for i, example in enumerate(examples)]
+    scored.sort(reverse=True, key=lambda x: x[0])
+    return [i for _, i in scored[:k]]
+
+
+def time_per_call(fn, queries):
+    start = time.perf_counter()
+    results = [fn(query) for query in queries]
+    return (time.perf_counter() - start) / max(len(queries), 1), results
+
+
+# Leave-one-out precision@k: retrieved neighbours sharing the query example's condition facts
+def precision_at_k(results, query_ids, signatures, k):
+    hits = total = 0
+    for query_id, ids in zip(query_ids, results):
+        neighbours = [i for i in ids if i != query_id][:k]
+        hits += sum(signatures[i] == signatures[query_id] for i in neighbours)
+        total += k
+    return hits / max(total, 1)
+
+
+def bench_retrieval(args):
+    corpus = load_corpus(args.dataset, args.size)
+    texts = [example['input'] for example in corpus]
+    signatures = [condition_signature(example['output']) for example in corpus]
+    rng = random.Random(1)
+    query_ids = rng.sample(range(len(corpus)), min(args.queries, len(corpus)))
+    queries = [texts[i] for i in query_ids]
+    k = args.k
+
+    print(f"examples={len(corpus)} queries={len(queries)} k={k}")
+    print(f"{'selector':<22}{'build ms':>10}{'per query ms':>14}{'precision@k':>13}")
+
+    def report(name, build_ms, per_query, results):
+        precision = precision_at_k(results, query_ids, signatures, k)
+        print(f"{name:<22}{build_ms:>10.1f}{per_query * 1000:>14.3f}{precision:>13.3f}")
+
+    per_query, results = time_per_call(lambda q: linear_keyword_search(q, corpus, k + 1), queries)
+    report("keyword (linear scan)", 0.0, per_query, results)
+
+    start = time.perf_counter()
+    index = InvertedIndex.build(texts)
+    build_ms = (time.perf_counter() - start) * 1000
+    per_query, results = time_per_call(lambda q: index.search(q, k + 1), queries)
+    report("keyword (inverted)", build_ms, per_query, results)
+
+    from sparse_retrieval import SparseIndex
+    for scheme in ("tfidf", "bm25"):
+        start = time.perf_counter()
+        sparse_index = SparseIndex.build(texts, scheme=scheme)
+        build_ms = (time.perf_counter() - start) * 1000
+        per_query, results = time_per_call(lambda q: sparse_index.search(q, k + 1), queries)
+        report(scheme, build_ms, per_query, results)
+
+        start = time.perf_counter()
+        results = sparse_index.search_batch(queries, k + 1)
+        per_query = (time.perf_counter() - start) / max(len(queries), 1)
+        report(f"{scheme} (batched)", build_ms, per_query, results)
+
+
+# Per-request CPU time and prompt tokens of hack3's prompt: rebuilt per call vs precompiled prefix
+def bench_prefix(args):
+    from prompts import EXAMPLES_PATH, count_tokens, load_prefix
+    with open(EXAMPLES_PATH, 'r', encoding='utf-8') as file:
+        raw = file.read()
+    template = "\n    Convert the following natural language statement into a structured JSON rule format.\n\n" \
+               "    Examples:\n    {example_texts}\n\n    "
+    prompt = "If the student's GPA is below 2.5, recommend academic counseling."
+    suffix = f'Now, convert this: "{prompt}"\n    '
+
+    # Before: the example list was rebuilt and every output re-serialized with indent=2 on each click
+    def rebuilt():
+        examples = json.loads(raw)
+        example_texts = "\n\n".join(
+            f"Input: \"{example['input']}\"\nOutput: {json.dumps(example['output'], indent=2)}"
+            for example in examples
+        )
+        return template.format(example_texts=example_texts) + suffix
+
+    def precompiled():
+        return load_prefix(template)[0] + suffix
+
+    def packed():
+        return load_prefix(template, budget=args.budget)[0] + suffix
+
+    runs = args.queries
+    builds = (("rebuilt per call", rebuilt), ("precompiled prefix", precompiled), (f"packed ({args.budget} tok)", packed))
+    for name, build in builds:
+        build()
+        start = time.process_time()
+        for _ in range(runs):
+            query = build()
+        cpu_us = (time.process_time() - start) / runs * 1e6
+        print(f"{name:<20} cpu/request {cpu_us:>9.1f} us   prompt tokens {count_tokens(query):>6}")
+
+    prefix = load_prefix(template, budget=args.budget)[0]
+    print(f"cacheable prefix tokens {count_tokens(prefix)} of {count_tokens(prefix + suffix)}")
+
+
+# The original greedy first-'{'-to-last-'}' extractor, kept as the baseline
+def regex_extract_json(text):
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match:
+        try:
+            return json.loads(match.group())
+        except json.JSONDecodeError:
+            return None
+    return None
+
+
+# Large noisy LLM responses: prose with stray braces, a decoy object, fences, Python literals
+def noisy_responses(size, seed=0):
+    rng = random.Random(seed)
+    rule = synthetic_corpus(1, seed)[0]["output"]
+    prose = "The rule uses {fact} placeholders and checks the student's record carefully. "
+    body = json.dumps(rule)
+    shapes = [
+        lambda noise: noise + body + noise,
+        lambda noise: noise + '{"example": true} ' + noise + body + " Note: {see above}.",
+        lambda noise: noise + "```json\n" + json.dumps(rule, indent=2) + "\n```\n" + noise,
+        lambda noise: noise + body.replace("true", "True").replace("}}", "},}") + noise,
+    ]
+    responses = []
+    for i in range(len(shapes) * 5):
+        noise = prose * (size // len(prose) // 2) + str(rng.random())
+        responses.append((shapes[i % len(shapes)](noise), rule))
+    return responses
+
+
+def bench_extract(args):
+    from json_utils import extract_json
+    for size in (1_000, 100_000, 1_000_000):
+        responses = noisy_responses(size)
+        for name, extract in (("greedy regex", regex_extract_json), ("balanced scanner", extract_json)):
+            start = time.perf_counter()
+            results = [extract(text) for text, _ in responses]
+            per_call = (time.perf_counter() - start) / len(responses)
+            correct = sum(result == rule for result, (_, rule) in zip(results, responses))
+            print(f"{size:>9} chars  {name:<17} {per_call * 1000:>9.3f} ms/response   "
+                  f"{correct}/{len(responses)} rules extracted")
+
+
+# The per-record dict walk the engine replaces, kept as the baseline (equality/ordering leaves only)
+def interpret_condition(node, record):
+    if "all" in node:
+        return all(interpret_condition(child, record) for child in node["all"])
+    if "any" in node:
+        return any(interpret_condition(child, record) for child in node["any"])
+    actual = record.get(node["fact"])
+    if actual is None:
+        return False
+    operator, value = node["operator"], node["value"]
+    if operator == "equal":
+        return actual == value
+    if operator == "notEqual":
+        return actual != value
+    try:
+        if operator == "lessThan":
+            return actual < value
+        if operator == "greaterThan":
+            return actual > value
+    except TypeError:
+        return False
+    raise ValueError(operator)
+
+
+def condition_leaves(conditions):
+    groups = conditions.get("all") or conditions.get("any")
+    return [leaf for group in groups for leaf in condition_leaves(group)] if groups else [conditions]
+
+
+# Student records over the rules' facts; each fact takes one of the values rules test for (or is missing)
+def synthetic_records(rules, size, seed=0):
+    rng = random.Random(seed)
+    values = {}
+    for rule in rules:
+        for leaf in condition_leaves(rule["conditions"]):
+            value = leaf["value"]
+            choices = values.setdefault(leaf["fact"], [])
+            choices.append(value)
+            if not isinstance(value, str):
+                choices.extend([value - 1, value + 1])
+    facts = sorted(values)
+    return [{fact: rng.choice(values[fact]) for fact in facts if rng.random() < 0.9} for _ in range(size)]
+
+
+# Literal leaves from the synthetic corpus with one value type per fact, as in a real student table
+# (a bare word bounding lessThan/greaterThan would also name another fact in the engine), grouped
+# into all/any rules of one to four leaves like the generated examples. With `distinct`, numeric values are
+# snapped to that many thresholds per fact, so rules repeat leaf tests the way generated rule sets do
+def synthetic_rules(count, seed=2, distinct=None):
+    leaves = []
+    fact_types = {}
+    for example in synthetic_corpus(count * 16):
+        leaf = example["output"]["conditions"]
+        is_text = isinstance(leaf["value"], str)
+        if fact_types.setdefault(leaf["fact"], is_text) != is_text or (is_text and leaf["operator"] in ("lessThan", "greaterThan")):
+            continue
+        if is_text:
+            leaf["value"] = leaf["value"].strip("'")
+        elif distinct:
+            leaf["value"] = int(leaf["value"]) // (100 // distinct + 1) * (100 // distinct + 1)
+        leaves.append((leaf, example["output"]["actions"]))
+    rng = random.Random(seed)
+    rules = []
+    for _ in range(count):
+        group = [leaves.pop() for _ in range(rng.randint(1, 4))]
+        conditions = group[0][0] if len(group) == 1 else {rng.choice(("all", "any")): [leaf for leaf, _ in group]}
+        rules.append({"conditions": conditions, "actions": group[0][1]})
+    return rules
+
+
+def bench_engine(args):
+    from rule_engine import RuleSet
+    rules = synthetic_rules(args.rules or 50)
+    records = synthetic_records(rules, args.size)
+    print(f"rules={len(rules)} records={len(records)}")
+
+    start = time.perf_counter()
+    rule_set = RuleSet(rules)
+    print(f"compile {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    def interpreted():
+        return [(i, n, rule["actions"]) for i, record in enumerate(records)
+                for n, rule in enumerate(rules) if interpret_condition(rule["conditions"], record)]
+
+    for name, run in (("interpreted", interpreted), ("compiled", lambda: list(rule_set.run(records)))):
+        start = time.perf_counter()
+        matches = run()
+        elapsed = time.perf_counter() - start
+        evaluations = len(records) * len(rules)
+        print(f"{name:<12} {elapsed * 1000:>9.1f} ms   {evaluations / elapsed / 1e6:>6.2f} M rule evals/s   "
+              f"{len(matches)} matches")
+
+
+# Many generated rules sharing leaf tests: independent compiled rules vs the shared-condition network,
+# with each alpha node tested in turn or found by threshold bisect / hash / trie lookups
+def bench_network(args):
+    from rule_engine import RuleSet
+    from rule_network import RuleNetwork
+    rules = synthetic_rules(args.rules or 2000, distinct=args.distinct)
+    records = synthetic_records(rules, args.size)
+
+    start = time.perf_counter()
+    network = RuleNetwork(rules)
+    build_ms = (time.perf_counter() - start) * 1000
+    stats = network.stats()
+    leaves = sum(len(condition_leaves(rule["conditions"])) for rule in rules)
+    print(f"rules={len(rules)} records={len(records)} leaf tests={leaves} alpha nodes={stats['alpha_nodes']} "
+          f"indexed={stats['indexed_nodes']} group nodes={stats['group_nodes']} build {build_ms:.1f} ms")
+
+    rule_set = RuleSet(rules)
+    engines = (("independent rules", rule_set), ("network, tests", RuleNetwork(rules, indexed=False)),
+               ("network, indexed", network))
+    for name, engine in engines:
+        start = time.perf_counter()
+        matches = sum(len(engine.fire(record)) for record in records)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<18} {elapsed * 1000:>9.1f} ms   {len(records) / elapsed:>9.0f} records/s   {matches} matches")
+    print("identical matches" if list(network.run(records)) == list(rule_set.run(records)) else "MISMATCH")
+
+    # Incremental maintenance: swap a tenth of the rules out and back in without a rebuild
+    swapped = list(network.rules)[::10]
+    start = time.perf_counter()
+    for name in swapped:
+        network.remove_rule(name)
+    for name in swapped:
+        network.add_rule(rules[name], name)
+    print(f"removed and re-added {len(swapped)} rules in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+# 10k+ single-test rules of the shapes generated rule sets repeat: GPA/fine thresholds, field code
+# equality, code lists and email/name affixes. Records trigger a handful each, as in validation runs
+def indexed_rules(count, seed=3):
+    rng = random.Random(seed)
+    codes = [f"{rng.randint(1, 9)}{''.join(rng.choice('XYZ') for _ in range(4))}{i}" for i in range(count // 4)]
+    shapes = [
+        lambda: {"fact": "GPA", "operator": "lessThan", "value": round(rng.uniform(0, 1.0), 2)},
+        lambda: {"fact": "library_fine", "operator": "greaterThan", "value": rng.randint(50, 10000)},
+        lambda: {"fact": "SB11", "operator": "equal", "value": rng.choice(codes)},
+        lambda: {"fact": "SB12", "operator": "in", "value": rng.sample(codes, 5)},
+        lambda: {"fact": "email", "operator": "endsWith", "value": f"@{rng.choice(codes).lower()}.edu"},
+        lambda: {"fact": "last_name", "operator": "startsWith", "value": rng.choice(codes)[1:rng.randint(2, 5)]},
+    ]
+    return [{"conditions": shapes[i % len(shapes)](), "actions": {"message": f"rule {i}"}} for i in range(count)], codes
+
+
+def bench_index(args):
+    from rule_engine import RuleSet
+    from rule_network import RuleNetwork
+    rules, codes = indexed_rules(args.rules or 12000)
+    rng = random.Random(4)
+    records = [{
+        "GPA": round(rng.uniform(0, 4), 2), "library_fine": rng.randint(0, 500), "SB11": rng.choice(codes),
+        "SB12": rng.choice(codes), "email": f"student{i}@{rng.choice(codes).lower()}.edu",
+        "last_name": rng.choice(codes)[1:] + "son",
+    } for i in range(args.size)]
+    print(f"rules={len(rules)} records={len(records)}")
+
+    rule_set, network = RuleSet(rules), RuleNetwork(rules)
+    for name, engine in (("comparison per rule", rule_set), ("network, tests", RuleNetwork(rules, indexed=False)),
+                         ("network, indexed", network)):
+        start = time.perf_counter()
+        matches = sum(len(engine.fire(record)) for record in records)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<20} {elapsed / len(records) * 1e6:>9.1f} us/record   {matches / len(records):.1f} matches/record")
+    sample = records[:200]
+    print("identical matches" if list(network.run(sample)) == list(rule_set.run(sample)) else "MISMATCH")
+
+
+# Nightly SB field validation: the SSN/K-12 checks of hack3's examples over student records
+SB_RULES = [
+    {"conditions": {"all": [
+        {"fact": "SB01", "operator": "equal", "value": "S"},
+        {"fact": "SB00", "operator": "notInRange", "value": ["000", "666", "900-999"], "position": "1-3"},
+        {"fact": "SB00", "operator": "notEqual", "value": "00", "position": "4-5"},
+        {"fact": "SB00", "operator": "notEqual", "value": "0000", "position": "6-9"},
+    ]}, "actions": {"message": "Invalid SSN format"}},
+    {"conditions": {"any": [{"fact": "SB11", "operator": "in", "value": ["7YYYY", "7XXXX", "8YYYY", "8XXXX"]}]},
+     "actions": {"fact": "SB15", "operator": "notEqual", "value": "1"}},
+    {"conditions": {"all": [{"fact": "SB15", "operator": "equal", "value": "Y"},
+                            {"fact": "computed_age", "operator": "lessThan", "value": 22}]},
+     "actions": {"message": "Special Admit in K-12: Enrollment status must be 'Y' and age must be < 22."}},
+    {"conditions": {"fact": "SB03", "operator": "before", "value": "1900-01-01"},
+     "actions": {"message": "Birth date out of range"}},
+]
+
+
+def sb_records(size, seed=0):
+    rng = random.Random(seed)
+    return [{
+        "SB00": f"{rng.choice(['000', '666', '950', '123', '456'])}{rng.randint(0, 99):02d}{rng.randint(0, 9999):04d}",
+        "SB01": rng.choice("SSSX"),
+        "SB03": f"{rng.choice([1890, 1995, 2001, 2006])}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "SB11": rng.choice(["7YYYY", "7XXXX", "10000", "20000"]),
+        "SB15": rng.choice("Y1N"),
+        "computed_age": rng.randint(14, 30),
+    } for _ in range(size)]
+
+
+def bench_columnar(args):
+    import numpy as np
+    import pyarrow as pa
+    from rule_engine import RuleSet
+    from columnar import ColumnarRuleSet, ColumnBatch
+    records = sb_records(args.size)
+    table = pa.Table.from_pylist(records)
+    print(f"rules={len(SB_RULES)} records={len(records)}")
+
+    rule_set, columnar_rule_set = RuleSet(SB_RULES), ColumnarRuleSet(SB_RULES)
+    start = time.perf_counter()
+    row_counts = [sum(map(rule.matches, records)) for rule in rule_set.rules]
+    row_seconds = time.perf_counter() - start
+
+    # Includes the Arrow -> NumPy conversion; string/date columns are converted once and shared by rules
+    start = time.perf_counter()
+    batch = ColumnBatch.from_arrow(table)
+    column_counts = [int(np.count_nonzero(mask)) for mask in columnar_rule_set.evaluate(batch)]
+    column_seconds = time.perf_counter() - start
+    for name, seconds, counts in (("row closures", row_seconds, row_counts),
+                                  ("columnar masks", column_seconds, column_counts)):
+        print(f"{name:<15} {seconds * 1000:>9.1f} ms   {len(records) / seconds / 1e6:>6.2f} M records/s   "
+              f"matches per rule {counts}")
+    same = list(rule_set.run(records)) == list(columnar_rule_set.run(batch))
+    print("identical matches" if same else "MISMATCH")
+
+
+# Records/s of the streaming validator on one process vs sharded over 1, 2, 4, ... worker processes
+# up to the core count, on a JSONL file of SB records; the target is near-linear scaling
+def bench_sharded(args):
+    import io
+    import os
+    import tempfile
+    from record_stream import StreamValidator, record_chunks, run_sharded
+    rules, records = SB_RULES, sb_records(args.size)
+    cores = os.cpu_count() or 1
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as file:
+        for record in records:
+            file.write(json.dumps(record) + "\n")
+    print(f"rules={len(rules)} records={len(records)} cores={cores} file {os.path.getsize(file.name) >> 20} MiB")
+    try:
+        serial = io.StringIO()
+        start = time.perf_counter()
+        StreamValidator(rules).run(record_chunks(file.name), serial)
+        serial_seconds = time.perf_counter() - start
+        print(f"{'serial':<10} {serial_seconds * 1000:>9.1f} ms   {len(records) / serial_seconds:>9.0f} records/s")
+        workers = 1
+        while workers <= cores:
+            output = io.StringIO()
+            start = time.perf_counter()
+            run_sharded(file.name, rules, output, workers)
+            elapsed = time.perf_counter() - start
+            same = "identical" if output.getvalue() == serial.getvalue() else "MISMATCH"
+            print(f"{workers:>2} workers {elapsed * 1000:>9.1f} ms   {len(records) / elapsed:>9.0f} records/s   "
+                  f"speedup {serial_seconds / elapsed:.2f}x   {same}")
+            workers = workers * 2 if workers * 2 <= cores or workers == cores else cores
+    finally:
+        os.remove(file.name)
+
+
+# Loading the example dataset: json.load into dicts plus the token index (as hack4 used to) vs the
+# streaming build into compact examples, the binary snapshot, and the per-rerun cost once the dataset
+# is held by the process. Memory is what each way keeps alive afterwards
+def bench_dataset(args):
+    import os
+    import tempfile
+    import tracemalloc
+    from dataset import load_dataset, read_dataset, snapshot_path_for
+
+    def json_load():
+        with open(path, 'r') as file:
+            examples = json.load(file)
+        return examples, InvertedIndex.build(example['input'] for example in examples)
+
+    examples = synthetic_corpus(args.size)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "dataset.json")
+    with open(path, 'w') as file:
+        json.dump(examples, file)
+    del examples
+    print(f"examples={args.size} file {os.path.getsize(path) >> 10} KiB")
+    try:
+        for name, load, measure in (("json.load", json_load, True),
+                                    ("streaming", lambda: read_dataset(path, snapshot=False), True),
+                                    ("write snapshot", lambda: read_dataset(path), False),
+                                    ("snapshot", lambda: read_dataset(path), True),
+                                    ("first load", lambda: load_dataset(path), False),
+                                    ("process cache", lambda: load_dataset(path), False)):
+            start = time.perf_counter()
+            load()
+            line = f"{name:<15} {(time.perf_counter() - start) * 1000:>9.2f} ms"
+            if measure:
+                tracemalloc.start()
+                loaded = load()
+                line += f"   {tracemalloc.get_traced_memory()[0] >> 20:>5} MiB kept"
+                tracemalloc.stop()
+                del loaded
+            print(line)
+        print(f"snapshot file {os.path.getsize(snapshot_path_for(path)) >> 10} KiB")
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+# One completion over a fresh client and connection, closed afterwards: a client built per call
+async def _unpooled_completion(base_url, messages):
+    import openai
+    async with openai.AsyncOpenAI(api_key="stub", base_url=base_url, max_retries=0) as client:
+        response = await client.chat.completions.create(model="stub", messages=messages)
+    return response.choices[0].message.content
+
+
+# Rule requests/s and latency through the backends with the deterministic stub, offline: in-process
+# (the pipeline's own overhead), over localhost HTTP through the shared keep-alive pool, and with a new
+# client and connection per request. Connections counts what the stub server saw
+def bench_backends(args):
+    import asyncio
+    from llm_backends import ChatBackend, StubBackend, serve_stub
+    from prompts import format_examples, load_examples
+    messages = [{"role": "user", "content": "Examples:\n" + format_examples(load_examples()[:5])
+                 + '\nNow, convert this: "GPA below 2.0"'}]
+    server = serve_stub(port=0)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    pooled = ChatBackend("stub", base_url, "stub", max_retries=0)
+    stub = StubBackend()
+    ways = [
+        ("in-process", lambda: stub.complete(messages)),
+        ("pooled", lambda: pooled.complete(messages)),
+        ("new client", lambda: _unpooled_completion(base_url, messages)),
+    ]
+
+    async def run(call):
+        limit = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one():
+            async with limit:
+                start = time.perf_counter()
+                await call()
+                latencies.append(time.perf_counter() - start)
+        await call()  # Warm up: imports, the pool's first connection
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.queries)))
+        return time.perf_counter() - start, sorted(latencies)
+
+    print(f"requests={args.queries} concurrency={args.concurrency} prompt={len(messages[0]['content'])} chars")
+    try:
+        for name, call in ways:
+            server.connections.clear()
+            elapsed, latencies = asyncio.run(run(call))
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)] * 1000
+            connections = len(server.connections) if name != "in-process" else 0
+            print(f"{name:<12} {args.queries / elapsed:>8.0f} req/s   p50 {p50:>7.2f} ms   p99 {p99:>7.2f} ms   "
+                  f"{connections:>4} connections")
+    finally:
+        server.shutdown()
+
+
+def _unquoted(node):
+    if isinstance(node, dict):
+        return {key: _unquoted(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_unquoted(value) for value in node]
+    if isinstance(node, str) and len(node) > 1 and node[0] == node[-1] and node[0] in "'\"":
+        return node[1:-1]  # Generated datasets keep the sentence's quotes in string values
+    return node
+
+
+# Share of sentences the pattern fast path turns into a rule without a model call, how many of those
+# rules have the dataset's own conditions, and the time per sentence; over the bundled few-shot
+# examples and over --dataset (else RULE_DATASET_PATH, else the synthetic corpus)
+def bench_fastpath(args):
+    import os
+    from dataset import DATASET_PATH
+    from fast_path import fact_vocabulary, fast_rule
+    from prompts import load_examples
+    if args.dataset is None and os.path.exists(DATASET_PATH):
+        args.dataset = DATASET_PATH
+    corpora = [("bundled examples", load_examples()),
+               (os.path.basename(args.dataset) if args.dataset else "synthetic", load_corpus(args.dataset, args.size))]
+    for name, corpus in corpora:
+        facts = fact_vocabulary(corpus)  # Subjects resolve against the facts of the corpus's own examples
+        start = time.perf_counter()
+        rules = [fast_rule(example['input'], facts) for example in corpus]
+        elapsed = time.perf_counter() - start
+        matched = [(rule, example) for rule, example in zip(rules, corpus) if rule is not None]
+        same = sum(rule["conditions"] == _unquoted(example['output'].get("conditions")) for rule, example in matched)
+        print(f"{name:<18} {len(corpus):>7} sentences   coverage {len(matched) / max(len(corpus), 1):>6.1%}   "
+              f"same conditions {same / max(len(matched), 1):>6.1%}   {elapsed / max(len(corpus), 1) * 1e6:>6.1f} us/sentence")
+
+
+BENCHMARKS = {
+    "fastpath": bench_fastpath,
+    "backends": bench_backends,
+    "dataset": bench_dataset,
+    "sharded": bench_sharded,
+    "index": bench_index,
+    "network": bench_network,
+    "columnar": bench_columnar,
+    "engine": bench_engine,
+    "extract": bench_extract,
+    "prefix": bench_prefix,
+    "retrieval": bench_retrieval,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the rule generator")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--dataset", help="Dataset JSON (defaults to a synthetic corpus)")
+    parser.add_argument("--size", type=int, default=20000, help="Synthetic corpus size")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--rules", type=int, help="Rule count (engine 50, network 2000, index 12000)")
+    parser.add_argument("--distinct", type=int, default=10, help="Numeric thresholds per fact in the network benchmark")
+    parser.add_argument("--budget", type=int, default=1500, help="Few-shot token budget")
+    parser.add_argument("--concurrency", type=int, default=16, help="In-flight requests in the backends benchmark")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import asyncio
+import argparse
+import importlib
+
+MAX_RETRIES = 6
+BASE_BACKOFF = 1.0  # Seconds; doubled per retry, with jitter
+MAX_BACKOFF = 60.0
+
+
+# (id, sentence) from a TXT (one per line), CSV or JSONL file, read lazily; ids are stable for resuming.
+# Rows that hold no sentence (bad JSON, a line that is not an object, a record without the field) are
+# reported and skipped. ValueError up front when a CSV has no column named field
+def read_sentences(path, field="input"):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        with open(path, 'r', encoding='utf-8', newline='') as file:
+            header = next(csv.reader(file), None)
+        if header is not None and field not in header:
+            raise ValueError(f"{path} has no {field!r} column (columns: {', '.join(header)})")
+    return _iter_sentences(path, extension, field)
+
+
+def _iter_sentences(path, extension, field):
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        if extension == ".csv":
+            reader = csv.DictReader(file)
+            if not reader.fieldnames:
+                print(f"Skipping {path}: no header row", file=sys.stderr)
+                return
+            for row_number, row in enumerate(reader, 1):
+                if (row.get(field) or "").strip():
+                    yield row_number, row[field].strip()
+        elif extension in (".jsonl", ".ndjson"):
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as error:
+                    print(f"Skipping line {line_number}: not JSON ({error})", file=sys.stderr)
+                    continue
+                if not isinstance(record, dict):
+                    print(f"Skipping line {line_number}: not a JSON object", file=sys.stderr)
+                elif isinstance(record.get(field), str) and record[field].strip():
+                    yield line_number, record[field].strip()
+                else:
+                    print(f"Skipping line {line_number}: no {field!r} sentence", file=sys.stderr)
+        else:
+            for line_number, line in enumerate(file, 1):
+                if line.strip():
+                    yield line_number, line.strip()
+
+
+# Ids already converted in a previous run; errors, a torn last line and any line that is not a result
+# record are retried (a retried id is appended again, so readers should keep the last record per id)
+def completed_ids(output_path):
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict) or "id" not in record:
+                continue
+            output = record.get("output")
+            if isinstance(output, dict) and "error" not in output:
+                done.add(record["id"])
+    return done
+
+
+# Open the results file for appending, terminating a line torn by a crash first
+def open_checkpoint(output_path):
+    torn = False
+    if os.path.exists(output_path) and os.path.getsize(output_path):
+        with open(output_path, 'rb') as file:
+            file.seek(-1, os.SEEK_END)
+            torn = file.read(1) != b"\n"
+    output = open(output_path, 'a', encoding='utf-8')
+    if torn:
+        output.write("\n")
+    return output
+
+
+def is_rate_limit(error):
+    return getattr(error, "status_code", None) == 429 or "RateLimit" in type(error).__name__
+
+
+def is_transient(error):
+    status = getattr(error, "status_code", None)
+    return is_rate_limit(error) or (status is not None and status >= 500) or \
+        any(name in type(error).__name__ for name in ("Timeout", "Connection"))
+
+
+# Seconds the provider asked us to wait, if it said so
+def retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+# Converts sentences with a bounded number of in-flight LLM calls on one event loop;
+# a rate-limit response pauses every worker, not just the one that hit it. The only retry loop: the
+# generator's backends are built with LLM_MAX_RETRIES=0 (see main)
+class BulkRunner:
+    def __init__(self, generate, concurrency=8, max_retries=MAX_RETRIES):
+        self.generate = generate
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.paused_until = 0.0
+        self.completed = 0
+        self.failed = 0
+
+    async def _call(self, sentence):
+        for attempt in range(self.max_retries + 1):
+            delay = self.paused_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await self.generate(sentence)
+            except Exception as error:
+                if attempt == self.max_retries or not is_transient(error):
+                    raise
+                delay = retry_after(error) or min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+                delay *= 1 + random.random() * 0.25
+                if is_rate_limit(error):
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                else:
+                    await asyncio.sleep(delay)
+
+    async def _worker(self, items, output):
+        for item_id, sentence in items:
+            start = time.perf_counter()
+            try:
+                rule = await self._call(sentence)
+            except Exception as error:
+                rule = {"error": f"{type(error).__name__}: {error}"}
+            if "error" in rule:
+                self.failed += 1
+            self.completed += 1
+            record = {"id": item_id, "input": sentence, "output": rule,
+                      "elapsed": round(time.perf_counter() - start, 3)}
+            # Single event-loop thread: whole lines, flushed as each result completes
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            if self.completed % 50 == 0:
+                print(f"{self.completed} done, {self.failed} failed", file=sys.stderr)
+
+    async def run(self, items, output):
+        items = iter(items)  # Shared by all workers, so input is read lazily
+        await asyncio.gather(*(self._worker(items, output) for _ in range(self.concurrency)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a file of rule sentences to JSON rules")
+    parser.add_argument("input", help="TXT (one sentence per line), CSV or JSONL file")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results file, also the resume checkpoint")
+    parser.add_argument("--generator", choices=("hack3", "hack4"), default="hack4")
+    parser.add_argument("--field", default="input", help="CSV column / JSONL field holding the sentence")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--provider", choices=("openai", "groq", "local", "stub"),
+                        help="LLM backend (LLM_PROVIDER); stub converts offline, for load tests")
+    args = parser.parse_args()
+
+    if args.provider:
+        os.environ["LLM_PROVIDER"] = args.provider  # Read when the generator module builds its backend
+    # BulkRunner owns retries, so the SDK must not retry (and sleep past paused_until) underneath it
+    os.environ["LLM_MAX_RETRIES"] = "0"
+    generate = importlib.import_module(args.generator).agenerate_rule
+    try:
+        sentences = read_sentences(args.input, args.field)
+    except ValueError as error:
+        parser.error(str(error))
+    done = completed_ids(args.output)
+    items = ((item_id, sentence) for item_id, sentence in sentences if item_id not in done)
+    if done:
+        print(f"Resuming: {len(done)} sentences already converted", file=sys.stderr)
+
+    runner = BulkRunner(generate, args.concurrency)
+    start = time.perf_counter()
+    with open_checkpoint(args.output) as output:
+        asyncio.run(runner.run(items, output))
+    print(f"{runner.completed} converted ({runner.failed} failed) in {time.perf_counter() - start:.1f}s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
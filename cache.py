@@ -0,0 +1,320 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+
+from retrieval import InvertedIndex
+
+CACHE_PATH = os.getenv(
+    "RULE_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".rule_cache.sqlite3")
+)
+CACHE_MAX_ENTRIES = int(os.getenv("RULE_CACHE_MAX_ENTRIES", "100000"))
+CACHE_TTL = float(os.getenv("RULE_CACHE_TTL", str(30 * 24 * 3600)))  # Seconds; 0 disables expiry
+ACCESS_RESOLUTION = 60  # Seconds between LRU timestamp refreshes, so most hits are read-only
+EVICT_EVERY = 100  # Writes between eviction passes
+
+
+# Collapse whitespace and case so trivially different prompts share a cache entry
+def normalize_prompt(prompt):
+    return " ".join(prompt.lower().split())
+
+
+# Content-addressed key: normalized prompt + model + temperature + few-shot set hash
+def cache_key(prompt, model, temperature, examples_hash):
+    payload = json.dumps([normalize_prompt(prompt), model, temperature, examples_hash])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Skeleton cache scope: the cache_key fields other than the prompt, so a skeleton is only reused under
+# the same model, temperature and few-shot set
+def cache_scope(model, temperature, examples_hash):
+    payload = json.dumps([model, temperature, examples_hash])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Drop a cache table's expired rows, then the least recently used ones beyond max_entries; returns the
+# number of rows removed
+def evict_rows(conn, table, now, ttl, max_entries):
+    removed = 0
+    if ttl:
+        removed += conn.execute(f"DELETE FROM {table} WHERE created < ?", (now - ttl,)).rowcount
+    removed += conn.execute(
+        f"DELETE FROM {table} WHERE rowid IN ("
+        f"SELECT rowid FROM {table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+        (max_entries,),
+    ).rowcount
+    return removed
+
+
+# Persistent rule cache in SQLite with LRU and TTL eviction and in-process hit/miss counters
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created, accessed FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.ttl and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            if now - row[2] > ACCESS_RESOLUTION:
+                self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        evict_rows(self._conn, "responses", now, self.ttl, self.max_entries)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+
+# One cache (and SQLite connection) per path per process, shared across Streamlit reruns
+@lru_cache(maxsize=None)
+def get_response_cache(path=CACHE_PATH):
+    return ResponseCache(path)
+
+
+SKELETON_THRESHOLD = float(os.getenv("RULE_SKELETON_THRESHOLD", "0.9"))  # Token Jaccard similarity
+
+# Quoted string literals ('Nursing', "Computer Science") and bare numbers (3.0, 10000), but not codes like SB11
+LITERAL_RE = re.compile(
+    r"(?<!\w)['‘\"“]([^'’\"”]+?)['’\"”](?!\w)"
+    r"|(?<![\w.])(\d+(?:\.\d+)?)(?!\w)"
+)
+# Words that flip a rule's meaning; prompts differing in any of them never share a skeleton
+SENSITIVE_WORDS = frozenset({
+    "not", "no", "never", "less", "lower", "below", "under", "fewer", "greater", "more", "above", "over",
+    "exceeds", "exceed", "before", "after", "within", "equal", "equals", "and", "or", "starts", "ends",
+    "contains", "least", "most",
+})
+SLOT = "⟦{}⟧"  # ⟦n⟧ marks where literal n goes inside a longer string
+
+
+# Replace quoted and numeric literals with placeholders; returns (canonical text, [(kind, text), ...])
+def canonicalize(prompt):
+    literals = []
+
+    def replace(match):
+        if match.group(1) is not None:
+            literals.append(("str", match.group(1)))
+            return " <str> "
+        literals.append(("num", match.group(2)))
+        return " <num> "
+
+    return normalize_prompt(LITERAL_RE.sub(replace, prompt)), literals
+
+
+def _literal_matches(value, kind, text):
+    if kind == "num" and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value == float(text)
+    return isinstance(value, str) and value == text
+
+
+# Swap literal values in the rule for placeholders; marks each literal used in `bound`
+def _skeletonize(node, literals, bound, key=None):
+    if isinstance(node, dict):
+        return {k: v if k in ("fact", "operator") else _skeletonize(v, literals, bound, k) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_skeletonize(item, literals, bound, key) for item in node]
+    if key == "value":
+        for i, (kind, text) in enumerate(literals):
+            if _literal_matches(node, kind, text):
+                bound.add(i)
+                return {"$literal": i, "type": "str" if isinstance(node, str) else kind}
+    if isinstance(node, str):
+        # One pass over all literals (longest first) so a slot is never re-matched by a later literal
+        positions = {text: i for i, (_, text) in enumerate(literals)}
+        alternatives = "|".join(re.escape(text) for text in sorted(positions, key=len, reverse=True))
+        pattern = re.compile(r"(?<![\w.])(?:" + alternatives + r")(?!\w)")
+
+        def slot(match):
+            bound.add(positions[match.group()])
+            return SLOT.format(positions[match.group()])
+
+        node = pattern.sub(slot, node)
+    return node
+
+
+def _literal_value(kind, text):
+    if kind == "num":
+        return float(text) if "." in text else int(text)
+    return text
+
+
+# Fill a skeleton's placeholders with a new prompt's literals
+def _fill(node, literals):
+    if isinstance(node, dict):
+        if "$literal" in node:
+            return _literal_value(node["type"], literals[node["$literal"]][1])
+        return {k: _fill(v, literals) for k, v in node.items()}
+    if isinstance(node, list):
+        return [_fill(item, literals) for item in node]
+    if isinstance(node, str):
+        for i, (_, text) in enumerate(literals):
+            node = node.replace(SLOT.format(i), text)
+    return node
+
+
+# Cache tier for prompts that differ only in numbers or quoted literals: stores literal-free rule
+# skeletons keyed by canonical prompt text and re-substitutes the new literals on a match. Scoped by
+# cache_scope and bounded like ResponseCache (TTL, then LRU beyond max_entries)
+class SkeletonCache:
+    def __init__(self, path=CACHE_PATH, threshold=SKELETON_THRESHOLD, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(skeletons)")]
+        if columns and "accessed" not in columns:
+            self._conn.execute("DROP TABLE skeletons")  # Layout without timestamps, scoped by model only
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS skeletons ("
+            "scope TEXT NOT NULL, canonical TEXT NOT NULL, kinds TEXT NOT NULL, skeleton TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (scope, canonical))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS skeletons_accessed ON skeletons (accessed)")
+        # scope -> (InvertedIndex over canonical texts, [[canonical, kinds, skeleton, created, accessed]],
+        # {canonical: row id}); only scopes with rows, dropped whenever eviction removes rows
+        self._entries = {}
+
+    # Canonical texts of a scope, loaded once and indexed for near-duplicate candidate lookup; None for a
+    # scope with no rows
+    def _scope_entries(self, scope):
+        entries = self._entries.get(scope)
+        if entries is None:
+            rows = [
+                [canonical, kinds, json.loads(skeleton), created, accessed]
+                for canonical, kinds, skeleton, created, accessed in self._conn.execute(
+                    "SELECT canonical, kinds, skeleton, created, accessed FROM skeletons WHERE scope = ?", (scope,)
+                )
+            ]
+            if not rows:
+                return None
+            index = InvertedIndex.build(row[0] for row in rows)
+            entries = self._entries[scope] = (index, rows, {row[0]: i for i, row in enumerate(rows)})
+        return entries
+
+    def _best_match(self, canonical, kinds, scope, now):
+        entries = self._scope_entries(scope)
+        if entries is None:
+            return None
+        index, rows, _ = entries
+        tokens = set(canonical.split())
+        best, best_score = None, self.threshold
+        for row_id in index.search(canonical, k=5):
+            row = rows[row_id]
+            if row[1] != kinds or (self.ttl and now - row[3] > self.ttl):
+                continue
+            other_tokens = set(row[0].split())
+            if (tokens ^ other_tokens) & SENSITIVE_WORDS:
+                continue
+            score = len(tokens & other_tokens) / len(tokens | other_tokens)
+            if score >= best_score:
+                best, best_score = row, score
+        return best
+
+    def get(self, prompt, scope):
+        canonical, literals = canonicalize(prompt)
+        kinds = ",".join(kind for kind, _ in literals)
+        now = time.time()
+        with self._lock:
+            row = self._best_match(canonical, kinds, scope, now) if literals else None
+            if row is None:
+                self.misses += 1
+                return None
+            if now - row[4] > ACCESS_RESOLUTION:
+                row[4] = now
+                self._conn.execute("UPDATE skeletons SET accessed = ? WHERE scope = ? AND canonical = ?",
+                                   (now, scope, row[0]))
+            self.hits += 1
+        return _fill(row[2], literals)
+
+    # Store the skeleton of a generated rule; skipped unless every literal maps unambiguously into the rule
+    def set(self, prompt, scope, rule):
+        canonical, literals = canonicalize(prompt)
+        texts = [text for _, text in literals]
+        if not literals or len(set(texts)) != len(texts):
+            return False
+        bound = set()
+        skeleton = _skeletonize(rule, literals, bound)
+        if len(bound) != len(literals):
+            return False
+        kinds = ",".join(kind for kind, _ in literals)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO skeletons (scope, canonical, kinds, skeleton, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (scope, canonical, kinds, json.dumps(skeleton), now, now),
+            )
+            entries = self._entries.get(scope)
+            if entries is not None:
+                index, rows, positions = entries
+                if canonical in positions:
+                    rows[positions[canonical]][1:] = [kinds, skeleton, now, now]
+                else:
+                    positions[canonical] = index.add(canonical)
+                    rows.append([canonical, kinds, skeleton, now, now])
+            self._writes += 1
+            if self._writes % EVICT_EVERY == 0 and evict_rows(self._conn, "skeletons", now, self.ttl, self.max_entries):
+                self._entries.clear()  # Reloaded per scope on the next lookup, without the evicted rows
+        return True
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+@lru_cache(maxsize=None)
+def get_skeleton_cache(path=CACHE_PATH):
+    return SkeletonCache(path)
@@ -0,0 +1,429 @@
+import datetime
+
+import numpy as np
+
+from rule_engine import (
+    MISSING, ORDERING_OPERATORS, RANGE_RE, CompiledRule, compile_leaf, leaf_fact, parse_date,
+    parse_position, parse_reference, _bound, _to_number,
+)
+
+DAY = np.timedelta64(86400 * 10 ** 6, "us")
+
+
+def _to_float(value):
+    number = _to_number(value)
+    return np.nan if number is None else number
+
+
+def _to_datetime64(value):
+    if isinstance(value, str):
+        value = parse_date(value)
+    if isinstance(value, datetime.date):
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return np.datetime64(value, "us")
+    return np.datetime64("NaT", "us")
+
+
+# Fixed-width string slicing without a Python loop: view the U array as a (rows, width) grid of
+# characters, cut the column range and view it back as strings
+def slice_strings(strings, positions):
+    width = strings.dtype.itemsize // 4
+    start, stop = min(positions.start, width), min(positions.stop, width)
+    if stop <= start or not len(strings):
+        return np.full(len(strings), "", dtype="U1")
+    grid = strings.view("U1").reshape(len(strings), width)[:, start:stop]
+    return np.ascontiguousarray(grid).view(f"U{stop - start}").ravel()
+
+
+# (is all digits, integer value) per string, computed on the character codes; much faster than
+# casting the str array to int and safe on rows that are not numbers
+def digit_values(strings):
+    width = strings.dtype.itemsize // 4
+    codes = strings.view(np.uint32).reshape(len(strings), width)
+    digits = codes[:, 0] != 0
+    values = np.zeros(len(strings), dtype=np.int64)
+    for column in range(width):
+        code = codes[:, column]
+        active = code != 0
+        digits &= ~active | ((code >= 48) & (code <= 57))
+        values = np.where(active, values * 10 + (code.astype(np.int64) - 48), values)
+    return digits, values
+
+
+# Arrow string column -> U array straight from its data buffer when every value is ASCII of one width
+# (field codes, SSNs, ISO dates) and none is null; None otherwise
+def _fixed_width_strings(column):
+    import pyarrow as pa
+    array = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    if array.type != pa.string() or array.null_count or not len(array):
+        return None
+    _, offsets, data = array.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int32)[array.offset:array.offset + len(array) + 1]
+    width = int(offsets[1] - offsets[0])
+    if width == 0 or int(offsets[-1] - offsets[0]) != width * len(array) or (np.diff(offsets) != width).any():
+        return None
+    chars = np.frombuffer(data, dtype=np.uint8)[offsets[0]:offsets[-1]]
+    if (chars >= 128).any():
+        return None
+    return chars.reshape(len(array), width).astype(np.uint32).view(f"U{width}").ravel()
+
+
+# A batch of records stored as one array per fact. Type conversions (strings, numbers, dates and
+# position slices) are computed once per column and shared by every rule evaluated on the batch
+class ColumnBatch:
+    def __init__(self, columns, size=None, nulls=None):
+        self.columns = {name: np.asarray(values) for name, values in columns.items()}
+        self.size = size if size is not None else len(next(iter(self.columns.values()), ()))
+        self._nulls = nulls or {}
+        self._cache = {}
+
+    @classmethod
+    def from_records(cls, records, facts=None):
+        records = list(records)
+        if facts is None:
+            facts = sorted({fact for record in records for fact in record})
+        columns, nulls = {}, {}
+        for fact in facts:
+            values = np.empty(len(records), dtype=object)
+            values[:] = [record.get(fact, MISSING) for record in records]
+            missing = np.fromiter((value is MISSING or value is None for value in values), bool, len(records))
+            values[missing] = None
+            columns[fact], nulls[fact] = values, missing
+        return cls(columns, len(records), nulls)
+
+    # pyarrow Table or RecordBatch; Arrow nulls become missing facts. Nullable int and bool columns keep
+    # their type with the nulls filled in and held in the null mask: to_numpy would make them float64
+    # (so 10000 reads as "10000.0") or object arrays
+    @classmethod
+    def from_arrow(cls, table):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        columns, nulls = {}, {}
+        for name in table.column_names:
+            column = table.column(name)
+            strings = _fixed_width_strings(column)
+            if strings is not None:
+                columns[name] = strings
+            elif column.null_count and (pa.types.is_integer(column.type) or pa.types.is_boolean(column.type)):
+                filler = False if pa.types.is_boolean(column.type) else 0
+                columns[name] = pc.fill_null(column, filler).to_numpy(zero_copy_only=False)
+            else:
+                columns[name] = column.to_numpy(zero_copy_only=False)
+            if column.null_count:
+                nulls[name] = column.is_null().to_numpy(zero_copy_only=False)
+        return cls(columns, table.num_rows, nulls)
+
+    @classmethod
+    def from_parquet(cls, path, columns=None):
+        import pyarrow.parquet as pq
+        return cls.from_arrow(pq.read_table(path, columns=columns))
+
+    def _cached(self, kind, fact, positions, build):
+        key = (kind, fact, positions and (positions.start, positions.stop))
+        value = self._cache.get(key)
+        if value is None:
+            value = self._cache[key] = build()
+        return value
+
+    # Raw column of a fact, or None if the batch does not have it
+    def values(self, fact):
+        return self.columns.get(fact)
+
+    # Rows where the fact is present: not null in the null mask and not None, as in rule_engine. NaN and
+    # NaT are values there too, so they count as present
+    def present(self, fact):
+        def build():
+            values = self.columns.get(fact)
+            if values is None:
+                return np.zeros(self.size, dtype=bool)
+            missing = self._nulls.get(fact)
+            if missing is None:
+                if values.dtype.kind != "O":
+                    return np.ones(self.size, dtype=bool)
+                missing = np.fromiter((value is None for value in values), bool, len(values))
+            return ~missing
+        return self._cached("present", fact, None, build)
+
+    # Column as a fixed-width str array (str() of non-strings, "" where missing), optionally sliced
+    def strings(self, fact, positions=None):
+        def build():
+            if positions is not None:
+                return slice_strings(self.strings(fact), positions)
+            values = self.columns[fact]
+            if values.dtype.kind == "U":
+                return values
+            if values.dtype.kind == "O":
+                present = self.present(fact)
+                values = np.where(present, values, "")
+            return values.astype(str)
+        return self._cached("strings", fact, positions, build)
+
+    # Column as float64, NaN where missing or not numeric
+    def numbers(self, fact, positions=None):
+        def build():
+            values = self.strings(fact, positions) if positions is not None else self.columns[fact]
+            if values.dtype.kind in "iuf":
+                return values.astype(float)
+            try:
+                numbers = values.astype(float)
+            except (TypeError, ValueError):
+                numbers = np.fromiter((_to_float(value) for value in values), float, len(values))
+            if positions is None and self._nulls.get(fact) is not None:
+                numbers[self._nulls[fact]] = np.nan
+            return numbers
+        return self._cached("numbers", fact, positions, build)
+
+    # Column as datetime64[us], NaT where missing or not a date
+    def dates(self, fact):
+        def build():
+            values = self.columns[fact]
+            if values.dtype.kind == "M":
+                return values.astype("datetime64[us]")
+            dates = self._iso_dates(fact)
+            if dates is None:
+                dates = np.array([_to_datetime64(value) for value in values], dtype="datetime64[us]")
+                dates[~self.present(fact)] = np.datetime64("NaT")
+            return dates
+        return self._cached("dates", fact, None, build)
+
+    # Vectorized parse when every present value is shaped YYYY-MM-DD..., else None. NumPy alone would also
+    # read "2024" or "2024-01" as dates, which the row engine does not
+    def _iso_dates(self, fact):
+        def build():
+            present = self.present(fact)
+            strings = self.strings(fact)
+            width = strings.dtype.itemsize // 4
+            if width < 10:
+                return False
+            codes = strings.view(np.uint32).reshape(len(strings), width)[present]
+            if not ((codes[:, 4] == 45) & (codes[:, 7] == 45) & (codes[:, 9] != 0)).all():
+                return False
+            try:
+                # NumPy parses ISO dates from object arrays several times faster than from U arrays
+                dates = self.columns[fact].astype(object).astype("datetime64[us]")
+            except (TypeError, ValueError):
+                return False
+            dates[~present] = np.datetime64("NaT")
+            return dates
+        dates = self._cached("iso_dates", fact, None, build)
+        return None if dates is False else dates
+
+    # Whether every present value of the column orders as kind ("num" or "date"); decided by a
+    # whole-column cast, not the element-wise fallbacks of numbers() and dates()
+    def orders_as(self, fact, kind):
+        def build():
+            values = self.columns[fact]
+            if values.dtype.kind in "iufb":
+                return kind == "num"
+            if values.dtype.kind == "M":
+                return kind == "date"
+            if kind == "date":
+                return self._iso_dates(fact) is not None
+            try:
+                values[self.present(fact)].astype(float)
+            except (TypeError, ValueError):
+                return False
+            return True
+        return self._cached("orders_" + kind, fact, None, build)
+
+    # Row dicts holding only the given facts, for conditions with no vectorized form
+    def rows(self, facts):
+        columns = [(fact, self.columns[fact].tolist(), self.present(fact)) for fact in facts if fact in self.columns]
+        for i in range(self.size):
+            yield {fact: values[i] for fact, values, present in columns if present[i]}
+
+
+def _ordering_operands(batch, fact, positions, bound):
+    if isinstance(bound, datetime.datetime):
+        if positions is None and batch.orders_as(fact, "date"):
+            return batch.dates(fact), _to_datetime64(bound)
+        return None
+    if bound.__class__ in (int, float):
+        if positions is not None:
+            return batch.numbers(fact, positions), bound
+        if batch.orders_as(fact, "num"):
+            return batch.numbers(fact), bound
+    return None
+
+
+_COMPARE = {"lessThan": np.less, "before": np.less, "greaterThan": np.greater, "after": np.greater}
+
+
+# Vectorized form of one leaf, or None when it needs the row-at-a-time fallback
+def _leaf_mask(batch, node, fact, positions):
+    operator, value = node["operator"], node.get("value")
+    present = batch.present(fact)
+    kind = batch.values(fact).dtype.kind
+
+    if operator in ("equal", "notEqual"):
+        if isinstance(value, bool):
+            if kind != "b" or positions is not None:
+                return None  # A position slice of a bool is text, left to the row path
+            equal = batch.values(fact) == value
+        elif value.__class__ in (int, float):
+            equal = batch.numbers(fact, positions) == value
+        elif isinstance(value, str):
+            equal = batch.strings(fact, positions) == value
+        else:
+            return None
+        return present & (equal if operator == "equal" else ~equal)
+
+    if operator in _COMPARE:
+        bound, unit = _bound(value)
+        if unit != 1:
+            if kind == "m":
+                days = batch.values(fact) / DAY / unit
+            elif kind in "iuf" and positions is None:
+                days = batch.numbers(fact)
+            else:
+                return None
+            return present & _COMPARE[operator](days, bound)
+        operands = _ordering_operands(batch, fact, positions, bound)
+        return None if operands is None else present & _COMPARE[operator](*operands)
+
+    if operator in ("in", "notInRange"):
+        values = value if isinstance(value, (list, tuple)) else [value]
+        members = [item if isinstance(item, str) else str(item) for item in values]
+        strings = batch.strings(fact, positions)
+        if len(members) <= 16:
+            contains = np.zeros(len(strings), dtype=bool)
+            for member in members:
+                contains |= strings == member
+        else:
+            contains = np.isin(strings, members)
+        ranges = [RANGE_RE.match(item) for item in members]
+        ranges = [(int(m.group(1)), int(m.group(2))) for m in ranges if m and int(m.group(1)) <= int(m.group(2))]
+        if ranges:
+            digits, numbers = digit_values(strings)
+            for low, high in ranges:
+                contains |= digits & (numbers >= low) & (numbers <= high)
+        return present & (contains if operator == "in" else ~contains)
+
+    if operator in ("startsWith", "endsWith", "contains"):
+        if kind == "O" and positions is None:
+            return None  # Object columns may hold lists, which contains treats as membership
+        strings = batch.strings(fact, positions)
+        if operator == "startsWith":
+            return present & np.char.startswith(strings, str(value))
+        if operator == "endsWith":
+            return present & np.char.endswith(strings, str(value))
+        return present & (np.char.find(strings, str(value)) >= 0)
+
+    if operator == "within" and isinstance(value, (list, tuple)) and len(value) == 2:
+        low, _ = _bound(value[0])
+        high, _ = _bound(value[1])
+        low_operands = _ordering_operands(batch, fact, positions, low)
+        high_operands = _ordering_operands(batch, fact, positions, high)
+        if low_operands is None or high_operands is None:
+            return None
+        actual, low = low_operands
+        high = high_operands[1]
+        low, high = min(low, high), max(low, high)
+        return present & (actual >= low) & (actual <= high)
+    return None
+
+
+# Leaves whose value is another fact ("registration_deadline", "course_start + 7 days"), vectorized
+# when both columns order as dates or as numbers
+def _reference_mask(batch, node, fact, other, offset):
+    operator = node["operator"]
+    if operator not in ORDERING_OPERATORS or batch.values(other) is None:
+        return None
+    kinds = [kind for kind in ("num", "date") if batch.orders_as(fact, kind) and batch.orders_as(other, kind)]
+    if not kinds:
+        return None
+    kind = kinds[0]
+    if kind == "date":
+        actual, bound = batch.dates(fact), batch.dates(other) + (offset * DAY).astype("timedelta64[us]")
+    else:
+        actual, bound = batch.numbers(fact), batch.numbers(other) + offset
+    present = batch.present(fact) & batch.present(other)
+    if operator == "within":
+        start = batch.dates(other) if kind == "date" else batch.numbers(other)
+        low, high = np.minimum(start, bound), np.maximum(start, bound)
+        return present & (actual >= low) & (actual <= high)
+    return present & _COMPARE[operator](actual, bound)
+
+
+# Compile a {fact, operator, value[, position]} condition into a function from batch to row mask
+def compile_leaf_mask(node):
+    scalar = compile_leaf(node)  # Validates the operator and provides the fallback for odd cases
+    fact = leaf_fact(node)
+    positions = parse_position(node.get("position"))
+    reference = parse_reference(node["operator"], node.get("value"))
+    facts = [fact] if reference is None else [fact, reference[0]]
+
+    def leaf(batch):
+        if batch.values(fact) is None:
+            return np.zeros(batch.size, dtype=bool)
+        if reference is None:
+            mask = _leaf_mask(batch, node, fact, positions)
+        elif positions is None:
+            mask = _reference_mask(batch, node, fact, *reference)
+        else:
+            mask = None
+        if mask is None:
+            mask = np.fromiter((scalar(row) for row in batch.rows(facts)), bool, batch.size)
+        return mask
+    return leaf
+
+
+def _all_mask(children):
+    def mask(batch):
+        result = children[0](batch)
+        for child in children[1:]:
+            if not result.any():
+                break
+            result = result & child(batch)
+        return result
+    return mask
+
+
+def _any_mask(children):
+    def mask(batch):
+        result = children[0](batch)
+        for child in children[1:]:
+            if result.all():
+                break
+            result = result | child(batch)
+        return result
+    return mask
+
+
+# Compile a conditions tree into a function from a ColumnBatch to a boolean mask over its rows
+def compile_mask(node):
+    if isinstance(node, list):
+        node = {"all": node}
+    if not isinstance(node, dict):
+        raise ValueError(f"Invalid condition: {node!r}")
+    if "all" in node or "any" in node:
+        group = "all" if "all" in node else "any"
+        children = [compile_mask(child) for child in node[group]]
+        if not children:
+            return lambda batch: np.full(batch.size, group == "all")
+        return _all_mask(children) if group == "all" else _any_mask(children)
+    if "not" in node:
+        inner = compile_mask(node["not"])
+        return lambda batch: ~inner(batch)
+    return compile_leaf_mask(node)
+
+
+# Rules evaluated a whole batch at a time; same results as rule_engine.RuleSet, row for row
+class ColumnarRuleSet:
+    def __init__(self, rules):
+        self.rules = [rule if isinstance(rule, CompiledRule) else CompiledRule(rule, i) for i, rule in enumerate(rules)]
+        self.masks = [compile_mask(rule.rule["conditions"]) for rule in self.rules]
+
+    # One boolean row mask per rule
+    def evaluate(self, batch):
+        return [mask(batch) for mask in self.masks]
+
+    # Yield (row index, rule name, actions) per match, in row order like RuleSet.run
+    def run(self, batch):
+        masks = self.evaluate(batch)
+        if not masks:
+            return
+        rows, rules = np.nonzero(np.stack(masks, axis=1))
+        for row, rule in zip(rows.tolist(), rules.tolist()):
+            yield row, self.rules[rule].name, self.rules[rule].actions
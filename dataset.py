@@ -0,0 +1,199 @@
+import os
+import json
+import array
+import pickle
+import hashlib
+from functools import lru_cache
+from collections.abc import Sequence
+
+from json_utils import iter_json_array
+from retrieval import InvertedIndex, build_selector, file_fingerprint, tokenize
+
+DATASET_PATH = os.getenv("RULE_DATASET_PATH", r'C:\HACKTHON\corrected_dataset.json')
+USE_SNAPSHOT = os.getenv("RULE_DATASET_SNAPSHOT", "1") != "0"
+SNAPSHOT_VERSION = 2  # Bump when the snapshot layout changes
+READ_CHUNK = 1 << 20  # Bytes read at a time while hashing and parsing a dataset file
+DECODED_EXAMPLES = int(os.getenv("RULE_DECODED_EXAMPLES", "4096"))  # Decoded examples an ExampleStore keeps
+
+# Imported modules survive Streamlit reruns, so loaded datasets live here rather than in the app scripts
+_datasets = {}  # path -> (fingerprint, Dataset)
+
+
+# Examples kept as one blob of compact JSON with start offsets, each decoded on access. A few
+# hundred bytes per example instead of a tree of dicts, so multi-million example corpora fit; loading
+# a snapshot costs two buffer copies, and a prompt only materializes the examples its selector returns.
+# The last DECODED_EXAMPLES decoded examples are kept (LRU), so repeated retrievals stay bounded
+class ExampleStore(Sequence):
+    def __init__(self, blob=None, offsets=None, decoded=DECODED_EXAMPLES):
+        self.blob = blob if blob is not None else bytearray()
+        self.offsets = offsets if offsets is not None else array.array('q', [0])  # len + 1 offsets into blob
+        self._decode = lru_cache(maxsize=decoded)(self._load)
+
+    @classmethod
+    def pack(cls, examples):
+        store = cls()
+        for example in examples:
+            store.append(example)
+        return store
+
+    # Add an example, reusing its JSON source text when the caller has it
+    def append(self, example, text=None):
+        if text is None:
+            text = json.dumps(example, separators=(",", ":"), ensure_ascii=False)
+        self.blob += text.encode('utf-8')
+        self.offsets.append(len(self.blob))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("example index out of range")
+        return self._decode(i)
+
+    def _load(self, i):
+        return json.loads(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    # Decode every example in turn without keeping them (building other selectors, exporting)
+    def __iter__(self):
+        blob, offsets = self.blob, self.offsets
+        for i in range(len(self)):
+            yield json.loads(blob[offsets[i]:offsets[i + 1]])
+
+
+# The example corpus with what is derived from it: the inputs, their token index and any other
+# example selectors built for it (one per retrieval mode)
+class Dataset:
+    def __init__(self, examples, index, content_hash):
+        self.examples = examples
+        self.index = index
+        self.hash = content_hash
+        self._selectors = {}
+
+    @property
+    def inputs(self):
+        return [example['input'] for example in self.examples]  # ExampleStore decodes without keeping them
+
+    def __len__(self):
+        return len(self.examples)
+
+    # Example selector for a retrieval mode; the keyword index comes with the dataset, others are built once
+    def selector(self, mode, dataset_path):
+        if mode == "keyword":
+            return self.index
+        if mode not in self._selectors:
+            self._selectors[mode] = build_selector(mode, dataset_path, self.inputs)
+        return self._selectors[mode]
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(READ_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Path of the binary snapshot kept next to a dataset file
+def snapshot_path_for(dataset_path):
+    return dataset_path + ".snapshot.pickle"
+
+
+# (example, JSON source text) of a dataset file, parsed one at a time: a JSON array read incrementally,
+# or JSONL
+def iter_examples(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson"):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line), line.strip()
+        else:
+            yield from iter_json_array(file, READ_CHUNK, raw=True)
+
+
+# Build a dataset in one pass over its file: each example is indexed and packed as soon as it is
+# parsed, so memory holds the compact store and index but never the whole corpus as dicts. Postings
+# are int arrays rather than lists of ints
+def stream_dataset(path, digest):
+    examples, postings = ExampleStore(), {}
+    get = postings.get
+    for example_id, (example, text) in enumerate(iter_examples(path)):
+        if not isinstance(example, dict) or not isinstance(example.get('input'), str):
+            raise ValueError("Synthetic data should be a list of dictionaries.")
+        for token in set(tokenize(example['input'])):
+            ids = get(token)
+            if ids is None:
+                ids = postings[token] = array.array('i')
+            ids.append(example_id)
+        examples.append(example, text)
+    examples.blob = bytes(examples.blob)
+    return Dataset(examples, InvertedIndex(postings, len(examples)), digest)
+
+
+def save_snapshot(path, dataset, fingerprint):
+    examples = dataset.examples if isinstance(dataset.examples, ExampleStore) else ExampleStore.pack(dataset.examples)
+    postings = {token: ids if isinstance(ids, array.array) else array.array('i', ids)
+                for token, ids in dataset.index.postings.items()}
+    payload = {"version": SNAPSHOT_VERSION, "fingerprint": fingerprint, "hash": dataset.hash,
+               "blob": examples.blob, "offsets": examples.offsets, "postings": postings, "size": dataset.index.size}
+    temporary = path + ".tmp"
+    with open(temporary, 'wb') as file:
+        pickle.dump(payload, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)  # Readers never see a half-written snapshot
+
+
+def snapshot_dataset(payload):
+    examples = ExampleStore(payload["blob"], payload["offsets"])
+    return Dataset(examples, InvertedIndex(payload["postings"], payload["size"]), payload["hash"])
+
+
+# Snapshot payload, or None if it is missing, unreadable or from another layout version. Snapshots are
+# written by save_snapshot next to the dataset; like the dataset itself they are trusted local files
+def load_snapshot(path):
+    try:
+        with open(path, 'rb') as file:
+            payload = pickle.load(file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != SNAPSHOT_VERSION:
+        return None
+    return payload
+
+
+# Read a dataset file, from its snapshot when that was written for the same file. A snapshot whose
+# mtime/size differ is still used if the content hash matches (a touched or copied file) and then
+# re-stamped; otherwise the file is streamed into a new dataset and the snapshot rebuilt
+def read_dataset(path, snapshot=USE_SNAPSHOT):
+    fingerprint = file_fingerprint(path)
+    snapshot_path = snapshot_path_for(path)
+    payload = load_snapshot(snapshot_path) if snapshot else None
+    if payload is not None and payload["fingerprint"] == fingerprint:
+        return snapshot_dataset(payload)
+
+    digest = file_hash(path)
+    if payload is not None and payload["hash"] == digest:
+        dataset = snapshot_dataset(payload)
+    else:
+        dataset = stream_dataset(path, digest)
+    if snapshot:
+        try:
+            save_snapshot(snapshot_path, dataset, fingerprint)
+        except OSError:
+            pass  # Read-only dataset directory: keep the in-memory dataset
+    return dataset
+
+
+# The dataset at a path, loaded once per process and reloaded only when the file changes (one stat
+# per call), so Streamlit reruns do not re-parse it
+def load_dataset(path=DATASET_PATH, snapshot=USE_SNAPSHOT):
+    fingerprint = file_fingerprint(path)
+    cached = _datasets.get(path)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    dataset = read_dataset(path, snapshot)
+    _datasets[path] = (fingerprint, dataset)
+    return dataset
@@ -0,0 +1,241 @@
+import datetime
+from collections.abc import Mapping
+
+from rule_engine import MISSING, group_fact, leaf_fact, parse_date, parse_reference, _to_number
+
+
+# Computed facts, each a declared function of named input facts (base fields, context values or other
+# computed facts), plus the aggregate used for each groupBy fact
+class FactRegistry:
+    def __init__(self):
+        self.facts = {}  # name -> (inputs, function)
+        self.aggregates = {}  # fact -> function(list of values) for groupBy; sum when not registered
+
+    def register(self, name, inputs, function):
+        self.facts[name] = (tuple(inputs), function)
+
+    # Decorator form: @registry.fact("computed_age", "SB03", "as_of_date")
+    def fact(self, name, *inputs):
+        def decorate(function):
+            self.register(name, inputs, function)
+            return function
+        return decorate
+
+    def aggregate(self, fact, function):
+        self.aggregates[fact] = function
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    parsed = parse_date(str(value))  # ISO or MIS-style YYYYMMDD
+    if parsed is None:
+        raise ValueError(f"Not a date: {value!r}")
+    return parsed.date()
+
+
+# Computed facts the generated examples use; base field names follow the MIS data elements where one exists
+DERIVED_FACTS = FactRegistry()
+
+
+@DERIVED_FACTS.fact("computed_age", "SB03", "as_of_date")
+def computed_age(birth_date, as_of_date):
+    birth_date, as_of_date = _as_date(birth_date), _as_date(as_of_date)
+    return as_of_date.year - birth_date.year - ((as_of_date.month, as_of_date.day) < (birth_date.month, birth_date.day))
+
+
+@DERIVED_FACTS.fact("average_gpa_last_3_semesters", "semester_gpas")
+def average_gpa_last_3_semesters(semester_gpas):
+    recent = [_to_number(gpa) for gpa in list(semester_gpas)[-3:]]
+    return sum(recent) / len(recent) if recent and None not in recent else None
+
+
+@DERIVED_FACTS.fact("course_withdrawal_percentage", "courses_withdrawn", "courses_attempted")
+def course_withdrawal_percentage(withdrawn, attempted):
+    return 100.0 * _to_number(withdrawn) / _to_number(attempted)
+
+
+@DERIVED_FACTS.fact("course_failure_percentage", "courses_failed", "courses_attempted")
+def course_failure_percentage(failed, attempted):
+    return 100.0 * _to_number(failed) / _to_number(attempted)
+
+
+@DERIVED_FACTS.fact("time_since_enrollment", "enrollment_date", "as_of_date")
+def time_since_enrollment(enrollment_date, as_of_date):
+    return _as_date(as_of_date) - _as_date(enrollment_date)  # A timedelta compares against "6 years"
+
+
+@DERIVED_FACTS.fact("incomplete_grades", "grades")
+def incomplete_grades(grades):
+    return sum(1 for grade in grades if str(grade).upper() == "I")
+
+
+# Values fixed for one evaluation pass, so computed facts agree across the batch
+def pass_context(as_of_date=None):
+    return {"as_of_date": as_of_date or datetime.date.today()}
+
+
+# Read-only view of a record that computes registered facts on first lookup and keeps them for the rest
+# of the pass. Facts no rule asks for are never computed; a fact whose inputs are missing (or whose
+# function fails) is missing itself, so conditions on it are false
+class LazyRecord(Mapping):
+    __slots__ = ("record", "registry", "context", "groups", "_memo")
+
+    def __init__(self, record, registry=DERIVED_FACTS, context=None, groups=None):
+        self.record = record
+        self.registry = registry
+        self.context = context if context is not None else pass_context()
+        self.groups = groups
+        self._memo = {}
+
+    def _lookup(self, name):
+        value = self.record.get(name, MISSING)
+        if value is not MISSING:
+            return value
+        value = self._memo.get(name, MISSING)
+        if value is not MISSING or name in self._memo:
+            return value
+        value = self.context.get(name, MISSING)
+        if value is MISSING:
+            self._memo[name] = MISSING  # Also stops a cycle of computed facts
+            if name in self.registry.facts:
+                value = self._compute(*self.registry.facts[name])
+            elif self.groups is not None:
+                value = self.groups.lookup(name, self)
+        self._memo[name] = value
+        return value
+
+    def _compute(self, inputs, function):
+        values = [self._lookup(name) for name in inputs]
+        if any(value is MISSING or value is None for value in values):
+            return MISSING
+        try:
+            value = function(*values)
+        except (TypeError, ValueError, ArithmeticError):
+            return MISSING
+        return MISSING if value is None else value
+
+    def get(self, name, default=None):
+        value = self._lookup(name)
+        return default if value is MISSING else value
+
+    def __getitem__(self, name):
+        value = self._lookup(name)
+        if value is MISSING:
+            raise KeyError(name)
+        return value
+
+    def __contains__(self, name):
+        return self._lookup(name) is not MISSING
+
+    # Iterating materializes every computed fact; rule engines look facts up by name instead
+    def __iter__(self):
+        names = list(self.record)
+        names.extend(name for name in self.context if name not in self.record)
+        names.extend(name for name in self.registry.facts if name not in self.record and name not in self.context)
+        if self.groups is not None:
+            names.extend(self.groups.tables)
+        return (name for name in names if name in self)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+
+# Facts, fact references and groupBy (fact, key) pairs the rules read
+def rule_facts(rules):
+    facts, groups = set(), set()
+
+    def walk(node):
+        if isinstance(node, list):
+            for child in node:
+                walk(child)
+        elif isinstance(node, dict):
+            if "fact" in node and "operator" in node:
+                facts.add(leaf_fact(node))
+                reference = parse_reference(node["operator"], node.get("value"))
+                if reference is not None:
+                    facts.add(reference[0])
+                if isinstance(node.get("groupBy"), str):
+                    facts.add(node["groupBy"])
+                    groups.add((node["fact"], node["groupBy"]))
+            for group in ("all", "any", "not"):
+                if group in node:
+                    walk(node[group])
+
+    for rule in rules:
+        walk(rule["conditions"] if isinstance(rule, dict) and "conditions" in rule else rule)
+    return facts, groups
+
+
+# groupBy facts for one batch: the aggregate of a fact over every record sharing the group key,
+# computed once per batch and looked up by each record's key
+class GroupFacts:
+    def __init__(self, tables):
+        self.tables = tables  # group fact name -> (group key fact, {key value: aggregate})
+
+    @classmethod
+    def build(cls, records, pairs, registry=DERIVED_FACTS):
+        tables = {}
+        for fact, group_by in pairs:
+            values = {}
+            for record in records:
+                key, value = record.get(group_by), record.get(fact)
+                if key is not None and value is not None:
+                    values.setdefault(_group_key(key), []).append(value)
+            aggregate = registry.aggregates.get(fact, _sum)
+            table = {}
+            for key, group in values.items():
+                try:
+                    table[key] = aggregate(group)
+                except (TypeError, ValueError, ArithmeticError):
+                    pass
+            tables[group_fact(fact, group_by)] = (group_by, table)
+        return cls(tables)
+
+    def lookup(self, name, record):
+        entry = self.tables.get(name)
+        if entry is None:
+            return MISSING
+        group_by, table = entry
+        key = record.get(group_by)
+        return MISSING if key is None else table.get(_group_key(key), MISSING)
+
+
+def _group_key(value):
+    return value if isinstance(value, (str, int, float, bool, datetime.date)) else str(value)
+
+
+def _sum(values):
+    return sum(_to_number(value) for value in values)
+
+
+# Wrap one batch of records for an evaluation pass: group facts are precomputed once for the rules'
+# groupBy conditions, every other computed fact is left to lookup time
+def lazy_records(records, rules, registry=DERIVED_FACTS, context=None):
+    context = context if context is not None else pass_context()
+    lazies = [LazyRecord(record, registry, context) for record in records]
+    _, pairs = rule_facts(rules)
+    if pairs:
+        groups = GroupFacts.build(lazies, pairs, registry)
+        for lazy in lazies:
+            lazy.groups = groups
+    return lazies
+
+
+# Add the computed and groupBy facts the rules read to a columnar.ColumnBatch as columns
+def add_derived_columns(batch, rules, registry=DERIVED_FACTS, context=None):
+    import numpy as np
+    facts, _ = rule_facts(rules)
+    wanted = [fact for fact in sorted(facts) if batch.values(fact) is None]
+    if not wanted:
+        return batch
+    lazies = lazy_records(batch.rows(list(batch.columns)), rules, registry, context)
+    for fact in wanted:
+        values = [lazy.get(fact) for lazy in lazies]
+        if any(value is not None for value in values):
+            column = np.empty(len(values), dtype=object)
+            column[:] = values
+            batch.columns[fact] = column
+    return batch
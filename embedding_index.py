@@ -0,0 +1,218 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from retrieval import file_fingerprint
+from sparse_retrieval import tokenize_words
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "hashing")  # "hashing" or a sentence-transformers model name
+EMBEDDING_IVF_LISTS = int(os.getenv("EMBEDDING_IVF_LISTS", "0"))  # 0 = exact search, else number of IVF lists
+SCAN_CHUNK_ROWS = 65536  # Rows of the memory-mapped matrix scored per dot product
+
+
+# Deterministic offline embedder: signed feature hashing of word unigrams and bigrams
+class HashingEmbedder:
+    def __init__(self, dim=512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text):
+        words = tokenize_words(text)
+        return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                # blake2b rather than hash() so vectors are identical across processes
+                digest = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "little")
+                vectors[row, digest % self.dim] += 1.0 if (digest >> 63) else -1.0
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+
+# Wrapper for a sentence-transformers model (optional dependency)
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st-{model_name}"
+
+    def embed(self, texts):
+        return self.model.encode(list(texts), normalize_embeddings=True, convert_to_numpy=True).astype(np.float32)
+
+
+def get_embedder(model=None):
+    model = model or EMBEDDING_MODEL
+    if model == "hashing":
+        return HashingEmbedder()
+    return SentenceTransformerEmbedder(model)
+
+
+# Simple Lloyd's k-means on a sample of the vectors, used as the IVF coarse quantizer
+def train_centroids(vectors, num_lists, iterations=10, sample_size=50000, seed=0):
+    rng = np.random.default_rng(seed)
+    sample_ids = rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)
+    sample = np.asarray(vectors[np.sort(sample_ids)], dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for list_id in range(num_lists):
+            members = sample[assignment == list_id]
+            if len(members):
+                centroid = members.mean(axis=0)
+                centroids[list_id] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids
+
+
+# Merge a chunk of candidate (score, id) pairs into the running top-k
+def _merge_top_k(best_scores, best_ids, scores, ids, k):
+    scores = np.concatenate([best_scores, scores])
+    ids = np.concatenate([best_ids, ids])
+    if len(scores) > k:
+        keep = np.argpartition(-scores, k - 1)[:k]
+        scores, ids = scores[keep], ids[keep]
+    return scores, ids
+
+
+# Nearest-neighbour example index over embedded inputs, stored as a memory-mapped .npy matrix
+class EmbeddingIndex:
+    def __init__(self, vectors, embedder, centroids=None, list_ids=None, list_offsets=None, nprobe=8):
+        self.vectors = vectors
+        self.embedder = embedder
+        self.centroids = centroids
+        self.list_ids = list_ids
+        self.list_offsets = list_offsets
+        self.nprobe = nprobe
+        self.size = len(vectors)
+
+    @staticmethod
+    def paths(base_path):
+        return base_path + ".vectors.npy", base_path + ".meta.json", base_path + ".ivf.npz"
+
+    # Embed texts in batches, writing straight into the memory-mapped file (or memory if base_path is None)
+    @classmethod
+    def build(cls, texts, embedder, base_path=None, dtype="float16", batch_size=1024,
+              ivf_lists=0, fingerprint=None):
+        if base_path is None:
+            vectors = np.zeros((len(texts), embedder.dim), dtype=dtype)
+        else:
+            vectors_path, meta_path, ivf_path = cls.paths(base_path)
+            vectors = np.lib.format.open_memmap(
+                vectors_path, mode="w+", dtype=dtype, shape=(len(texts), embedder.dim)
+            )
+        for start in range(0, len(texts), batch_size):
+            vectors[start:start + batch_size] = embedder.embed(texts[start:start + batch_size])
+
+        ivf = {}
+        if ivf_lists and len(texts) >= ivf_lists:
+            centroids = train_centroids(vectors, ivf_lists)
+            assignment = np.concatenate([
+                np.argmax(np.asarray(vectors[start:start + SCAN_CHUNK_ROWS], dtype=np.float32) @ centroids.T, axis=1)
+                for start in range(0, len(texts), SCAN_CHUNK_ROWS)
+            ])
+            # Example ids grouped by inverted list, with list boundaries in list_offsets
+            list_ids = np.argsort(assignment, kind="stable")
+            list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=ivf_lists))])
+            ivf = {"centroids": centroids, "list_ids": list_ids, "list_offsets": list_offsets}
+
+        if base_path is not None:
+            vectors.flush()
+            if ivf:
+                np.savez(ivf_path, **ivf)
+            elif os.path.exists(ivf_path):
+                os.remove(ivf_path)
+            # Metadata last, so a crash mid-build leaves no valid-looking index behind
+            with open(meta_path, "w") as file:
+                json.dump({"embedder": embedder.name, "dim": embedder.dim, "size": len(texts),
+                           "dtype": dtype, "ivf_lists": len(ivf["centroids"]) if ivf else 0,
+                           "fingerprint": fingerprint}, file)
+            vectors = np.load(vectors_path, mmap_mode="r")
+        return cls(vectors, embedder, **ivf)
+
+    # Open a persisted index without reading the vectors into RAM; None if missing or stale
+    @classmethod
+    def open(cls, base_path, embedder, fingerprint=None, size=None, ivf_lists=None):
+        vectors_path, meta_path, ivf_path = cls.paths(base_path)
+        try:
+            with open(meta_path, "r") as file:
+                meta = json.load(file)
+            vectors = np.load(vectors_path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if meta.get("embedder") != embedder.name or meta.get("fingerprint") != fingerprint:
+            return None
+        if size is not None and meta.get("size") != size:
+            return None
+        if ivf_lists is not None and meta.get("ivf_lists") != (ivf_lists if size is None or size >= ivf_lists else 0):
+            return None
+        ivf = {}
+        if os.path.exists(ivf_path):
+            with np.load(ivf_path) as data:
+                ivf = {name: data[name] for name in ("centroids", "list_ids", "list_offsets")}
+        return cls(vectors, embedder, **ivf)
+
+    # Exact search: batched dot products over the matrix, one chunk of rows at a time
+    def _search_exact(self, queries, k):
+        best = [(np.empty(0, np.float32), np.empty(0, np.int64)) for _ in range(len(queries))]
+        for start in range(0, self.size, SCAN_CHUNK_ROWS):
+            chunk = np.asarray(self.vectors[start:start + SCAN_CHUNK_ROWS], dtype=np.float32)
+            scores = queries @ chunk.T
+            ids = np.arange(start, start + len(chunk))
+            for row in range(len(queries)):
+                best[row] = _merge_top_k(*best[row], scores[row], ids, k)
+        return best
+
+    # IVF search: score only the examples in the nprobe lists closest to each query
+    def _search_ivf(self, queries, k, nprobe):
+        nprobe = min(nprobe, len(self.centroids))
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        best = []
+        for query, lists in zip(queries, probes):
+            ids = np.concatenate([
+                self.list_ids[self.list_offsets[list_id]:self.list_offsets[list_id + 1]] for list_id in lists
+            ])
+            ids.sort()  # Sequential access into the memory map
+            scores = np.asarray(self.vectors[ids], dtype=np.float32) @ query
+            best.append(_merge_top_k(np.empty(0, np.float32), np.empty(0, np.int64), scores, ids, k))
+        return best
+
+    def search_batch(self, prompts, k=5, nprobe=None):
+        if not self.size:
+            return [[] for _ in prompts]
+        k = min(k, self.size)
+        queries = self.embedder.embed(list(prompts))
+        if self.centroids is not None:
+            best = self._search_ivf(queries, k, nprobe or self.nprobe)
+        else:
+            best = self._search_exact(queries, k)
+        results = []
+        for scores, ids in best:
+            order = np.lexsort((ids, -scores))  # Highest similarity first, earlier examples on ties
+            results.append(ids[order].tolist())
+        return results
+
+    def search(self, prompt, k=5, nprobe=None):
+        return self.search_batch([prompt], k, nprobe)[0]
+
+
+# Open the index stored next to the dataset, embedding the inputs only if it is missing or stale
+def load_or_build_embedding_index(dataset_path, texts, embedder=None, dtype="float16", ivf_lists=None):
+    embedder = embedder or get_embedder()
+    ivf_lists = EMBEDDING_IVF_LISTS if ivf_lists is None else ivf_lists
+    try:
+        fingerprint = file_fingerprint(dataset_path)
+    except OSError:
+        return EmbeddingIndex.build(texts, embedder, dtype=dtype, ivf_lists=ivf_lists)
+
+    base_path = dataset_path + ".emb"
+    index = EmbeddingIndex.open(base_path, embedder, fingerprint, size=len(texts), ivf_lists=ivf_lists)
+    if index is not None:
+        return index
+    try:
+        return EmbeddingIndex.build(texts, embedder, base_path, dtype=dtype, ivf_lists=ivf_lists,
+                                    fingerprint=fingerprint)
+    except OSError:
+        return EmbeddingIndex.build(texts, embedder, dtype=dtype, ivf_lists=ivf_lists)
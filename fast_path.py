@@ -0,0 +1,282 @@
+import os
+import re
+import json
+
+from prompts import load_examples
+from rule_repair import validate_rule
+
+# Student data element codes and their names. A sentence may name a field by its code, by its name with
+# the code ("Student Education Status (SB11)") or by its full name alone; all resolve to the code as fact.
+# RULE_FIELD_CODES names a JSON file of further {code: name} entries
+FIELD_CODES = {
+    "SB00": "Student Identifier",
+    "SB01": "Student Identifier Status",
+    "SB03": "Student Birth Date",
+    "SB11": "Student Education Status",
+    "SB12": "Student High School Last",
+    "SB15": "Student Enrollment Status",
+}
+FIELD_CODES_PATH = os.getenv("RULE_FIELD_CODES")
+# Fact names for subjects that are not just their words in snake_case
+FACT_NAMES = {
+    "this field": "field_value", "this element": "element", "computed age": "computed_age",
+    "age": "computed_age",
+}
+MAX_FACT_WORDS = 5
+
+# "Student Education Status (SB11)" -> "SB11": the capitalized words before a code in parentheses
+CODED_FIELD_RE = re.compile(r"((?:[A-Z][\w-]*\s+)*)\((SB\d{2})\)")
+SENTENCE_WORDS = frozenset({"If", "When", "Then", "The", "This", "A", "An"})  # Capitalized, but not part of a name
+PARENTHETICAL_RE = re.compile(r"\s*\([^()]*\)")
+EQUALS_RE = re.compile(r"\s*(!=|=)\s*")
+SENTENCE_RE = re.compile(r"^(?:if|when)\s+(?P<body>.+?)\.?$", re.IGNORECASE | re.DOTALL)
+CODE_RE = re.compile(r"^SB\d{2}$")
+# Sentence adverbials that may open a condition without changing it
+LEADING_RE = re.compile(
+    r"^(?:(?:currently|now|at present|as recorded(?: by the registrar)?|according to the registrar|"
+    r"for the current (?:semester|term|year)|this (?:semester|term|year))\s*,?\s+)+",
+    re.IGNORECASE,
+)
+SUBJECT_RE = re.compile(
+    r"^(?:(?:the|a|an|their)\s+)*(?:(?:student|applicant)(?:'s|s'|s)\s+)?(?P<name>.+)$", re.IGNORECASE
+)
+# "the student is a veteran" -> student_status, "the student is an international applicant" -> applicant_status
+STATUS_RE = re.compile(
+    r"^(?:the|a)\s+student\s+is\s+(?:a|an)\s+(?P<status>[a-z][a-z-]*(?:\s+[a-z][a-z-]*)??)(?:\s+(?P<noun>student|applicant))?$"
+)
+WORD_RE = re.compile(r"^[A-Za-z][A-Za-z-]*$")
+NOT_FACT_WORDS = frozenset({"is", "are", "has", "have", "does", "do", "not", "if", "then", "and", "or", "must",
+                            "than", "more", "less", "who", "which", "that"})
+VALUE_SPLIT_RE = re.compile(r"\s*,\s*(?:or\s+|and\s+)?|\s+or\s+")
+NUMBER_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+BARE_VALUE_RE = re.compile(r"^[A-Z0-9][A-Z0-9-]*$")  # Codes written without quotes: Y, S, 7YYYY, 10000
+SUFFIX_VALUE_RE = re.compile(r"^\.[A-Za-z]{2,}$")  # Domain suffixes written without quotes: .edu
+QUOTED_RE = re.compile(r"^['\"](.+)['\"]$")
+MUST_RE = re.compile(r"\bmust\s+(not\s+)?be\b")
+CODED_AS_RE = re.compile(r"\bmust\s+(?:not\s+)?be\s+coded\s+as\b")
+NESTED_RE = re.compile(r"\b(?:if|unless|when|otherwise)\b|[.;:]\s", re.IGNORECASE)
+
+# Predicates of a condition, most specific first: (operator, phrase between subject and value). "in"
+# turns into equal for a single value and notInRange when negated
+PREDICATES = [
+    ("atLeast", r"is\s+at\s+least"),
+    ("atMost", r"is\s+at\s+most|is\s+no\s+more\s+than"),
+    ("lessThan", r"(?:is\s+)?(?:less|lower|fewer)\s+than|is\s+(?:below|under)|(?:falls|drops)\s+below|below"),
+    ("greaterThan", r"(?:is\s+)?(?:greater|more|higher)\s+than|is\s+(?:above|over)|exceeds"),
+    ("startsWith", r"(?:starts|begins)\s+with"),
+    ("endsWith", r"ends\s+(?:with|in)"),
+    ("contains", r"contains(?:\s+the\s+word)?"),
+    ("notIn", r"(?:is|are)\s+not(?:\s+coded\s+as|\s+equal\s+to)?|!=|does\s+not\s+equal"),
+    ("in", r"(?:is|are)(?:\s+coded\s+as|\s+equal\s+to)?|=|equals"),
+]
+PREDICATE_RES = [(operator, re.compile(rf"^(?P<subject>.+?)\s+(?:{phrase})\s+(?P<value>.+)$", re.IGNORECASE))
+                 for operator, phrase in PREDICATES]
+INCLUSIVE = {"atLeast": "greaterThan", "atMost": "lessThan"}  # Written as any of the strict operator and equal
+
+# Imported modules survive Streamlit reruns, so the loaded code table and fact vocabulary live here rather
+# than in the app scripts
+_field_names = {}
+_default_facts = []
+
+
+# Field name (lowercase) -> code, with the RULE_FIELD_CODES entries, built once per process
+def field_names():
+    if not _field_names:
+        codes = dict(FIELD_CODES)
+        if FIELD_CODES_PATH:
+            with open(FIELD_CODES_PATH, 'r', encoding='utf-8') as file:
+                codes.update(json.load(file))
+        _field_names.update({name.lower(): code for code, name in codes.items()})
+    return _field_names
+
+
+def _collect_facts(node, facts):
+    if isinstance(node, dict):
+        if isinstance(node.get("fact"), str):
+            facts.add(node["fact"])
+        for child in node.values():
+            _collect_facts(child, facts)
+    elif isinstance(node, list):
+        for child in node:
+            _collect_facts(child, facts)
+
+
+# Facts a sentence's subjects may resolve to: the field codes, FACT_NAMES and every fact the examples'
+# rules test or set
+def fact_vocabulary(examples):
+    facts = set(FIELD_CODES) | set(field_names().values()) | set(FACT_NAMES.values())
+    for example in examples:
+        _collect_facts(example.get('output'), facts)
+    return frozenset(facts)
+
+
+# The vocabulary of the bundled examples, built once per process
+def default_facts():
+    if not _default_facts:
+        _default_facts.append(fact_vocabulary(load_examples()))
+    return _default_facts[0]
+
+
+def _code_field(match):
+    words = match.group(1).split()
+    while words and words[-1] not in SENTENCE_WORDS:
+        words.pop()
+    return " ".join(words + [match.group(2)])
+
+
+# Uniform quotes, coded field names replaced by their codes and other parenthetical remarks dropped
+def _clean(prompt):
+    text = prompt.replace("’", "'").replace("‘", "'").replace("“", '"').replace("”", '"').strip()
+    text = CODED_FIELD_RE.sub(_code_field, text)
+    previous = None
+    while previous != text:
+        previous, text = text, PARENTHETICAL_RE.sub("", text)
+    return " ".join(EQUALS_RE.sub(r" \1 ", text).split())
+
+
+# Fact for a condition's subject: a field code, a known phrase, the subject's words in snake_case
+# (acronyms such as GPA kept as written) when facts has that name, else the one fact in facts named by
+# the most of the subject's words ("declared major" -> major). None when no known fact matches, so the
+# sentence is left to the model
+def resolve_fact(subject, facts):
+    match = SUBJECT_RE.match(LEADING_RE.sub("", subject.strip()))
+    name = match.group("name").strip() if match else ""
+    if CODE_RE.match(name):
+        return name
+    lowered = name.lower()
+    code = field_names().get(lowered) or field_names().get("student " + lowered)
+    if code:
+        return code
+    if lowered in FACT_NAMES:
+        return FACT_NAMES[lowered]
+    words = name.split()
+    if not 0 < len(words) <= MAX_FACT_WORDS or not all(WORD_RE.match(word) for word in words) or \
+            NOT_FACT_WORDS & set(lowered.split()):
+        return None
+    fact = "_".join(word if word.isupper() and len(word) > 1 else word.lower() for word in words).replace("-", "_")
+    if fact in facts:
+        return fact
+    subject_words = set(lowered.replace("-", "_").replace("_", " ").split())
+    named = [(len(fact.split("_")), fact) for fact in facts if set(fact.lower().split("_")) <= subject_words]
+    named.sort(reverse=True)
+    if not named or len(named) > 1 and named[0][0] == named[1][0]:
+        return None
+    return named[0][1]
+
+
+# A literal as written: quoted text, a number or a bare code; None for anything else (words that need a
+# model to interpret)
+def parse_value(text):
+    text = text.strip()
+    match = QUOTED_RE.match(text)
+    if match:
+        return match.group(1)
+    if NUMBER_RE.match(text):
+        return float(text) if "." in text else int(text)
+    if BARE_VALUE_RE.match(text) or SUFFIX_VALUE_RE.match(text):
+        return text
+    return None
+
+
+def parse_values(text):
+    values = [parse_value(item) for item in VALUE_SPLIT_RE.split(text.strip()) if item]
+    return values if values and None not in values else None
+
+
+# One condition ("the student's GPA is less than 2.0", "SB11 is coded as 7YYYY, 7XXXX or 8XXXX") as a
+# rule leaf, or None. A domain suffix ("is '.edu'") is an endsWith test
+def parse_condition(text, facts):
+    text = LEADING_RE.sub("", text.strip())
+    match = STATUS_RE.match(text)
+    if match:
+        fact = (match.group("noun") or "student") + "_status"
+        if fact not in facts:
+            return None
+        return {"fact": fact, "operator": "equal", "value": match.group("status").replace(" ", "_")}
+    for operator, pattern in PREDICATE_RES:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        fact = resolve_fact(match.group("subject"), facts)
+        values = parse_values(match.group("value"))
+        if fact is None or values is None:
+            continue
+        if operator == "in" and len(values) == 1 and str(values[0]).startswith("."):
+            return {"fact": fact, "operator": "endsWith", "value": values[0]}
+        if operator in ("in", "notIn"):
+            if len(values) == 1:
+                return {"fact": fact, "operator": "equal" if operator == "in" else "notEqual", "value": values[0]}
+            return {"fact": fact, "operator": "in" if operator == "in" else "notInRange", "value": values}
+        if len(values) != 1:
+            continue
+        if operator in INCLUSIVE:
+            return {"any": [{"fact": fact, "operator": INCLUSIVE[operator], "value": values[0]},
+                            {"fact": fact, "operator": "equal", "value": values[0]}]}
+        return {"fact": fact, "operator": operator, "value": values[0]}
+    return None
+
+
+# A condition clause: one condition, or conditions joined by "and" (all) or by "or" (any) but not both
+def parse_conditions(text, facts):
+    leaf = parse_condition(text, facts)
+    if leaf is not None:
+        return leaf
+    for word, group in ((" and ", "all"), (" or ", "any")):
+        parts = re.split(rf",?{word}", text)
+        if len(parts) > 1:
+            leaves = [parse_condition(part, facts) for part in parts]
+            if None not in leaves:
+                return {group: leaves}
+    return None
+
+
+# The consequent as (requirement leaf or None, actions), in the forms of the bundled examples: a code
+# another field must (not) be coded as ("SB15 must not be coded as 1") is the action
+# {"fact", "operator", "value"} with the code as a string; any other requirement on another field ("the
+# student's computed age must be less than 22") is a further condition, with the sentence as the
+# message; any other single instruction is kept as the message. None when the consequent is not one of
+# these
+def parse_consequent(text, facts):
+    if NESTED_RE.search(text + " "):
+        return None
+    if MUST_RE.search(text):
+        requirement = parse_condition(MUST_RE.sub(lambda match: "is not" if match.group(1) else "is", text), facts)
+        if requirement is None or "fact" not in requirement:
+            return None
+        if CODED_AS_RE.search(text):
+            if requirement["operator"] not in ("equal", "notEqual"):
+                return None
+            return None, {"fact": requirement["fact"], "operator": requirement["operator"],
+                          "value": str(requirement["value"])}
+        return requirement, {"message": text[:1].upper() + text[1:] + "."}
+    return (None, {"message": text + "."}) if text[:1].islower() else None
+
+
+def _with_requirement(conditions, requirement):
+    if requirement is None:
+        return conditions
+    leaves = conditions["all"] if "all" in conditions else [conditions]
+    return {"all": leaves + [requirement]}
+
+
+# Rule for a sentence of a common shape ("If <conditions>, [then] <action>."), or None to leave it to the
+# model. Splits at each ", " from the right, so value lists with commas stay in the condition; a rule is
+# only returned when it passes rule_repair validation. Subjects resolve against facts (default: the
+# bundled examples' fact_vocabulary)
+def fast_rule(prompt, facts=None):
+    facts = default_facts() if facts is None else facts
+    match = SENTENCE_RE.match(_clean(prompt))
+    if match is None:
+        return None
+    body = match.group("body")
+    then = body.find(", then ")
+    splits = [then] if then >= 0 else [i.start() for i in re.finditer(", ", body)][::-1]
+    for split in splits:
+        consequent = body[split + 2:]
+        consequent = consequent[len("then "):] if consequent.startswith("then ") else consequent
+        conditions = parse_conditions(body[:split], facts)
+        parsed = parse_consequent(consequent, facts) if conditions is not None else None
+        if parsed is not None:
+            rule = {"conditions": _with_requirement(conditions, parsed[0]), "actions": parsed[1]}
+            return rule if not validate_rule(rule) else None
+    return None
@@ -1,63 +1,69 @@
 import os
-import json
-import re
-import random
+import logging
+import time
 import streamlit as st
 from dotenv import load_dotenv
-from openai import OpenAI
+from contextlib import aclosing
+from async_utils import iterate_sync, run_sync
+from json_utils import IncrementalJSONParser
+from retrieval import build_selector
+from dataset import DATASET_PATH, load_dataset
+from prompts import example_budget, examples_hash, format_examples, load_examples, pack_examples
+from cache import cache_key, cache_scope, get_response_cache, get_skeleton_cache
+from rule_schema import RULE_MAX_TOKENS, request_options, structured_mode
+from rule_repair import REPAIR_STATS, arepair_rule
+from llm_backends import make_backend
+from router import (
+    LOCAL_CONFIDENCE, LOCAL_MODEL, ROUTER_TIERS, TIER_METRICS, RuleRouter, Tier, get_template_matcher, pattern_tier,
+    template_tier,
+)
 
 # Load API key
 load_dotenv()
-API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Initialize OpenAI client
-client = OpenAI(api_key=API_KEY)
+# Initialize the LLM backend (LLM_PROVIDER, see llm_backends): OpenAI by default, over the shared
+# keep-alive connection pool
+TEMPERATURE = 0.7  # Adjust the temperature parameter
+backend = make_backend("openai", 'gpt-3.5-turbo', TEMPERATURE)
+MODEL = backend.model
+# Small local model the router tries first (ROUTER_LOCAL_MODEL at LOCAL_LLM_BASE_URL); none when unset
+local_backend = make_backend("local", LOCAL_MODEL, TEMPERATURE, override=False) \
+    if LOCAL_MODEL and "local" in ROUTER_TIERS else None
 
-# Load synthetic data from JSON file
+# Persistent response cache and near-duplicate skeleton cache, shared across reruns
+response_cache = get_response_cache()
+skeleton_cache = get_skeleton_cache()
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "keyword")  # keyword, bm25, tfidf or embedding
+MODEL_CONTEXT_WINDOW = 16385  # gpt-3.5-turbo
+# Rule output mode (STRUCTURED_OUTPUT, see rule_schema): function calling by default, so the reply is
+# the rule's JSON and nothing else, capped at RULE_MAX_TOKENS (twice the examples' p99 rule)
+STRUCTURED_OUTPUT = structured_mode()
+MAX_OUTPUT_TOKENS = RULE_MAX_TOKENS if STRUCTURED_OUTPUT != "off" else 1024  # Reserved for the completion
+EXAMPLE_TOKEN_BUDGET = int(os.getenv("EXAMPLE_TOKEN_BUDGET", "1500"))
+NUM_CANDIDATES = 20  # Ranked examples offered to the token-budget packer
+
+# Load synthetic data (RULE_DATASET_PATH); parsed once per process, from its binary snapshot when current
 try:
-    with open(r'C:\HACKTHON\corrected_dataset.json', 'r') as file:  # Use raw string or double backslashes
-        synthetic_data = json.load(file)
-        if not isinstance(synthetic_data, list):
-            raise ValueError("Synthetic data should be a list of dictionaries.")
+    dataset = load_dataset(DATASET_PATH)
+    synthetic_data = dataset.examples
 except Exception as e:
     st.error(f"Error loading synthetic data: {e}")
+    dataset = None
     synthetic_data = []
 
-# Function to extract valid JSON from LLM response
-def extract_json(text):
-    match = re.search(r"\{.*\}", text, re.DOTALL)  # Extract content between first '{' and last '}'
-    if match:
-        try:
-            return json.loads(match.group())  # Convert extracted string to JSON
-        except json.JSONDecodeError:
-            return None
-    return None
+# The example selector (token index, sparse TF-IDF/BM25 matrix or embedding index) is built once per dataset
+if dataset is not None:
+    example_index = dataset.selector(RETRIEVAL_MODE, DATASET_PATH)
+else:
+    example_index = build_selector(RETRIEVAL_MODE, DATASET_PATH, [])
 
-# Function to generate rule
-def generate_rule(prompt):
-    # Function to find relevant examples based on keyword matching
-    def find_relevant_examples(prompt, examples, num_samples=5):
-        keywords = set(prompt.lower().split())
-        scored_examples = []
-
-        for example in examples:
-            example_keywords = set(example['input'].lower().split())
-            score = len(keywords & example_keywords)  # Intersection of keywords
-            scored_examples.append((score, example))
-
-        # Sort examples by score in descending order and select top ones
-        scored_examples.sort(reverse=True, key=lambda x: x[0])
-        return [example for _, example in scored_examples[:num_samples]]
-
-    # Find relevant examples from synthetic data
-    relevant_examples = find_relevant_examples(prompt, synthetic_data)
-
-    example_texts = "\n\n".join(
-        f"Input: \"{example['input']}\"\nOutput: {json.dumps(example['output'], indent=2)}"
-        for example in relevant_examples
-    )
+# Rule templates from the bundled examples for the router's first tier, built once per process. Not
+# from the dataset: templating every example would undo the compact store's startup and memory savings
+bundled_examples = load_examples()
+template_matcher = get_template_matcher(bundled_examples, examples_hash(bundled_examples))
 
-    query = f"""
+PROMPT_TEMPLATE = """
     You are an expert with extensive experience in Business Rule Engines (BRE). Your task is to convert natural language statements into structured JSON rules. Below are some examples of how to perform this task:
 
     Examples:
@@ -68,33 +74,137 @@ def generate_rule(prompt):
     "{prompt}"
     """
 
-    response = client.chat.completions.create(
-        model='gpt-3.5-turbo',
-        messages=[{'role': 'user', 'content': query}],
-        temperature=0.7  # Adjust the temperature parameter
+# Function to build the LLM query, cache key and skeleton scope for a prompt; returns a cached rule instead when there is one
+def build_rule_request(prompt, selector=None, model=None):
+    # Find relevant examples from synthetic data via the example selector
+    selector = selector or example_index
+    candidates = [synthetic_data[i] for i in selector.search(prompt, k=NUM_CANDIDATES)]
+
+    # Fill the token budget with the best-ranked examples that fit
+    budget = example_budget(
+        MODEL_CONTEXT_WINDOW, PROMPT_TEMPLATE.format(example_texts="", prompt=prompt),
+        MAX_OUTPUT_TOKENS, EXAMPLE_TOKEN_BUDGET
     )
-    rule_text = response.choices[0].message.content.strip()
+    relevant_examples = pack_examples(candidates, budget)
+
+    # Return a stored rule for the same normalized prompt, model, temperature and few-shot set
+    model = model or MODEL
+    digest = examples_hash(relevant_examples)
+    key, scope = cache_key(prompt, model, TEMPERATURE, digest), cache_scope(model, TEMPERATURE, digest)
+    cached_rule = response_cache.get(key)
+    if cached_rule is not None:
+        return (key, scope), None, cached_rule
 
-    # Log response for debugging
-    print("LLM Response:", rule_text)
+    # Reuse the rule of a prompt that differs only in numbers or quoted literals
+    skeleton_rule = skeleton_cache.get(prompt, scope)
+    if skeleton_rule is not None:
+        response_cache.set(key, skeleton_rule)
+        return (key, scope), None, skeleton_rule
 
-    # Extract and validate JSON
-    rule_json = extract_json(rule_text)
-    if rule_json:
+    query = PROMPT_TEMPLATE.format(example_texts=format_examples(relevant_examples), prompt=prompt)
+    return (key, scope), query, None
+
+# Function to send a short repair prompt (one broken fragment, no examples) for what local repair could not fix
+async def complete_repair(query, llm=None):
+    llm = llm or backend
+    return await llm.complete([{'role': 'user', 'content': query}], temperature=0, max_tokens=RULE_MAX_TOKENS)
+
+# Function to turn the LLM response into a rule (and cache it); repairs go to the model that wrote it
+async def aparse_rule_response(prompt, keys, rule_text, llm=None):
+    llm = llm or backend
+    key, scope = keys
+    # Log response for debugging (not printed: bulk and streaming runs pass thousands of responses through here)
+    logging.debug("LLM Response: %s", rule_text)
+
+    # Extract and validate JSON, fixing what can be fixed locally before asking the model to repair it
+    rule_json, errors = await arepair_rule(rule_text, lambda query: complete_repair(query, llm), prompt)
+    if not errors:
+        response_cache.set(key, rule_json)
+        skeleton_cache.set(prompt, scope, rule_json)
         return rule_json
     else:
         return {
-            "error": "Invalid JSON response",
+            "error": "Invalid JSON response" if rule_json is None else "Invalid rule",
+            "validation_errors": errors,
             "raw_output": rule_text
         }
 
+# Function to generate a rule with one model (the hosted one unless given), through its caches
+async def agenerate_model_rule(prompt, selector=None, llm=None):
+    llm = llm or backend
+    keys, query, cached_rule = build_rule_request(prompt, selector, llm.model)
+    if cached_rule is not None:
+        return cached_rule
 
+    rule_text = await llm.complete([{'role': 'user', 'content': query}], **request_options(STRUCTURED_OUTPUT))
+    return await aparse_rule_response(prompt, keys, rule_text.strip(), llm)
 
-# Streamlit UI
-st.set_page_config(page_title="AI-Powered Business Rules Engine", layout="wide")
-st.title("AI-Powered Business Rules Engine")
+# Function to build the routing cascade: a template match, a sentence pattern when enabled, then the
+# local model when configured, then the hosted model, escalating while the rule's confidence is below
+# the tier's threshold
+def rule_router(selector=None):
+    tiers = [template_tier(template_matcher)] if "template" in ROUTER_TIERS else []
+    if "pattern" in ROUTER_TIERS:
+        tiers.append(pattern_tier())
+    if local_backend is not None:
+        tiers.append(Tier("local", lambda prompt: agenerate_model_rule(prompt, selector, local_backend),
+                          LOCAL_CONFIDENCE))
+    tiers.append(Tier("hosted", lambda prompt: agenerate_model_rule(prompt, selector), 0.0))
+    return RuleRouter(template_matcher, tiers)
 
-st.markdown("""
+# Function to generate rule without blocking the event loop
+async def agenerate_rule(prompt, selector=None):
+    rule_json, _, _ = await rule_router(selector).aroute(prompt)
+    return rule_json
+
+# Function to generate rule
+def generate_rule(prompt, selector=None):
+    return run_sync(agenerate_rule(prompt, selector))
+
+# Function to stream a rule: yields the partial rule as tokens arrive, then the final rule
+async def astream_rule(prompt, selector=None):
+    # Cheap tiers answer at once; only an escalation to the hosted model is streamed
+    router = rule_router(selector)
+    routed_rule, _, _ = await router.aroute(prompt, fallback=False)
+    if routed_rule is not None:
+        yield routed_rule
+        return
+
+    start = time.perf_counter()
+    keys, query, cached_rule = build_rule_request(prompt, selector)
+    if cached_rule is not None:
+        router.record_fallback(prompt, cached_rule, time.perf_counter() - start)
+        yield cached_rule
+        return
+
+    parser = IncrementalJSONParser()
+    last_partial = None
+    stream = backend.stream([{'role': 'user', 'content': query}], **request_options(STRUCTURED_OUTPUT))
+    async with aclosing(stream):
+        async for text in stream:
+            # Stop reading (and paying for) output once the top-level object has closed
+            if parser.feed(text):
+                break
+            partial = parser.partial()
+            if partial is not None and partial is not last_partial:
+                last_partial = partial
+                yield partial
+    rule_json = await aparse_rule_response(prompt, keys, parser.text.strip())
+    router.record_fallback(prompt, rule_json, time.perf_counter() - start)
+    yield rule_json
+
+# Function to stream a rule from synchronous code (the Streamlit script thread)
+def stream_rule(prompt, selector=None):
+    return iterate_sync(astream_rule(prompt, selector))
+
+
+
+# Streamlit UI (`streamlit run` executes the script as __main__; importing it only defines generate_rule)
+if __name__ == "__main__":
+    st.set_page_config(page_title="AI-Powered Business Rules Engine", layout="wide")
+    st.title("AI-Powered Business Rules Engine")
+
+    st.markdown("""
 <style>
     .main {
         background-color: #f0f2f6;
@@ -115,19 +225,31 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-st.subheader("Enter your rule in natural language:")
-user_prompt = st.text_area("Rule Input", label_visibility="collapsed")
+    st.subheader("Enter your rule in natural language:")
+    user_prompt = st.text_area("Rule Input", label_visibility="collapsed")
 
-if st.button("Generate Rule"):
-    if user_prompt:
-        with st.spinner("Generating rule..."):
-            rule_json = generate_rule(user_prompt)
-            st.success("Rule generated successfully!")
-            st.json(rule_json)
-    else:
-        st.warning("Please enter a rule.")
+    if st.button("Generate Rule"):
+        if user_prompt:
+            with st.spinner("Generating rule..."):
+                # Render the conditions/actions tree as it streams in
+                rule_view = st.empty()
+                for rule_json in stream_rule(user_prompt):
+                    rule_view.json(rule_json)
+                st.success("Rule generated successfully!")
+        else:
+            st.warning("Please enter a rule.")
+
+    cache_stats = response_cache.stats()
+    skeleton_stats = skeleton_cache.stats()
+    st.sidebar.caption(f"Response cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['entries']} stored)")
+    st.sidebar.caption(f"Skeleton cache: {skeleton_stats['hits']} hits / {skeleton_stats['misses']} misses")
+    for tier, stats in TIER_METRICS.stats().items():
+        st.sidebar.caption(f"Router {tier}: {stats['accepted']}/{stats['attempts']} accepted "
+                           f"({stats['hit_rate']:.0%}), p50 {stats['p50_ms']:.0f} ms, p95 {stats['p95_ms']:.0f} ms")
+    if REPAIR_STATS:
+        st.sidebar.caption("Rule validation: " + ", ".join(f"{count} {outcome}" for outcome, count in REPAIR_STATS.items()))
 
-st.markdown("""
+    st.markdown("""
 ### How It Works
 1. **Enter your rule**: Type a rule in plain English in the text area above.
 2. **Generate Rule**: Click the "Generate Rule" button to convert your input into a structured JSON rule.
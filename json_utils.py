@@ -0,0 +1,332 @@
+import re
+import ast
+import json
+
+CLOSERS = {"{": "}", "[": "]"}
+SIGNIFICANT_RE = re.compile(r'[{}"\\]')  # The only characters that change scanner state
+FENCE_RE = re.compile(r"```[ \t]*(?:json|JSON)?[ \t]*\n(.*?)```", re.DOTALL)
+OBJECT_START_RE = re.compile(r"\{\s*[\"'}]")  # An object opens with a (possibly single-quoted) key or closes empty
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+REPAIRABLE_RE = re.compile(r"'|True|False|None|[}\]]")  # Where a strict parse fails on what repair_json fixes
+STRING_OPENERS = ("{", "[", ",", ":")
+DECODER = json.JSONDecoder()
+
+
+# Single forward pass over text[start:end] giving [start, end] of every {...}, nested ones included, in
+# order of their opening brace; end is None for a brace still open at the end of the text. A '"' only
+# opens a string where JSON allows one (after {, [, "," or ":"), so a quote in prose does not hide the
+# braces after it. Jumps between significant characters instead of visiting each one
+def brace_spans(text, start=0, end=None):
+    spans = []
+    open_spans = []
+    in_string = False
+    escaped_at = -1
+    for match in SIGNIFICANT_RE.finditer(text, start, len(text) if end is None else end):
+        position = match.start()
+        char = match.group()
+        if in_string:
+            if position == escaped_at:
+                continue
+            if char == "\\":
+                escaped_at = position + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = bool(open_spans) and _previous_char(text, position, start) in STRING_OPENERS
+        elif char == "{":
+            open_spans.append(len(spans))
+            spans.append([position, None])
+        elif char == "}" and open_spans:
+            spans[open_spans.pop()][1] = position + 1
+    return spans
+
+
+# The last non-whitespace character before position (and not before start)
+def _previous_char(text, position, start):
+    position -= 1
+    while position >= start and text[position] in " \t\n\r":
+        position -= 1
+    return text[position] if position >= start else ""
+
+
+# Tolerant rewrite of almost-JSON: Python literals (True/False/None), single-quoted strings
+# and trailing commas before a closing bracket
+def repair_json(text):
+    out = []
+    i, length = 0, len(text)
+    while i < length:
+        char = text[i]
+        if char in "\"'":
+            j = i + 1
+            while j < length and text[j] != char:
+                j += 2 if text[j] == "\\" else 1
+            literal = text[i:j + 1]
+            if char == "'":
+                try:
+                    literal = json.dumps(ast.literal_eval(literal))
+                except (ValueError, SyntaxError):
+                    pass
+            out.append(literal)
+            i = j + 1
+        elif char == ",":
+            k = i + 1
+            while k < length and text[k].isspace():
+                k += 1
+            if k >= length or text[k] not in "}]":
+                out.append(char)
+            i += 1
+        elif char.isalpha() or char == "_":
+            j = i + 1
+            while j < length and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(PYTHON_LITERALS.get(word, word))
+            i = j
+        else:
+            out.append(char)
+            i += 1
+    return "".join(out)
+
+
+# Parse one JSON candidate, falling back to the repair pass; None if neither works
+def loads_tolerant(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    except RecursionError:
+        return None
+    try:
+        return json.loads(repair_json(text))
+    except (ValueError, RecursionError):
+        return None
+
+
+# (start, end, object) for the outermost spans that parse as objects, none inside another. JSON parsing is
+# context-free, so once a span fails at some offset every span opened inside it before that offset and
+# still open there fails at the same point and is skipped unparsed; with the repair pass tried at most
+# once per region, each character is parsed a bounded number of times. An open span that is a valid JSON
+# prefix up to the end is a truncated object: the braces inside it are fragments, not objects
+def _iter_objects(text, spans, end):
+    covered = failed_start = failed_at = repair_blocked = -1
+    for span_start, span_end in spans:
+        if span_start < covered or not OBJECT_START_RE.match(text, span_start):
+            continue
+        if failed_start < span_start < failed_at and (span_end is None or span_end > failed_at):
+            continue
+        try:
+            parsed, parsed_end = DECODER.raw_decode(text, span_start)
+        except RecursionError:
+            covered = end if span_end is None else span_end  # Nested too deep to be a rule, inner spans too
+            continue
+        except json.JSONDecodeError as error:
+            if span_end is None:
+                if error.pos >= end or error.msg.startswith("Unterminated string"):
+                    return
+                failed_start, failed_at = span_start, error.pos
+                continue
+            parsed, parsed_end = None, span_end
+            if span_start >= repair_blocked and REPAIRABLE_RE.match(text, error.pos):
+                parsed = loads_tolerant(text[span_start:span_end])
+                repair_blocked = span_end if parsed is None else repair_blocked
+            if not isinstance(parsed, dict):
+                failed_start, failed_at = span_start, error.pos
+                continue
+        covered = parsed_end
+        yield span_start, parsed_end, parsed
+
+
+# Parsed objects in text[start:end], in order of appearance
+def _objects_in(text, start, end):
+    end = len(text) if end is None else end
+    return [parsed for _, _, parsed in _iter_objects(text, brace_spans(text, start, end), end)]
+
+
+# Every top-level JSON object in an LLM response, ```json fenced blocks first
+def extract_json_objects(text):
+    found = []
+    for fence in FENCE_RE.finditer(text):
+        found.extend(_objects_in(text, fence.start(1), fence.end(1)))
+    return found or _objects_in(text, 0, None)
+
+
+# Function to extract valid JSON from LLM response: the first object that looks like a rule,
+# else the first object at all
+def extract_json(text):
+    objects = extract_json_objects(text)
+    for candidate in objects:
+        if "conditions" in candidate:
+            return candidate
+    return objects[0] if objects else None
+
+
+# Incremental parser for the first top-level JSON object in a token stream. Tracks string/escape
+# state and nesting as text arrives, so each chunk only scans its own characters, can render the object
+# so far with its open containers closed, and reports when the object has closed so the caller can stop
+# reading the stream
+class IncrementalJSONParser:
+    def __init__(self):
+        self.text = ""  # Everything fed so far, including any prose around the object
+        self.start = None  # Offset of the object's opening brace in text
+        self.end = None  # Offset just past its closing brace, once complete
+        self._scanned = 0
+        self._stack = []  # Open containers as [opener, offset]
+        self._closed = []  # [start, end] of the objects closed inside the open top-level one
+        self._in_string = False
+        self._escape = False
+        self._expect_key = False  # Inside an object, before the ':' of the current member
+        self._previous = ""  # Last significant character outside strings
+        self._safe_end = None  # Offset where the object so far is a valid JSON prefix once the open containers
+        # are closed; the stack only changes where a new safe offset is marked, so it is the stack there
+        self._partial = None
+        self._partial_at = None
+
+    @property
+    def complete(self):
+        return self.end is not None
+
+    # True when an object has opened but the text fed so far ends inside it
+    @property
+    def incomplete(self):
+        return self.start is not None and not self.complete
+
+    def _mark_safe(self, end):
+        self._safe_end = end
+
+    def _reset(self):
+        self.start = None
+        self._stack = []
+        self._closed = []
+        self._safe_end = None
+        self._partial = None
+        self._partial_at = None
+
+    # The top-level span closed at end: the object itself, else for braces in prose ("{like this}") the
+    # first object closed inside it; False (and a fresh start) when neither parses
+    def _close(self, end):
+        if isinstance(loads_tolerant(self.text[self.start:end]), dict):
+            self.end = end
+            return True
+        inner = next(_iter_objects(self.text, sorted(self._closed), end), None)
+        self._reset()
+        if inner is None:
+            return False
+        self.start, self.end = inner[0], inner[1]
+        return True
+
+    # Add a chunk of streamed text; returns True once the top-level object has closed
+    def feed(self, chunk):
+        self.text += chunk
+        if self.complete:
+            return True
+        text = self.text
+        for i in range(self._scanned + 1, len(text) + 1):
+            char = text[i - 1]
+            if self.start is None:
+                if char == "{":
+                    self.start = i - 1
+                    self._stack.append([char, i - 1])
+                    self._expect_key = True
+                    self._previous = char
+                    self._mark_safe(i)
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._previous = char
+                    if not self._expect_key:
+                        self._mark_safe(i)  # A complete string value
+                continue
+            if char in " \t\n\r":
+                continue
+            if char == '"':
+                self._in_string = self._previous in STRING_OPENERS
+            elif char in CLOSERS:
+                self._stack.append([char, i - 1])
+                self._expect_key = char == "{"
+                self._mark_safe(i)
+            elif char in "}]":
+                opener, offset = self._stack.pop()
+                self._expect_key = False
+                if self._stack:
+                    if opener == "{":
+                        self._closed.append([offset, i])
+                    self._mark_safe(i)
+                elif self._close(i):
+                    self._scanned = i
+                    return True
+            elif char == ",":
+                self._mark_safe(i - 1)  # The member before the comma is complete
+                self._expect_key = self._stack[-1][0] == "{"
+            elif char == ":":
+                self._expect_key = False
+            self._previous = char
+        self._scanned = len(text)
+        return False
+
+    # The complete object's text, or None while it is still open
+    def object_text(self):
+        return self.text[self.start:self.end] if self.complete else None
+
+    # The object so far as a dict, with unfinished members dropped and open containers closed
+    def partial(self):
+        if self.complete:
+            return loads_tolerant(self.object_text())
+        if self._safe_end is None or self._safe_end == self._partial_at:
+            return self._partial
+        closers = "".join(CLOSERS[opener] for opener, _ in reversed(self._stack))
+        partial = loads_tolerant(self.text[self.start:self._safe_end] + closers)
+        if partial is not None:
+            self._partial, self._partial_at = partial, self._safe_end
+        return self._partial
+
+
+# Elements of a top-level JSON array read from a text file chunk by chunk, each decoded as soon as the
+# buffer holds all of it, so only one chunk and one element are in memory at a time. With raw, yields
+# (element, its source text)
+def iter_json_array(file, chunk_size=1 << 20, raw=False):
+    buffer, position, eof = "", 0, False
+
+    # Skip whitespace, reading more until a significant character (or the end of the file) is in view
+    def significant():
+        nonlocal buffer, position, eof
+        while True:
+            position = WHITESPACE_RE.match(buffer, position).end()
+            if position < len(buffer) or eof:
+                return buffer[position] if position < len(buffer) else ""
+            more = file.read(chunk_size)
+            buffer, position, eof = buffer[position:] + more, 0, not more
+
+    if significant() != "[":
+        raise ValueError("Expected a JSON array")
+    position += 1
+    if significant() == "]":
+        return
+    while True:
+        significant()
+        try:
+            value, end = DECODER.raw_decode(buffer, position)
+            # A number cut by the buffer's end parses too ("12" of "125", "-1" of "-1.5"): a value is
+            # only complete once the delimiter after it is in view
+            complete = eof or (end < len(buffer) and buffer[end] in ",] \t\n\r")
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            complete = False
+        if not complete:
+            more = file.read(chunk_size)
+            buffer, position, eof = buffer[position:] + more, 0, not more
+            continue
+        yield (value, buffer[position:end]) if raw else value
+        position = end
+        delimiter = significant()
+        if delimiter == "]":
+            return
+        if delimiter != ",":
+            raise ValueError(f"Expected ',' or ']' in JSON array, found {delimiter!r}")
+        position += 1
@@ -0,0 +1,221 @@
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import openai
+from async_utils import PerLoop
+from rule_schema import delta_text, message_text
+
+# Provider -> (base URL environment variable, default base URL, API key environment variable). Every
+# HTTP provider is reached through its OpenAI-compatible chat completions endpoint
+PROVIDERS = {
+    "openai": ("OPENAI_BASE_URL", None, "OPENAI_API_KEY"),
+    "groq": ("GROQ_API_BASE", "https://api.groq.com", "GROQ_API_KEY"),  # SDK-style base; /openai/v1 is added
+    "local": ("LOCAL_LLM_BASE_URL", "http://127.0.0.1:8700/v1", "LOCAL_LLM_API_KEY"),  # vLLM, llama.cpp, stub server
+}
+STUB_RULE = {"conditions": {"fact": "GPA", "operator": "lessThan", "value": 2.0}, "actions": {"message": "probation"}}
+OUTPUT_RE = re.compile(r"^\s*Output: (\{.*\})\s*$", re.MULTILINE)  # A few-shot example's rule (prompts.format_example)
+
+
+# Settings are read when a backend or pool is built rather than at import, so the apps' load_dotenv applies
+def _setting(name, default):
+    return float(os.getenv(name, default))
+
+
+# One keep-alive connection pool per event loop, shared by every HTTP backend on that loop
+def _http_client():
+    limits = type(openai.DEFAULT_CONNECTION_LIMITS)(  # The Limits class of the SDK's HTTP client
+        max_connections=int(_setting("LLM_MAX_CONNECTIONS", 64)),
+        max_keepalive_connections=int(_setting("LLM_MAX_KEEPALIVE", 32)),
+        keepalive_expiry=_setting("LLM_KEEPALIVE_EXPIRY", 60),
+    )
+    return openai.DefaultAsyncHttpxClient(limits=limits, timeout=request_timeout())
+
+
+http_clients = PerLoop(_http_client)
+
+
+# LLM_TIMEOUT seconds for a whole read, LLM_CONNECT_TIMEOUT to open a connection
+def request_timeout():
+    return openai.Timeout(_setting("LLM_TIMEOUT", 60), connect=_setting("LLM_CONNECT_TIMEOUT", 5))
+
+
+# An OpenAI-compatible chat completions endpoint. Retries of connection errors, 408/409/429 and 5xx
+# responses (LLM_MAX_RETRIES, exponential backoff honouring Retry-After) are left to the SDK
+class ChatBackend:
+    def __init__(self, model, base_url=None, api_key=None, temperature=0, max_retries=None):
+        self.model = model
+        self.base_url = base_url
+        self.temperature = temperature
+        max_retries = int(_setting("LLM_MAX_RETRIES", 2)) if max_retries is None else max_retries
+        self.clients = PerLoop(lambda: openai.AsyncOpenAI(
+            api_key=api_key, base_url=base_url, http_client=http_clients.get(), timeout=request_timeout(),
+            max_retries=max_retries,
+        ))
+
+    # Text of one completion: the forced tool call's arguments, else the content
+    async def complete(self, messages, **options):
+        options.setdefault("temperature", self.temperature)
+        response = await self.clients.get().chat.completions.create(model=self.model, messages=messages, **options)
+        return message_text(response.choices[0].message)
+
+    # Text fragments of a streamed completion. Closing the generator (contextlib.aclosing) closes the
+    # response, so a caller that stops early stops the generation too
+    async def stream(self, messages, **options):
+        options.setdefault("temperature", self.temperature)
+        stream = await self.clients.get().chat.completions.create(
+            model=self.model, messages=messages, stream=True, **options
+        )
+        try:
+            async for chunk in stream:
+                text = delta_text(chunk.choices[0].delta) if chunk.choices else ""
+                if text:
+                    yield text
+        finally:
+            await stream.close()
+
+
+# Deterministic offline backend for load tests and benchmarks: answers with the first example output in
+# the prompt (the best-ranked few-shot example) or STUB_RULE, after STUB_LATENCY seconds, streamed in
+# STUB_CHUNK-character pieces. Its model name keeps stub rules out of the real models' cache entries
+class StubBackend:
+    def __init__(self, model="stub", temperature=0, latency=None, chunk_size=None):
+        self.model = model
+        self.temperature = temperature
+        self.latency = _setting("STUB_LATENCY", 0) if latency is None else latency
+        self.chunk_size = int(_setting("STUB_CHUNK", 8)) if chunk_size is None else chunk_size
+        self.requests = 0
+
+    def reply(self, messages):
+        self.requests += 1
+        match = OUTPUT_RE.search(messages[-1]["content"])
+        return match.group(1) if match else json.dumps(STUB_RULE)
+
+    async def complete(self, messages, **options):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.reply(messages)
+
+    async def stream(self, messages, **options):
+        text = await self.complete(messages)
+        for i in range(0, len(text), self.chunk_size):
+            yield text[i:i + self.chunk_size]
+
+
+# The backend for an app: LLM_PROVIDER (openai, groq, local or stub) overrides the app's provider,
+# LLM_MODEL its model and LLM_BASE_URL the provider's endpoint. Without override (a second, fixed tier
+# such as the router's local model) only LLM_PROVIDER=stub applies, so offline runs stub every backend
+def make_backend(provider, model, temperature=0, override=True):
+    if override:
+        provider = os.getenv("LLM_PROVIDER", provider)
+        model = os.getenv("LLM_MODEL", model)
+    elif os.getenv("LLM_PROVIDER") == "stub":
+        provider = "stub"
+    if provider == "stub":
+        return StubBackend(temperature=temperature)
+    if provider not in PROVIDERS:
+        raise ValueError(f"Unknown LLM_PROVIDER: {provider}")
+    url_variable, default_url, key_variable = PROVIDERS[provider]
+    base_url = os.getenv(url_variable, default_url)
+    if provider == "groq":
+        base_url = base_url.rstrip("/") + "/openai/v1"
+    if override:
+        base_url = os.getenv("LLM_BASE_URL", base_url)
+    api_key = os.getenv(key_variable) or ("not-needed" if provider == "local" else None)
+    return ChatBackend(model, base_url, api_key, temperature)
+
+
+# OpenAI-compatible HTTP front for a StubBackend: chat completions as content, or as a tool call when the
+# request offers tools, and as server-sent events when streamed. HTTP/1.1 with lengths on every response,
+# so clients keep their connections alive as they would with a real provider
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # Headers and body are separate writes; don't wait on the client's ACK
+    backend = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        self.server.connections.add(self.client_address)
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        text = self.backend.reply(body["messages"])
+        tool = body["tools"][0]["function"]["name"] if body.get("tools") else None
+        created, model = int(time.time()), body.get("model", self.backend.model)
+        if body.get("stream"):
+            events = []
+            for i in range(0, len(text), self.backend.chunk_size):
+                piece = text[i:i + self.backend.chunk_size]
+                if tool is None:
+                    delta = {"content": piece}
+                else:
+                    delta = {"tool_calls": [{"index": 0, "function": {"arguments": piece}}]}
+                    if i == 0:
+                        delta["tool_calls"][0].update(id="call_stub", type="function")
+                        delta["tool_calls"][0]["function"]["name"] = tool
+                chunk = {"id": "stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                events.append(f"data: {json.dumps(chunk)}\n\n")
+            events.append("data: [DONE]\n\n")
+            self._send("text/event-stream", "".join(events).encode())
+            return
+        if tool is None:
+            message = {"role": "assistant", "content": text}
+        else:
+            message = {"role": "assistant", "content": None, "tool_calls": [
+                {"id": "call_stub", "type": "function", "function": {"name": tool, "arguments": text}}]}
+        prompt_tokens = sum(len(str(item.get("content") or "")) for item in body["messages"]) // 4
+        response = {"id": "stub", "object": "chat.completion", "created": created, "model": model,
+                    "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(text) // 4,
+                              "total_tokens": prompt_tokens + len(text) // 4}}
+        self._send("application/json", json.dumps(response).encode())
+
+    def _send(self, content_type, data):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # Listen backlog; the default 5 drops connection bursts from a load test
+
+
+# Start the stub server on a daemon thread; port 0 picks a free port (server.server_address[1]).
+# server.connections collects the client addresses seen, to check that connections are reused
+def serve_stub(host="127.0.0.1", port=8700, backend=None):
+    handler = type("StubHandler", (_StubHandler,), {"backend": backend or StubBackend()})
+    server = _StubServer((host, port), handler)
+    server.connections = set()
+    threading.Thread(target=server.serve_forever, name="llm-stub-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the deterministic stub LLM over an OpenAI-compatible API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--latency", type=float, help="Seconds per request (default STUB_LATENCY or 0)")
+    args = parser.parse_args()
+    server = serve_stub(args.host, args.port, StubBackend(latency=args.latency))
+    host, port = server.server_address[:2]
+    print(f"Stub LLM on http://{host}:{port}/v1 (LLM_PROVIDER=local LOCAL_LLM_BASE_URL=...)", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import json
+import hashlib
+from functools import lru_cache
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "examples.json")
+EXAMPLE_SEPARATOR = "\n\n"
+
+# Imported modules survive Streamlit reruns, so these caches live here rather than in the app scripts
+_prefix_cache = {}
+
+
+# Stable content hash of an example set (key order and whitespace do not matter)
+def examples_hash(examples):
+    payload = json.dumps(list(examples), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Load a few-shot example corpus (and its content hash) once per process
+@lru_cache(maxsize=None)
+def _load_examples(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        examples = tuple(json.load(file))
+    return examples, examples_hash(examples)
+
+
+def load_examples(path=EXAMPLES_PATH):
+    return list(_load_examples(path)[0])
+
+
+# Render one example as "Input: ... / Output: ..." with compact (no indent) JSON
+def format_example(example):
+    output = json.dumps(example['output'], separators=(",", ":"), ensure_ascii=False)
+    return f"Input: \"{example['input']}\"\nOutput: {output}"
+
+
+# Render examples as the few-shot block
+def format_examples(examples):
+    return EXAMPLE_SEPARATOR.join(format_example(example) for example in examples)
+
+
+# Greedily fill a token budget with examples, taken in the given (best-first) order;
+# an example that does not fit is skipped so smaller lower-ranked ones can still fill the gap
+def pack_examples(examples, budget):
+    packed, used = [], 0
+    separator_tokens = count_tokens(EXAMPLE_SEPARATOR)
+    for example in examples:
+        cost = count_tokens(format_example(example)) + (separator_tokens if packed else 0)
+        if used + cost <= budget:
+            packed.append(example)
+            used += cost
+    return packed
+
+
+# Tokens left for examples once the fixed prompt text and the reserved completion are accounted for
+def example_budget(context_window, fixed_text, max_output_tokens, limit=None):
+    available = context_window - count_tokens(fixed_text) - max_output_tokens
+    return max(0, available if limit is None else min(limit, available))
+
+
+# Serialize a prompt prefix once per (template, example content, budget); returns the prefix and its hash
+def _compiled_prefix(template, examples, digest=None, budget=None):
+    key = (template, digest or examples_hash(examples), budget)
+    compiled = _prefix_cache.get(key)
+    if compiled is None:
+        if budget is not None:
+            examples = pack_examples(examples, budget)
+        prefix = template.format(example_texts=format_examples(examples))
+        compiled = _prefix_cache[key] = (prefix, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+    return compiled
+
+
+# The same prefix string on every call for the same template, examples and budget
+def compile_prefix(template, examples, digest=None, budget=None):
+    return _compiled_prefix(template, examples, digest, budget)[0]
+
+
+# Precompiled prefix for a corpus file plus the prefix hash (no per-call serialization or hashing)
+def load_prefix(template, path=EXAMPLES_PATH, budget=None):
+    examples, digest = _load_examples(path)
+    return _compiled_prefix(template, examples, digest, budget)
+
+
+# Local tokenizer: tiktoken when installed and its encoding is available (it downloads on first use)
+@lru_cache(maxsize=None)
+def _get_encoding(encoding_name):
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(encoding_name)
+    except Exception:
+        return None
+
+
+# Count prompt tokens with the local tokenizer, else approximate at ~4 characters per token
+def count_tokens(text, encoding_name="cl100k_base"):
+    encoding = _get_encoding(encoding_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
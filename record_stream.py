@@ -0,0 +1,312 @@
+import os
+import io
+import sys
+import csv
+import json
+import mmap
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+import multiprocessing
+
+from rule_engine import RuleSet
+from rule_network import RuleNetwork
+from derived_facts import DERIVED_FACTS, LazyRecord, pass_context, rule_facts
+
+CHUNK_BYTES = 4 << 20  # JSONL bytes parsed per chunk
+CHUNK_ROWS = 20000  # CSV rows per chunk
+SHARD_BYTES = 1 << 20  # Smallest shard worth sending to a worker
+SHARDS_PER_WORKER = 4  # More shards than workers keeps every core busy until the end
+
+
+# Read-only map of a whole file, or None for an empty one (mmap cannot map zero bytes)
+def map_file(file):
+    if not os.fstat(file.fileno()).st_size:
+        return None
+    return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Yield lists of (line number, record) from a JSONL file, cutting the mapped bytes at the last newline
+# of each CHUNK_BYTES window so only one chunk of parsed records is alive at a time. start/end bound
+# one shard (see shard_ranges), whose first line is line_number + 1
+def jsonl_chunks(path, chunk_bytes=CHUNK_BYTES, start=0, end=None, line_number=0):
+    with open(path, 'rb') as file:
+        data = map_file(file)
+        if data is None:
+            return
+        with data:
+            size = len(data) if end is None else end
+            while start < size:
+                stop = min(start + chunk_bytes, size)
+                if stop < size:
+                    cut = data.rfind(b"\n", start, stop)
+                    stop = cut + 1 if cut >= start else (data.find(b"\n", stop) + 1 or size)  # One line over a chunk
+                lines = data[start:stop].split(b"\n")
+                chunk = list(_parse_lines(lines, line_number))
+                line_number += len(lines) - 1  # The piece after the chunk's final newline is empty
+                start = stop
+                if chunk:
+                    yield chunk
+
+
+# (line number, record) for the JSON object lines among lines, the first being line_number + 1; other
+# lines are reported and skipped rather than ending the run
+def _parse_lines(lines, line_number):
+    for line_number, line in enumerate(lines, line_number + 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            print(f"Skipping line {line_number}: not JSON ({error})", file=sys.stderr)
+            continue
+        if isinstance(record, dict):
+            yield line_number, record
+        else:
+            print(f"Skipping line {line_number}: not a JSON object", file=sys.stderr)
+
+
+# Yield lists of (row number, record) from a CSV file with a header row. Quoted fields may span lines,
+# so rows come from a csv reader over the mapped file rather than from byte windows. Empty cells are
+# left out of the record, so conditions on them see a missing fact. start/end bound one shard of
+# single-line rows after the header
+def csv_chunks(path, chunk_rows=CHUNK_ROWS, start=0, end=None, row_number=0):
+    with open(path, 'rb') as file:
+        data = map_file(file)
+        if data is None:
+            return
+        with data:
+            reader = _csv_reader(data, 0, len(data))
+            header = next(reader, None)
+            if header is None:
+                return
+            if start:
+                reader = _csv_reader(data, start, end)
+            chunk = []
+            for row_number, row in enumerate(reader, row_number + 1):
+                chunk.append((row_number, {name: value for name, value in zip(header, row) if value != ""}))
+                if len(chunk) == chunk_rows:
+                    yield chunk
+                    chunk = []
+            if chunk:
+                yield chunk
+
+
+def _csv_reader(data, start, end):
+    raw = _MappedReader(data, start, len(data) if end is None else end)
+    return csv.reader(io.TextIOWrapper(raw, encoding='utf-8-sig' if not start else 'utf-8', newline=''))
+
+
+# Minimal raw-stream view of part of an mmap for TextIOWrapper (mmap itself has no readinto/readable)
+class _MappedReader(io.RawIOBase):
+    def __init__(self, data, start, end):
+        self.data = data
+        self.position = start
+        self.end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self.end - self.position)
+        buffer[:count] = self.data[self.position:self.position + count]
+        self.position += count
+        return count
+
+
+def record_chunks(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        return csv_chunks(path)
+    if extension in (".jsonl", ".ndjson"):
+        return jsonl_chunks(path)
+    raise ValueError(f"Unsupported record file (expected .csv or .jsonl): {path}")
+
+
+# Generated rules from a JSON file (one rule or a list) or a JSONL file of rules or bulk.py results;
+# results that failed to convert, and JSONL lines that are not JSON objects, are skipped
+def load_rules(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        if os.path.splitext(path)[1].lower() in (".jsonl", ".ndjson"):
+            items = [record for _, record in _parse_lines(file, 0)]
+        else:
+            items = json.load(file)
+    rules = []
+    for position, item in enumerate(items if isinstance(items, list) else [items], 1):
+        rule = item.get("output", item) if isinstance(item, dict) and "conditions" not in item else item
+        if isinstance(rule, dict) and "conditions" in rule:
+            rule = dict(rule)
+            rule.setdefault("name", item.get("id", position) if isinstance(item, dict) else position)
+            rules.append(rule)
+    return rules
+
+
+# The text a matched rule reports: actions.message, else the actions themselves
+def action_message(actions):
+    if isinstance(actions, dict) and "message" in actions:
+        return actions["message"]
+    return actions
+
+
+# Evaluate the rules over every record of a file, writing one JSONL line per (record, matched rule)
+# as each chunk finishes. Memory holds one chunk of records, whatever the file size. groupBy rules need
+# every record of a group at once, so they are refused rather than left to never match
+class StreamValidator:
+    def __init__(self, rules, engine="compiled", key=None, include_record=False, derived=True, as_of_date=None):
+        _, groups = rule_facts(rules)
+        if groups:
+            grouped = ", ".join(sorted(f"{fact} by {group_by}" for fact, group_by in groups))
+            raise ValueError(f"groupBy conditions cannot be checked one record at a time: {grouped}")
+        self.rules = RuleNetwork(rules) if engine == "network" else RuleSet(rules)
+        self.key = key  # Record field copied into each violation to identify the record
+        self.include_record = include_record
+        self.derived = derived  # Look up derived_facts computed facts (computed_age, ...) on demand
+        self.context = pass_context(as_of_date)
+        self.records = 0
+        self.violations = 0
+
+    def _violations(self, chunk):
+        for number, record in chunk:
+            if self.derived:
+                record = LazyRecord(record, DERIVED_FACTS, self.context)
+            for name, actions in self.rules.fire(record):
+                violation = {"record": number, "rule": name, "message": action_message(actions)}
+                if self.key is not None:
+                    violation["key"] = record.get(self.key)
+                if self.include_record:
+                    violation["data"] = dict(record.record if self.derived else record)
+                yield violation
+
+    def run(self, chunks, output):
+        for chunk in chunks:
+            lines = [json.dumps(violation, ensure_ascii=False, default=str) + "\n"
+                     for violation in self._violations(chunk)]
+            output.writelines(lines)
+            output.flush()
+            self.records += len(chunk)
+            self.violations += len(lines)
+        return self.violations
+
+
+# Split a record file into about `shards` byte ranges ending at newlines, as (start, end) pairs. CSV
+# shards start after the header and assume no quoted field spans lines
+def shard_ranges(path, shards, min_bytes=SHARD_BYTES):
+    with open(path, 'rb') as file:
+        data = map_file(file)
+        if data is None:
+            return []
+        with data:
+            size = len(data)
+            start = 0
+            if os.path.splitext(path)[1].lower() == ".csv":
+                start = data.find(b"\n") + 1
+                if not start:
+                    return []  # Header only
+            step = max(min_bytes, -(-(size - start) // max(1, shards)))
+            ranges = []
+            while start < size:
+                end = size if start + step >= size else data.find(b"\n", start + step - 1) + 1 or size
+                ranges.append((start, end))
+                start = end
+            return ranges
+
+
+# Per-worker state: the rule set is compiled once by the pool initializer, not shipped with each task
+_validator = None
+
+
+def _start_worker(rules, engine, key, include_record, as_of_date):
+    global _validator
+    _validator = StreamValidator(rules, engine, key, include_record, as_of_date=as_of_date)
+
+
+def _count_lines(task):
+    path, start, end = task
+    with open(path, 'rb') as file, map_file(file) as data:
+        count = 0
+        for position in range(start, end, CHUNK_BYTES):
+            count += data[position:min(position + CHUNK_BYTES, end)].count(b"\n")
+        return count
+
+
+def _run_shard(task):
+    path, start, end, number, output_path = task
+    if os.path.splitext(path)[1].lower() == ".csv":
+        chunks = csv_chunks(path, start=start, end=end, row_number=number)
+    else:
+        chunks = jsonl_chunks(path, start=start, end=end, line_number=number)
+    records, violations = _validator.records, _validator.violations
+    with open(output_path, 'w', encoding='utf-8') as output:
+        _validator.run(chunks, output)
+    return _validator.records - records, _validator.violations - violations
+
+
+# StreamValidator over a process pool. Workers map the record file themselves and read their own byte
+# ranges, so records are never pickled; they count the lines before each shard first so record numbers
+# match a serial run. Shard outputs are appended in file order as they complete, giving the same
+# output as a serial run line for line. Returns (records, violations)
+def run_sharded(path, rules, output, workers=None, engine="compiled", key=None, include_record=False,
+                as_of_date=None):
+    workers = workers or os.cpu_count() or 1
+    ranges = shard_ranges(path, workers * SHARDS_PER_WORKER)
+    if not ranges:
+        return 0, 0
+    as_of_date = pass_context(as_of_date)["as_of_date"]  # One date for every worker
+    directory = tempfile.mkdtemp(prefix="record_stream-")
+    records = violations = 0
+    try:
+        with multiprocessing.Pool(workers, _start_worker, (rules, engine, key, include_record, as_of_date)) as pool:
+            counts = pool.map(_count_lines, [(path, start, end) for start, end in ranges])
+            numbers = itertools.accumulate(counts, initial=0)
+            tasks = [(path, start, end, number, os.path.join(directory, f"{i}.jsonl"))
+                     for i, ((start, end), number) in enumerate(zip(ranges, numbers))]
+            for task, (shard_records, shard_violations) in zip(tasks, pool.imap(_run_shard, tasks)):
+                with open(task[-1], 'r', encoding='utf-8') as shard:
+                    shutil.copyfileobj(shard, output)
+                output.flush()
+                os.remove(task[-1])
+                records += shard_records
+                violations += shard_violations
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return records, violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a large CSV/JSONL record file against generated rules")
+    parser.add_argument("records", help="CSV (with a header row) or JSONL record file")
+    parser.add_argument("-r", "--rules", required=True, help="JSON rule(s) or JSONL rules / bulk.py results")
+    parser.add_argument("-o", "--output", help="JSONL violations file (default: stdout)")
+    parser.add_argument("--engine", choices=("compiled", "network"), default="compiled",
+                        help="network shares tests across many rules")
+    parser.add_argument("--key", help="Record field to copy into each violation")
+    parser.add_argument("--include-record", action="store_true", help="Copy the whole record into each violation")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Processes evaluating shards of the file (0: one per core); CSV rows must be single lines")
+    args = parser.parse_args()
+
+    rules = load_rules(args.rules)
+    try:
+        validator = StreamValidator(rules, args.engine, args.key, args.include_record)
+    except ValueError as error:
+        parser.error(str(error))
+    start = time.perf_counter()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        if args.workers == 1:
+            validator.run(record_chunks(args.records), output)
+            records, violations = validator.records, validator.violations
+        else:
+            records, violations = run_sharded(args.records, rules, output, args.workers or None, args.engine,
+                                              args.key, args.include_record, validator.context["as_of_date"])
+    finally:
+        if args.output:
+            output.close()
+    elapsed = time.perf_counter() - start
+    print(f"{records} records, {len(rules)} rules, {violations} violations in {elapsed:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import os
+import json
+import heapq
+from collections import Counter
+
+
+# Split text into lowercase whitespace tokens (same tokenization the keyword matcher always used)
+def tokenize(text):
+    return text.lower().split()
+
+
+# Fingerprint of a source file, used to tell whether a persisted index is stale
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+# Token -> example-id inverted index for keyword-overlap example retrieval
+class InvertedIndex:
+    def __init__(self, postings=None, size=0):
+        self.postings = postings if postings is not None else {}
+        self.size = size
+
+    @classmethod
+    def build(cls, texts):
+        index = cls()
+        for text in texts:
+            index.add(text)
+        return index
+
+    # Add one example input and return its id
+    def add(self, text):
+        example_id = self.size
+        for token in set(tokenize(text)):
+            self.postings.setdefault(token, []).append(example_id)
+        self.size += 1
+        return example_id
+
+    # Score examples sharing at least one token with the prompt by the number of shared tokens
+    def scores(self, prompt):
+        counts = Counter()
+        for token in set(tokenize(prompt)):
+            counts.update(self.postings.get(token, ()))
+        return counts
+
+    # Return the ids of the k best examples, highest overlap first and earlier examples first on ties
+    def search(self, prompt, k=5):
+        counts = self.scores(prompt)
+        top = heapq.nsmallest(k, counts.items(), key=lambda item: (-item[1], item[0]))
+        ids = [example_id for example_id, _ in top]
+
+        # Pad with zero-overlap examples in dataset order, like the full sort used to
+        example_id = 0
+        while len(ids) < min(k, self.size):
+            if example_id not in counts:
+                ids.append(example_id)
+            example_id += 1
+        return ids
+
+    def save(self, path, fingerprint=None):
+        with open(path, 'w') as file:
+            json.dump({"fingerprint": fingerprint, "size": self.size, "postings": self.postings}, file)
+
+    # Load a persisted index, or return None if it is missing or was built from a different source
+    @classmethod
+    def load(cls, path, fingerprint=None):
+        try:
+            with open(path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if data.get("fingerprint") != fingerprint:
+            return None
+        return cls(data["postings"], data["size"])
+
+
+# Path of the index persisted next to a dataset file
+def index_path_for(dataset_path):
+    return dataset_path + ".index.json"
+
+
+# Load the index persisted next to the dataset, rebuilding (and re-persisting) it when stale
+def load_or_build_index(dataset_path, texts):
+    try:
+        fingerprint = file_fingerprint(dataset_path)
+    except OSError:
+        return InvertedIndex.build(texts)
+
+    index_path = index_path_for(dataset_path)
+    index = InvertedIndex.load(index_path, fingerprint)
+    if index is not None and index.size == len(texts):
+        return index
+
+    index = InvertedIndex.build(texts)
+    try:
+        index.save(index_path, fingerprint)
+    except OSError:
+        pass  # Read-only dataset directory: keep the in-memory index
+    return index
+
+
+# Build the few-shot example selector for a retrieval mode: "keyword" (token overlap), "bm25", "tfidf" or "embedding"
+def build_selector(mode, dataset_path, texts):
+    if mode == "keyword":
+        return load_or_build_index(dataset_path, texts)
+    if mode in ("bm25", "tfidf"):
+        from sparse_retrieval import SparseIndex  # Needs NumPy/SciPy only when selected
+        return SparseIndex.build(texts, scheme=mode)
+    if mode == "embedding":
+        from embedding_index import load_or_build_embedding_index
+        return load_or_build_embedding_index(dataset_path, texts)
+    raise ValueError(f"Unknown retrieval mode: {mode}")
@@ -0,0 +1,256 @@
+import os
+import time
+from collections import Counter, deque
+
+from cache import SENSITIVE_WORDS, _fill, _skeletonize, canonicalize
+from fast_path import fast_rule
+from retrieval import InvertedIndex
+from rule_repair import validate_rule
+
+TEMPLATE_THRESHOLD = float(os.getenv("ROUTER_TEMPLATE_THRESHOLD", "0.85"))  # Token Jaccard to reuse an example
+PATTERN_CONFIDENCE = float(os.getenv("ROUTER_PATTERN_CONFIDENCE", "0.8"))
+TEMPLATE_CONFIDENCE = float(os.getenv("ROUTER_TEMPLATE_CONFIDENCE", "0.8"))
+LOCAL_CONFIDENCE = float(os.getenv("ROUTER_LOCAL_CONFIDENCE", "0.8"))
+LOCAL_MODEL = os.getenv("ROUTER_LOCAL_MODEL")  # Small model at LOCAL_LLM_BASE_URL; no local tier when unset
+# Cheap tiers tried before the hosted model. "pattern" (fast_path) is opt-in: its rules do not yet
+# agree with the examples' conditions often enough to be on by default
+ROUTER_TIERS = os.getenv("ROUTER_TIERS", "template,local").split(",")
+LATENCY_WINDOW = 1000  # Recent latencies kept per tier for the percentiles
+
+# Imported modules survive Streamlit reruns, so matchers and metrics live here rather than in the app scripts
+_matchers = {}
+
+
+# Few-shot examples as rule templates: each example's sentence with its numbers and quoted literals taken
+# out, and its rule with the same literals as slots. A sentence that differs from an example only in
+# those literals (token Jaccard >= threshold, no meaning-flipping word changed) gets the example's rule
+# with its own literals filled in; no model call
+class TemplateMatcher:
+    def __init__(self, examples, threshold=TEMPLATE_THRESHOLD):
+        self.threshold = threshold
+        self.rows = []  # (canonical text, literal kinds, skeleton or None, example output)
+        for example in examples:
+            canonical, literals = canonicalize(example['input'])
+            texts = [text for _, text in literals]
+            bound = set()
+            if not literals:
+                skeleton = example['output']  # Nothing to substitute: the rule is its own template
+            elif len(set(texts)) == len(texts):
+                skeleton = _skeletonize(example['output'], literals, bound)
+            if literals and (len(set(texts)) != len(texts) or len(bound) != len(literals)):
+                skeleton = None  # Literals that do not map one to one into the rule: nearest example only
+            self.rows.append((canonical, ",".join(kind for kind, _ in literals), skeleton, example['output']))
+        self.index = InvertedIndex.build(row[0] for row in self.rows)
+
+    # (example output, token Jaccard) of the example sentence closest to the prompt, or (None, 0.0)
+    def nearest(self, prompt):
+        return self._closest(canonicalize(prompt)[0])[1:]
+
+    def _closest(self, canonical):
+        tokens = set(canonical.split())
+        best = (None, None, 0.0)
+        for row_id in self.index.search(canonical, k=5):
+            other = set(self.rows[row_id][0].split())
+            score = len(tokens & other) / len(tokens | other) if tokens | other else 0.0
+            if score > best[2]:
+                best = (row_id, self.rows[row_id][3], score)
+        return best
+
+    # The filled-in rule of a matching template, or None
+    def match(self, prompt):
+        canonical, literals = canonicalize(prompt)
+        row_id, _, score = self._closest(canonical)
+        if row_id is None or score < self.threshold:
+            return None
+        other, kinds, skeleton, _ = self.rows[row_id]
+        if skeleton is None or kinds != ",".join(kind for kind, _ in literals) or \
+                (set(canonical.split()) ^ set(other.split())) & SENSITIVE_WORDS:
+            return None
+        return _fill(skeleton, literals)
+
+
+# One TemplateMatcher per example set (by content hash) per process
+def get_template_matcher(examples, digest):
+    matcher = _matchers.get(digest)
+    if matcher is None:
+        matcher = _matchers[digest] = TemplateMatcher(examples)
+    return matcher
+
+
+def _leaves(node, groups, operators):
+    if isinstance(node, list):
+        groups.append("all")
+        for child in node:
+            _leaves(child, groups, operators)
+    elif isinstance(node, dict):
+        for group in ("all", "any", "not"):
+            if group in node:
+                groups.append(group)
+                _leaves(node[group], groups, operators)
+                return
+        operators.append(node.get("operator"))
+
+
+# Structural agreement of two rules in [0, 1]: the operators their leaves use (as multisets), the number
+# of leaves and the top-level group
+def structure_agreement(rule, example):
+    shapes = []
+    for item in (rule, example):
+        groups, operators = [], []
+        _leaves(item.get("conditions") if isinstance(item, dict) else None, groups, operators)
+        shapes.append((groups[:1], Counter(operators), len(operators)))
+    (top, operators, count), (other_top, other_operators, other_count) = shapes
+    union = sum((operators | other_operators).values())
+    overlap = sum((operators & other_operators).values()) / union if union else 1.0
+    return 0.5 * overlap + 0.25 * (count == other_count) + 0.25 * (top == other_top)
+
+
+def _facts(node, facts):
+    if isinstance(node, list):
+        for child in node:
+            _facts(child, facts)
+    elif isinstance(node, dict):
+        if isinstance(node.get("fact"), str):
+            facts.append(node["fact"])
+        for group in ("all", "any", "not"):
+            if group in node:
+                _facts(node[group], facts)
+
+
+# Overlap of the facts two rules' conditions test, in [0, 1]
+def fact_agreement(rule, example):
+    facts, other_facts = [], []
+    _facts(rule.get("conditions"), facts)
+    _facts(example.get("conditions"), other_facts)
+    facts, other_facts = set(facts), set(other_facts)
+    return len(facts & other_facts) / len(facts | other_facts) if facts | other_facts else 1.0
+
+
+# Agreement of two rules' actions in [0, 1]: the keys they set (a message, fact/operator/value, a
+# source, a next_action)
+def action_agreement(rule, example):
+    actions, other_actions = rule.get("actions"), example.get("actions")
+    if not isinstance(actions, dict) or not isinstance(other_actions, dict):
+        return 0.0
+    keys, other_keys = set(actions), set(other_actions)
+    return len(keys & other_keys) / len(keys | other_keys) if keys | other_keys else 1.0
+
+
+# Confidence in a rule, in [0, 1]: 0 unless it passes rule_repair validation, then its agreement with
+# the nearest few-shot example: 0.4 for the conditions' structure, 0.3 for the facts tested and 0.3 for
+# the actions. Without an example it is 0.5, below every default threshold. Scored against the example
+# rather than the sentence, since the tiers' rules reuse the sentence's own words. A copy of the example
+# only counts as far as the sentences match (similarity, the nearest token Jaccard)
+def score_rule(rule, example=None, similarity=1.0):
+    if not isinstance(rule, dict) or "error" in rule or validate_rule(rule):
+        return 0.0
+    if not isinstance(example, dict) or not example:
+        return 0.5
+    if rule == example and similarity < TEMPLATE_THRESHOLD:
+        return 0.5
+    return round(0.4 * structure_agreement(rule, example) + 0.3 * fact_agreement(rule, example)
+                 + 0.3 * action_agreement(rule, example), 3)
+
+
+# Per-tier routing counters: attempts, rules accepted, escalations and failures, with recent latencies
+class TierMetrics:
+    def __init__(self):
+        self.counts = {}  # tier -> Counter of attempts / accepted / escalated / errors
+        self.latencies = {}  # tier -> deque of seconds
+        self.confidence = {}  # tier -> sum of scores, for the mean
+
+    def record(self, tier, seconds, outcome, confidence=0.0):
+        counts = self.counts.setdefault(tier, Counter())
+        counts["attempts"] += 1
+        counts[outcome] += 1
+        self.latencies.setdefault(tier, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+        self.confidence[tier] = self.confidence.get(tier, 0.0) + confidence
+
+    # tier -> {attempts, accepted, escalated, errors, hit_rate, share, p50_ms, p95_ms, mean_confidence}
+    def stats(self):
+        routed = sum(counts["accepted"] for counts in self.counts.values())
+        stats = {}
+        for tier, counts in self.counts.items():
+            latencies = sorted(self.latencies[tier])
+            stats[tier] = {
+                "attempts": counts["attempts"], "accepted": counts["accepted"], "escalated": counts["escalated"],
+                "errors": counts["errors"],
+                "hit_rate": counts["accepted"] / counts["attempts"],
+                "share": counts["accepted"] / routed if routed else 0.0,
+                "p50_ms": latencies[len(latencies) // 2] * 1000,
+                "p95_ms": latencies[min(len(latencies) - 1, len(latencies) * 95 // 100)] * 1000,
+                "mean_confidence": self.confidence[tier] / counts["attempts"],
+            }
+        return stats
+
+
+TIER_METRICS = TierMetrics()
+
+
+# One step of the cascade: generate(prompt) -> rule (a dict with "error" on failure), accepted when its
+# score reaches min_confidence
+class Tier:
+    def __init__(self, name, generate, min_confidence):
+        self.name = name
+        self.generate = generate
+        self.min_confidence = min_confidence
+
+
+# Pattern tier: fast_path's rule for a sentence of a common shape, its subjects resolved against facts
+# (default: the bundled examples' facts), else an error so the router escalates
+def pattern_tier(min_confidence=PATTERN_CONFIDENCE, facts=None):
+    async def generate(prompt):
+        rule = fast_rule(prompt, facts)
+        return rule if rule is not None else {"error": "No matching pattern"}
+    return Tier("pattern", generate, min_confidence)
+
+
+# Template tier: the matcher's rule for the sentence, else an error so the router escalates
+def template_tier(matcher, min_confidence=TEMPLATE_CONFIDENCE):
+    async def generate(prompt):
+        rule = matcher.match(prompt)
+        return rule if rule is not None else {"error": "No matching template"}
+    return Tier("template", generate, min_confidence)
+
+
+# Tries cheap tiers first (a template match, a sentence pattern, a small local model) and escalates to the next tier while
+# the rule scores below the tier's confidence. The last tier's rule is returned whatever its score, and
+# its exceptions propagate (bulk.py retries them); earlier tiers that raise just escalate
+class RuleRouter:
+    def __init__(self, matcher, tiers, metrics=TIER_METRICS):
+        self.matcher = matcher
+        self.tiers = tiers
+        self.metrics = metrics
+
+    # (rule, tier name, confidence). With fallback=False the last tier is not run and the rule is None
+    # when no earlier tier was confident, for callers that run the last tier themselves (streaming)
+    async def aroute(self, prompt, fallback=True):
+        nearest = None  # (nearest example's rule, token Jaccard), found once the first rule needs scoring
+        tiers = self.tiers if fallback else self.tiers[:-1]
+        for position, tier in enumerate(tiers):
+            last = position == len(self.tiers) - 1
+            start = time.perf_counter()
+            try:
+                rule = await tier.generate(prompt)
+            except Exception:
+                self.metrics.record(tier.name, time.perf_counter() - start, "errors")
+                if last:
+                    raise
+                continue
+            if nearest is None:
+                nearest = self.matcher.nearest(prompt)
+            confidence = score_rule(rule, *nearest)
+            if last:
+                outcome = "errors" if "error" in rule else "accepted"
+            else:
+                outcome = "accepted" if confidence >= tier.min_confidence else "escalated"
+            self.metrics.record(tier.name, time.perf_counter() - start, outcome, confidence)
+            if last or outcome == "accepted":
+                return rule, tier.name, confidence
+        return None, None, 0.0
+
+    # Record a last-tier rule produced outside aroute (a streamed completion) in the metrics
+    def record_fallback(self, prompt, rule, seconds):
+        confidence = score_rule(rule, *self.matcher.nearest(prompt))
+        self.metrics.record(self.tiers[-1].name, seconds, "errors" if "error" in rule else "accepted", confidence)
+        return confidence
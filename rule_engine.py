@@ -0,0 +1,441 @@
+import re
+import datetime
+import operator as op
+from functools import lru_cache
+
+MISSING = object()  # A fact the record does not have (or holds None); every condition on it is false
+
+IDENTIFIER_RE = re.compile(r"^[A-Za-z_]\w*$")
+DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)[\s_]*(day|week|month|year)s?\s*$", re.IGNORECASE)
+OFFSET_RE = re.compile(r"^\s*([A-Za-z_]\w*)\s*([+-])\s*(.+?)\s*$")  # "course_start + 7 days"
+RANGE_RE = re.compile(r"^(\d+)-(\d+)$")  # "900-999" inside an in / notInRange list
+DAYS_PER_UNIT = {"day": 1, "week": 7, "month": 30, "year": 365}
+NUMBER_TYPES = (int, float)
+ORDERING_OPERATORS = frozenset({"lessThan", "greaterThan", "before", "after", "within"})
+
+
+# "7 days" -> (7.0, 1), "6 years" -> (6.0, 365); None if the text is not a duration
+def parse_duration(text):
+    match = DURATION_RE.match(text) if isinstance(text, str) else None
+    if match is None:
+        return None
+    return float(match.group(1)), DAYS_PER_UNIT[match.group(2).lower()]
+
+
+# ISO date or datetime string -> datetime; None otherwise. Cached, since record columns repeat values
+@lru_cache(maxsize=65536)
+def parse_date(text):
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+
+
+def _to_number(value):
+    if value.__class__ in NUMBER_TYPES:
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return {"true": True, "false": False, "y": True, "n": False}.get(value.strip().lower())
+    return value if isinstance(value, bool) else None
+
+
+# Normalize a value for ordering comparisons: numbers stay numbers, dates become datetimes,
+# durations become a count of `unit` days, numeric and ISO date strings are parsed
+def comparable(value, unit=1):
+    cls = value.__class__
+    if cls in NUMBER_TYPES:
+        return value
+    if cls is str:
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        parsed = parse_date(value)
+        if parsed is not None:
+            return parsed
+        duration = parse_duration(value)
+        if duration is not None:
+            return duration[0] * duration[1] / unit
+        return value
+    if cls is datetime.date:
+        return datetime.datetime.combine(value, datetime.time())
+    if cls is datetime.timedelta:
+        return value.total_seconds() / 86400 / unit
+    return value
+
+
+# Literal bound of an ordering operator and the day count its unit stands for ("6 years" -> 6, 365)
+def _bound(value):
+    duration = parse_duration(value)
+    if duration is not None:
+        return duration
+    return comparable(value), 1
+
+
+# Shift a referenced value by an offset in days: datetimes by a timedelta, numbers by the count
+def _shift(value, days):
+    if not days:
+        return value
+    if isinstance(value, datetime.datetime):
+        return value + datetime.timedelta(days=days)
+    if value.__class__ in NUMBER_TYPES:
+        return value + days
+    return MISSING
+
+
+def _equal(value):
+    if isinstance(value, bool):
+        return lambda actual: actual is value or _to_bool(actual) is value
+    if value.__class__ in NUMBER_TYPES:
+        return lambda actual: actual == value if actual.__class__ in NUMBER_TYPES else _to_number(actual) == value
+    if isinstance(value, str):
+        if _to_number(value) is None:
+            # A number can never equal a non-numeric string such as "probation"
+            return lambda actual: actual == value or (actual.__class__ not in NUMBER_TYPES and str(actual) == value)
+        return lambda actual: actual == value or (actual.__class__ is not str and str(actual) == value)
+    return lambda actual: actual == value
+
+
+def _not_equal(value):
+    equal = _equal(value)
+    return lambda actual: not equal(actual)
+
+
+def _less_than(value):
+    bound, unit = _bound(value)
+
+    def test(actual):
+        if actual is None:
+            return False
+        try:
+            return comparable(actual, unit) < bound
+        except TypeError:
+            return False
+    return test
+
+
+def _greater_than(value):
+    bound, unit = _bound(value)
+
+    def test(actual):
+        if actual is None:
+            return False
+        try:
+            return comparable(actual, unit) > bound
+        except TypeError:
+            return False
+    return test
+
+
+# Exact members plus numeric "lo-hi" ranges; numbers also match their string form
+def _membership(values):
+    if not isinstance(values, (list, tuple, set, frozenset)):
+        values = [values]
+    members = set()
+    ranges = []
+    for value in values:
+        members.add(value if isinstance(value, str) else str(value))
+        match = RANGE_RE.match(value) if isinstance(value, str) else None
+        if match and int(match.group(1)) <= int(match.group(2)):
+            ranges.append((int(match.group(1)), int(match.group(2))))
+    ranges = tuple(ranges)
+
+    def contains(actual):
+        if actual.__class__ is not str:
+            actual = str(actual)
+        if actual in members:
+            return True
+        if ranges and actual.isdigit():
+            number = int(actual)
+            for low, high in ranges:
+                if low <= number <= high:
+                    return True
+        return False
+    return contains
+
+
+def _in(values):
+    return _membership(values)
+
+
+def _not_in_range(values):
+    contains = _membership(values)
+    return lambda actual: not contains(actual)
+
+
+def _starts_with(value):
+    value = str(value)
+    return lambda actual: (actual if actual.__class__ is str else str(actual)).startswith(value)
+
+
+def _ends_with(value):
+    value = str(value)
+    return lambda actual: (actual if actual.__class__ is str else str(actual)).endswith(value)
+
+
+def _contains(value):
+    text = str(value)
+
+    def test(actual):
+        if isinstance(actual, (list, tuple, set, frozenset)):
+            return value in actual
+        return text in (actual if actual.__class__ is str else str(actual))
+    return test
+
+
+# Inclusive window: a [start, end] pair, or a bare duration meaning the last N units up to compile time
+def _within(value):
+    if isinstance(value, (list, tuple)) and len(value) == 2:
+        low, high = sorted((comparable(value[0]), comparable(value[1])))
+    else:
+        duration = parse_duration(value)
+        if duration is None:
+            raise ValueError(f"within needs a [start, end] pair or a duration, got {value!r}")
+        high = datetime.datetime.now()
+        low = high - datetime.timedelta(days=duration[0] * duration[1])
+
+    def test(actual):
+        try:
+            return low <= comparable(actual) <= high
+        except TypeError:
+            return False
+    return test
+
+
+# Operator name -> factory(value) returning a predicate over the record's fact value
+OPERATORS = {
+    "equal": _equal,
+    "notEqual": _not_equal,
+    "lessThan": _less_than,
+    "greaterThan": _greater_than,
+    "in": _in,
+    "notInRange": _not_in_range,
+    "startsWith": _starts_with,
+    "endsWith": _ends_with,
+    "contains": _contains,
+    "before": _less_than,
+    "after": _greater_than,
+    "within": _within,
+}
+
+
+# Operator name -> C-level comparison used directly when the fact value already has the literal's type
+FAST_OPERATORS = {
+    "equal": op.eq, "notEqual": op.ne, "lessThan": op.lt, "greaterThan": op.gt, "before": op.lt, "after": op.gt,
+    "startsWith": str.startswith, "endsWith": str.endswith, "contains": op.contains,
+}
+
+
+# (types, comparison, operand) for a same-type fast path, or None: str == str, number < number,
+# datetime < datetime skip the coercions of the general predicate
+def _fast_path(operator, value):
+    comparison = FAST_OPERATORS.get(operator)
+    if comparison is None or isinstance(value, bool):
+        return None
+    if operator in ORDERING_OPERATORS:
+        bound, unit = _bound(value)
+        if unit != 1:
+            return None
+        if bound.__class__ in NUMBER_TYPES:
+            return NUMBER_TYPES, comparison, bound
+        if bound.__class__ is datetime.datetime:
+            return (datetime.datetime,), comparison, bound
+        return None
+    if value.__class__ is str:
+        return (str,), comparison, value
+    if value.__class__ in NUMBER_TYPES and operator in ("equal", "notEqual"):
+        return NUMBER_TYPES, comparison, value
+    return None
+
+
+# "1-3" -> slice(0, 3), "4" -> slice(3, 4): 1-based inclusive character positions of a fact
+def parse_position(position):
+    if position is None:
+        return None
+    first, _, last = str(position).partition("-")
+    try:
+        return slice(int(first) - 1, int(last or first))
+    except ValueError:
+        raise ValueError(f"Invalid position: {position!r}")
+
+
+# A value naming another fact of the record: {"fact": "x"}, "registration_deadline" as the bound of an
+# ordering operator, "course_start + 7 days", or a fact holding the list for "in". Returns (fact, offset
+# in days) or None for a literal
+def parse_reference(operator, value):
+    if isinstance(value, dict) and isinstance(value.get("fact"), str):
+        return value["fact"], 0.0
+    if not isinstance(value, str) or operator not in ORDERING_OPERATORS | {"in"}:
+        return None
+    match = OFFSET_RE.match(value)
+    if match and operator in ORDERING_OPERATORS:
+        duration = parse_duration(match.group(3))
+        if duration is not None:
+            days = duration[0] * duration[1]
+            return match.group(1), days if match.group(2) == "+" else -days
+    if IDENTIFIER_RE.match(value) and isinstance(comparable(value), str):
+        return value, 0.0
+    return None
+
+
+# Name of the batch-level fact a groupBy condition reads: `fact` aggregated over the record's group
+def group_fact(fact, group_by):
+    return f"{fact} by {group_by}"
+
+
+# The fact a condition reads from the record ("course_override_requests by major" with groupBy)
+def leaf_fact(node):
+    fact = node.get("fact")
+    if not isinstance(fact, str):
+        raise ValueError(f"Condition has no fact: {node!r}")
+    group_by = node.get("groupBy")
+    return group_fact(fact, group_by) if isinstance(group_by, str) else fact
+
+
+# Compile a {fact, operator, value[, position, groupBy]} condition into a predicate over a record mapping
+def compile_leaf(node):
+    operator = node.get("operator")
+    factory = OPERATORS.get(operator)
+    if factory is None:
+        raise ValueError(f"Unknown operator: {operator!r}")
+    fact = leaf_fact(node)
+    positions = parse_position(node.get("position"))
+    reference = parse_reference(operator, node.get("value"))
+
+    if positions is None:
+        read = None
+    else:
+        def read(record):
+            actual = record.get(fact, MISSING)
+            if actual is MISSING or actual is None:
+                return MISSING
+            return (actual if actual.__class__ is str else str(actual))[positions]
+
+    if reference is None:
+        test = factory(node.get("value"))
+        fast = _fast_path(operator, node.get("value"))
+        if read is None and fast is not None:
+            types, comparison, operand = fast
+
+            def leaf(record):
+                actual = record.get(fact)
+                if actual.__class__ in types:
+                    return comparison(actual, operand)
+                return actual is not None and test(actual)
+        elif read is None:
+            def leaf(record):
+                actual = record.get(fact)
+                return actual is not None and test(actual)
+        else:
+            def leaf(record):
+                actual = read(record)
+                return actual is not MISSING and test(actual)
+        return leaf
+
+    # The bound comes from the record itself, so the operator's predicate is built per record
+    other, offset = reference
+
+    def resolve(record):
+        value = record.get(other, MISSING)
+        if value is MISSING or value is None:
+            return MISSING
+        if operator == "within":
+            start = comparable(value)
+            end = _shift(start, offset)
+            return MISSING if end is MISSING else [start, end]
+        return _shift(comparable(value), offset) if offset else value
+
+    def leaf(record):
+        actual = record.get(fact, MISSING) if read is None else read(record)
+        if actual is MISSING or actual is None:
+            return False
+        bound = resolve(record)
+        return bound is not MISSING and factory(bound)(actual)
+    return leaf
+
+
+def _all(children):
+    if len(children) == 1:
+        return children[0]
+    if len(children) == 2:
+        first, second = children
+        return lambda record: first(record) and second(record)
+
+    def test(record):
+        for child in children:
+            if not child(record):
+                return False
+        return True
+    return test
+
+
+def _any(children):
+    if len(children) == 1:
+        return children[0]
+    if len(children) == 2:
+        first, second = children
+        return lambda record: first(record) or second(record)
+
+    def test(record):
+        for child in children:
+            if child(record):
+                return True
+        return False
+    return test
+
+
+# Compile a conditions tree (nested all/any/not groups, a bare list meaning all) into one predicate
+def compile_condition(node):
+    if isinstance(node, list):
+        return _all(tuple(compile_condition(child) for child in node))
+    if not isinstance(node, dict):
+        raise ValueError(f"Invalid condition: {node!r}")
+    if "all" in node:
+        return _all(tuple(compile_condition(child) for child in node["all"])) if node["all"] else lambda record: True
+    if "any" in node:
+        return _any(tuple(compile_condition(child) for child in node["any"])) if node["any"] else lambda record: False
+    if "not" in node:
+        inner = compile_condition(node["not"])
+        return lambda record: not inner(record)
+    return compile_leaf(node)
+
+
+# A generated rule compiled once: `matches(record)` runs the closure tree, `evaluate` returns the actions
+class CompiledRule:
+    def __init__(self, rule, name=None):
+        if not isinstance(rule, dict) or "conditions" not in rule:
+            raise ValueError("Rule has no conditions")
+        self.rule = rule
+        self.name = rule.get("name", name)
+        self.actions = rule.get("actions")
+        self.matches = compile_condition(rule["conditions"])
+
+    def evaluate(self, record):
+        return self.actions if self.matches(record) else None
+
+
+# Rules evaluated together against a stream of records
+class RuleSet:
+    def __init__(self, rules):
+        self.rules = [rule if isinstance(rule, CompiledRule) else CompiledRule(rule, i) for i, rule in enumerate(rules)]
+
+    # (rule name, actions) of every rule the record satisfies
+    def fire(self, record):
+        return [(rule.name, rule.actions) for rule in self.rules if rule.matches(record)]
+
+    # Yield (record index, rule name, actions) per match; on_match(actions, record, rule name) is called too
+    def run(self, records, on_match=None):
+        rules = [(rule.matches, rule.name, rule.actions) for rule in self.rules]
+        for index, record in enumerate(records):
+            for matches, name, actions in rules:
+                if matches(record):
+                    if on_match is not None:
+                        on_match(actions, record, name)
+                    yield index, name, actions
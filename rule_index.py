@@ -0,0 +1,260 @@
+import bisect
+import datetime
+
+from rule_engine import (
+    NUMBER_TYPES, RANGE_RE, _bound, _to_bool, _to_number, comparable, parse_position, parse_reference,
+)
+
+TERMINAL = None  # Trie key holding the nodes whose string ends at that trie node
+
+
+# Alpha nodes of one (fact, lessThan|greaterThan) group with thresholds kept sorted: one bisect per
+# record finds every threshold the value passes. Numbers and datetimes do not compare, so each has its
+# own array
+class ThresholdIndex:
+    def __init__(self, less):
+        self.less = less  # lessThan/before: true for thresholds above the value; else below it
+        self._arrays = {}  # "num" | "date" -> ([thresholds], [nodes])
+        self.size = 0
+
+    def add(self, bound, node):
+        thresholds, nodes = self._arrays.setdefault("date" if isinstance(bound, datetime.datetime) else "num", ([], []))
+        i = bisect.bisect_right(thresholds, bound)
+        thresholds.insert(i, bound)
+        nodes.insert(i, node)
+        self.size += 1
+
+    def remove(self, bound, node):
+        thresholds, nodes = self._arrays["date" if isinstance(bound, datetime.datetime) else "num"]
+        i = bisect.bisect_left(thresholds, bound)
+        while nodes[i] is not node:
+            i += 1
+        del thresholds[i], nodes[i]
+        self.size -= 1
+
+    def matches(self, actual):
+        if actual is None:
+            return ()
+        value = comparable(actual)
+        if isinstance(value, datetime.datetime):
+            kind = "date"
+        elif value.__class__ in NUMBER_TYPES or value.__class__ is bool:
+            kind = "num"
+        else:
+            return ()  # Text never orders against a number or a date
+        arrays = self._arrays.get(kind)
+        if not arrays:
+            return ()
+        thresholds, nodes = arrays
+        try:
+            if self.less:
+                return nodes[bisect.bisect_right(thresholds, value):]
+            return nodes[:bisect.bisect_left(thresholds, value)]
+        except TypeError:  # Naive vs aware datetimes
+            return ()
+
+
+# key -> alpha nodes, for equal/notEqual and in/notInRange membership tests
+class ValueIndex:
+    def __init__(self):
+        self.entries = {}
+        self.size = 0
+
+    def add(self, key, node):
+        self.entries.setdefault(key, []).append(node)
+        self.size += 1
+
+    def remove(self, key, node):
+        nodes = self.entries[key]
+        nodes.remove(node)
+        if not nodes:
+            del self.entries[key]
+        self.size -= 1
+
+    def get(self, key):
+        return self.entries.get(key, ())
+
+
+# Character trie of startsWith prefixes (or reversed endsWith suffixes); walking a value collects every
+# node whose string it starts (ends) with
+class PrefixTrie:
+    def __init__(self, reverse=False):
+        self.reverse = reverse
+        self.root = {}
+        self.size = 0
+
+    def add(self, text, node):
+        trie = self.root
+        for char in reversed(text) if self.reverse else text:
+            trie = trie.setdefault(char, {})
+        trie.setdefault(TERMINAL, []).append(node)
+        self.size += 1
+
+    def remove(self, text, node):
+        path = [self.root]
+        for char in reversed(text) if self.reverse else text:
+            path.append(path[-1][char])
+        path[-1][TERMINAL].remove(node)
+        if not path[-1][TERMINAL]:
+            del path[-1][TERMINAL]
+        chars = list(reversed(text) if self.reverse else text)
+        for depth in range(len(chars), 0, -1):  # Prune branches left empty
+            if path[depth]:
+                break
+            del path[depth - 1][chars[depth - 1]]
+        self.size -= 1
+
+    def matches(self, text):
+        found = []
+        trie = self.root
+        if TERMINAL in trie:
+            found.extend(trie[TERMINAL])
+        for char in reversed(text) if self.reverse else text:
+            trie = trie.get(char)
+            if trie is None:
+                break
+            if TERMINAL in trie:
+                found.extend(trie[TERMINAL])
+        return found
+
+
+# Equality lookups keyed so a hash hit means exactly what rule_engine's equal predicate would say:
+# numbers by value (18 == 18.0 == "18"), numeric strings by text ("1" == 1), other strings by text
+# (never matched by a number), booleans by truth ("true", "Y")
+class EqualityIndex:
+    def __init__(self):
+        self.numbers = ValueIndex()
+        self.numeric_strings = ValueIndex()
+        self.strings = ValueIndex()
+        self.booleans = ValueIndex()
+
+    @property
+    def size(self):
+        return self.numbers.size + self.numeric_strings.size + self.strings.size + self.booleans.size
+
+    # (sub-index, key) for a literal, or None if it has to stay a compiled test
+    def slot(self, value):
+        if isinstance(value, bool):
+            return self.booleans, value
+        if value.__class__ in NUMBER_TYPES:
+            return (self.numbers, value) if value == value else None
+        if isinstance(value, str):
+            return (self.numeric_strings if _to_number(value) is not None else self.strings), value
+        return None
+
+    def matches(self, actual):
+        found = []
+        is_text = actual.__class__ is str
+        text = actual if is_text else str(actual)
+        number = actual if actual.__class__ in NUMBER_TYPES else _to_number(actual)
+        if number is not None:
+            found.extend(self.numbers.get(number))
+        found.extend(self.numeric_strings.get(text))
+        if is_text or actual.__class__ not in NUMBER_TYPES:
+            found.extend(self.strings.get(text))
+        truth = _to_bool(actual)
+        if truth is not None:
+            found.extend(self.booleans.get(truth))
+        return found
+
+
+# Every alpha node testing one fact, with literal comparisons held in the indexes above and the rest
+# (positions, fact references, ranges, contains, within, ...) kept as compiled tests
+class FactIndex:
+    def __init__(self, indexed=True):
+        self.indexed = indexed  # False keeps every node a compiled test (for comparison)
+        self.tests = []
+        self.less = ThresholdIndex(less=True)
+        self.greater = ThresholdIndex(less=False)
+        self.equal = EqualityIndex()
+        self.not_equal = EqualityIndex()
+        self.not_equal_nodes = []
+        self.members = ValueIndex()
+        self.non_members = ValueIndex()
+        self.non_member_nodes = []
+        self.prefixes = PrefixTrie()
+        self.suffixes = PrefixTrie(reverse=True)
+        self._slots = {}  # node -> (structure, key, complement list) it was indexed under
+
+    def __len__(self):
+        return len(self._slots) + len(self.tests)
+
+    # Where a literal condition can be indexed: (structure, key, complement list) or None
+    def _classify(self, condition):
+        operator, value = condition["operator"], condition.get("value")
+        if parse_position(condition.get("position")) is not None or parse_reference(operator, value) is not None:
+            return None
+        if operator in ("lessThan", "greaterThan", "before", "after"):
+            bound, unit = _bound(value)
+            if unit == 1 and (bound.__class__ in NUMBER_TYPES or isinstance(bound, datetime.datetime)) and bound == bound:
+                return (self.less if operator in ("lessThan", "before") else self.greater), bound, None
+            return None
+        if operator in ("equal", "notEqual"):
+            index = self.equal if operator == "equal" else self.not_equal
+            slot = index.slot(value)
+            return None if slot is None else (slot[0], slot[1], self.not_equal_nodes if operator == "notEqual" else None)
+        if operator in ("in", "notInRange"):
+            values = value if isinstance(value, (list, tuple, set, frozenset)) else [value]
+            members = [item if isinstance(item, str) else str(item) for item in values]
+            if any(RANGE_RE.match(member) for member in members):
+                return None
+            if operator == "in":
+                return self.members, frozenset(members), None
+            return self.non_members, frozenset(members), self.non_member_nodes
+        if operator == "startsWith":
+            return self.prefixes, str(value), None
+        if operator == "endsWith":
+            return self.suffixes, str(value), None
+        return None
+
+    def add(self, node, condition):
+        slot = self._classify(condition) if self.indexed else None
+        if slot is None:
+            self.tests.append(node)
+            return
+        structure, key, complement = slot
+        if structure is self.members or structure is self.non_members:
+            for member in key:
+                structure.add(member, node)
+        else:
+            structure.add(key, node)
+        if complement is not None:
+            complement.append(node)
+        self._slots[node] = (structure, key, complement)
+
+    def remove(self, node):
+        slot = self._slots.pop(node, None)
+        if slot is None:
+            self.tests.remove(node)
+            return
+        structure, key, complement = slot
+        if structure is self.members or structure is self.non_members:
+            for member in key:
+                structure.remove(member, node)
+        else:
+            structure.remove(key, node)
+        if complement is not None:
+            complement.remove(node)
+
+    # Alpha nodes true for a record holding `actual` for this fact
+    def matches(self, record, actual):
+        found = [node for node in self.tests if node.test(record)]
+        if self.less.size or self.greater.size:
+            found.extend(self.less.matches(actual))
+            found.extend(self.greater.matches(actual))
+        if self.equal.size:
+            found.extend(self.equal.matches(actual))
+        if self.not_equal_nodes:
+            equal = set(self.not_equal.matches(actual))
+            found.extend(node for node in self.not_equal_nodes if node not in equal)
+        if self.members.size or self.non_member_nodes:
+            text = actual if actual.__class__ is str else str(actual)
+            found.extend(self.members.get(text))
+            if self.non_member_nodes:
+                members = set(self.non_members.get(text))
+                found.extend(node for node in self.non_member_nodes if node not in members)
+        if self.prefixes.size or self.suffixes.size:
+            text = actual if actual.__class__ is str else str(actual)
+            found.extend(self.prefixes.matches(text))
+            found.extend(self.suffixes.matches(text))
+        return found
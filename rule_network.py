@@ -0,0 +1,201 @@
+import json
+import itertools
+
+from rule_engine import compile_condition, compile_leaf, leaf_fact
+from rule_index import FactIndex
+
+
+# A network node: an alpha node runs one distinct test on the record; an all/any node becomes true
+# once `needed` of its children have. `parents` are the nodes its result feeds, `rules` the rules it decides
+class _Node:
+    __slots__ = ("id", "key", "kind", "test", "fact", "children", "needed", "parents", "refs", "rules", "slot")
+
+    def __init__(self, node_id, key, kind, test=None, fact=None, children=()):
+        self.id = node_id
+        self.key = key
+        self.kind = kind
+        self.test = test
+        self.fact = fact
+        self.children = children
+        self.needed = len(children) if kind == "all" else 1
+        self.parents = []
+        self.refs = 0
+        self.rules = []
+        self.slot = None  # Group nodes: index of their counter in the per-record counts list
+
+
+def condition_key(node):
+    return json.dumps(node, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+# Rete-style network over many generated rules: identical fact/operator/value tests become one alpha
+# node evaluated once per record, identical all/any groups one group node, and results propagate
+# upward through per-record counters. Rules can be added and removed without rebuilding
+class RuleNetwork:
+    def __init__(self, rules=(), indexed=True):
+        self.indexed = indexed  # Threshold/hash/trie lookups for literal comparisons; False tests each node
+        self.rules = {}  # name -> (root node, actions)
+        self._nodes = {}  # key -> node
+        self._alpha_by_fact = {}  # fact -> FactIndex of the alpha nodes testing it
+        self._unconditional = []  # Alpha nodes that must run even without their fact (not, empty groups)
+        self._order = {}  # name -> insertion sequence, so matches come out in rule order
+        self._slots = 0  # Counter slots handed out to group nodes...
+        self._free_slots = []  # ...and those freed by removed groups, reused first
+        self._ids = itertools.count()
+        self._names = itertools.count()
+        for rule in rules:
+            self.add_rule(rule)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _alpha(self, key, test, fact, condition):
+        node = _Node(next(self._ids), key, "alpha", test=test, fact=fact)
+        if fact is None:
+            self._unconditional.append(node)
+        else:
+            index = self._alpha_by_fact.get(fact)
+            if index is None:
+                index = self._alpha_by_fact[fact] = FactIndex(self.indexed)
+            index.add(node, condition)
+        return node
+
+    # Find or create the node for a condition, taking one reference on it
+    def _acquire(self, condition):
+        if isinstance(condition, list):
+            condition = {"all": condition}
+        group = "all" if "all" in condition else "any" if "any" in condition else None
+        if group is not None and condition[group]:
+            children = []
+            for child in condition[group]:
+                child = self._acquire(child)
+                if child in children:
+                    self._release(child)  # all(a, a) is all(a)
+                else:
+                    children.append(child)
+            if len(children) == 1:
+                return children[0]
+            key = (group, frozenset(child.id for child in children))
+            node = self._nodes.get(key)
+            if node is None:
+                node = self._nodes[key] = _Node(next(self._ids), key, group, children=tuple(children))
+                if self._free_slots:
+                    node.slot = self._free_slots.pop()
+                else:
+                    node.slot, self._slots = self._slots, self._slots + 1
+                for child in children:
+                    child.parents.append(node)
+            else:
+                for child in children:
+                    self._release(child)  # The existing group already holds its children
+        else:
+            key = condition_key(condition)
+            node = self._nodes.get(key)
+            if node is None:
+                if group is None and "not" not in condition:
+                    node = self._alpha(key, compile_leaf(condition), leaf_fact(condition), condition)
+                else:
+                    # not and empty groups are not monotone in their children: kept as one opaque test
+                    node = self._alpha(key, compile_condition(condition), None, condition)
+                self._nodes[key] = node
+        node.refs += 1
+        return node
+
+    # Drop one reference; unused nodes leave the network along with their references on children
+    def _release(self, node):
+        node.refs -= 1
+        if node.refs:
+            return
+        del self._nodes[node.key]
+        if node.kind == "alpha":
+            if node.fact is None:
+                self._unconditional.remove(node)
+            else:
+                index = self._alpha_by_fact[node.fact]
+                index.remove(node)
+                if not len(index):
+                    del self._alpha_by_fact[node.fact]
+        else:
+            self._free_slots.append(node.slot)
+        for child in node.children:
+            child.parents.remove(node)
+            self._release(child)
+
+    # Add a generated rule; returns its name. A rule with an existing name replaces it
+    def add_rule(self, rule, name=None):
+        if not isinstance(rule, dict) or "conditions" not in rule:
+            raise ValueError("Rule has no conditions")
+        compile_condition(rule["conditions"])  # Validate before touching the network
+        name = rule.get("name", name)
+        if name is None:
+            name = next(self._names)
+            while name in self.rules:
+                name = next(self._names)
+        if name in self.rules:
+            self.remove_rule(name)
+        root = self._acquire(rule["conditions"])
+        root.rules.append(name)
+        self.rules[name] = (root, rule.get("actions"))
+        self._order[name] = next(self._ids)
+        return name
+
+    def remove_rule(self, name):
+        root, _ = self.rules.pop(name)
+        del self._order[name]
+        root.rules.remove(name)
+        self._release(root)
+
+    # Names of the rules the record satisfies, in the order they were added
+    def matching_rules(self, record):
+        active = [node for node in self._unconditional if node.test(record)]
+        alpha_by_fact = self._alpha_by_fact
+        # Only a plain dict is iterated: other mappings (derived_facts.LazyRecord) compute facts on lookup
+        if record.__class__ is dict and len(record) < len(alpha_by_fact):
+            facts = [fact for fact in record if fact in alpha_by_fact]
+        else:
+            facts = [fact for fact in alpha_by_fact if fact in record]
+        # Literal comparisons come from bisect, hash and trie lookups on the fact's value; a None value is
+        # a missing fact, as in rule_engine
+        for fact in facts:
+            actual = record[fact]
+            if actual is not None:
+                active.extend(alpha_by_fact[fact].matches(record, actual))
+
+        # Each node turns true at most once per record, so a counter per group node is enough
+        matched = []
+        counts = [0] * self._slots
+        push, pop = active.append, active.pop
+        while active:
+            node = pop()
+            if node.rules:
+                matched.extend(node.rules)
+            for parent in node.parents:
+                slot = parent.slot
+                count = counts[slot] + 1
+                counts[slot] = count
+                if count == parent.needed:
+                    push(parent)
+        if len(matched) > 1:
+            matched.sort(key=self._order.__getitem__)
+        return matched
+
+    # (rule name, actions) of every rule the record satisfies
+    def fire(self, record):
+        rules = self.rules
+        return [(name, rules[name][1]) for name in self.matching_rules(record)]
+
+    # Yield (record index, rule name, actions) per match, like rule_engine.RuleSet.run
+    def run(self, records, on_match=None):
+        rules = self.rules
+        for index, record in enumerate(records):
+            for name in self.matching_rules(record):
+                actions = rules[name][1]
+                if on_match is not None:
+                    on_match(actions, record, name)
+                yield index, name, actions
+
+    def stats(self):
+        alpha = sum(len(index) for index in self._alpha_by_fact.values()) + len(self._unconditional)
+        tested = sum(len(index.tests) for index in self._alpha_by_fact.values()) + len(self._unconditional)
+        return {"rules": len(self.rules), "alpha_nodes": alpha, "indexed_nodes": alpha - tested,
+                "group_nodes": len(self._nodes) - alpha}
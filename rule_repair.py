@@ -0,0 +1,472 @@
+import re
+import json
+import copy
+from collections import Counter
+
+from json_utils import IncrementalJSONParser, extract_json
+from rule_engine import (
+    DURATION_RE, IDENTIFIER_RE, OFFSET_RE, OPERATORS, ORDERING_OPERATORS, compile_condition, parse_date,
+    parse_duration,
+)
+
+GROUPS = ("all", "any", "not")
+LEAF_KEYS = ("fact", "operator", "value", "position", "groupBy")
+POSITION_RE = re.compile(r"^\d{1,3}(-\d{1,3})?$")  # Same form as the rule schema's position pattern
+LOOSE_POSITION_RE = re.compile(r"^\s*(\d{1,3})\s*(?:(?:-|:|\.\.|to|through)\s*(\d{1,3}))?\s*$", re.IGNORECASE)
+LOOSE_DURATION_RE = re.compile(r"^\s*(?:last|past|within|in the last|in the past)\s+(.+)$", re.IGNORECASE)
+REPAIR_ATTEMPTS = 1  # Repair round trips to the model after local fixes before giving up
+REPAIR_TEXT_LENGTH = 2000  # Characters of unparseable output quoted back in a repair prompt
+
+# Misspelled or foreign spellings of the engine's operators, keyed by _key; symbols as written
+OPERATOR_ALIASES = {
+    "==": "equal", "=": "equal", "===": "equal", "!=": "notEqual", "<>": "notEqual", "!==": "notEqual",
+    "<": "lessThan", ">": "greaterThan",
+    "eq": "equal", "equals": "equal", "is": "equal", "equalto": "equal", "isequalto": "equal",
+    "ne": "notEqual", "neq": "notEqual", "notequals": "notEqual", "notequalto": "notEqual", "isnot": "notEqual",
+    "lt": "lessThan", "less": "lessThan", "below": "lessThan", "under": "lessThan",
+    "gt": "greaterThan", "greater": "greaterThan", "above": "greaterThan", "over": "greaterThan",
+    "morethan": "greaterThan", "exceeds": "greaterThan",
+    "oneof": "in", "isin": "in", "inlist": "in", "inrange": "in", "anyof": "in",
+    "notin": "notInRange", "notinlist": "notInRange", "notoneof": "notInRange", "noneof": "notInRange",
+    "beginswith": "startsWith", "startswith": "startsWith", "endswith": "endsWith",
+    "includes": "contains", "has": "contains", "containing": "contains",
+    "earlierthan": "before", "isbefore": "before", "laterthan": "after", "isafter": "after",
+    "inthelast": "within", "between": "within",
+}
+# Inclusive comparisons the engine has no operator for, rewritten as an any-group with equal
+INCLUSIVE_ALIASES = {
+    "<=": "lessThan", "=<": "lessThan", "lte": "lessThan", "le": "lessThan", "atmost": "lessThan",
+    "lessthanorequal": "lessThan", "lessthanorequalto": "lessThan", "lessthaninclusive": "lessThan",
+    "lessthanequal": "lessThan", "max": "lessThan",
+    ">=": "greaterThan", "=>": "greaterThan", "gte": "greaterThan", "ge": "greaterThan", "atleast": "greaterThan",
+    "greaterthanorequal": "greaterThan", "greaterthanorequalto": "greaterThan",
+    "greaterthaninclusive": "greaterThan", "greaterthanequal": "greaterThan", "min": "greaterThan",
+}
+GROUP_ALIASES = {
+    "and": "all", "allof": "all", "every": "all", "or": "any", "anyof": "any", "some": "any", "not": "not",
+    "none": "none", "noneof": "none",
+}
+LEAF_KEY_ALIASES = {
+    "field": "fact", "attribute": "fact", "variable": "fact", "property": "fact", "path": "fact",
+    "op": "operator", "comparator": "operator", "operation": "operator", "comparison": "operator",
+    "values": "value", "threshold": "value", "target": "value", "expected": "value",
+    "pos": "position", "positions": "position", "characters": "position",
+    "groupby": "groupBy", "group": "groupBy",
+}
+RULE_KEY_ALIASES = {
+    "condition": "conditions", "when": "conditions", "if": "conditions", "criteria": "conditions",
+    "action": "actions", "event": "actions", "then": "actions", "result": "actions", "outcome": "actions",
+}
+RULE_WRAPPERS = ("rule", "json_rule", "output", "result")
+
+REPAIR_TEMPLATE = """Fix this part of a JSON business rule{statement}.
+Problems: {errors}
+A condition is {{"fact": name, "operator": op, "value": v}} (optional "position": "1-3", "groupBy": fact), \
+{{"all": [conditions]}}, {{"any": [conditions]}} or {{"not": condition}}. Operators: {operators}.
+{subject}: {fragment}
+Return only the corrected JSON {kind}."""
+
+# Outcomes of generated rules: valid as returned, fixed locally, fixed by a repair call, or still invalid
+REPAIR_STATS = Counter()
+
+
+# Spelling-insensitive form of a key or operator name: "Less_Than" -> "lessthan"
+def _key(name):
+    return re.sub(r"[^a-z]", "", name.lower()) if isinstance(name, str) else name
+
+
+_CANONICAL_OPERATORS = {_key(name): name for name in OPERATORS}
+
+
+# "conditions.all[0].operator" for an error path
+def format_path(path):
+    text = ""
+    for part in path:
+        text += f"[{part}]" if isinstance(part, int) else (f".{part}" if text else part)
+    return text or "rule"
+
+
+# Validation errors of a parsed rule as (path, message) pairs, empty for a rule the engine and the rule
+# schema both accept: an object with conditions and actions, all/any lists of conditions, not over one
+# condition, leaves with a known operator, a value of a type the operator takes and a "4" or "1-3" position
+def validate_rule(rule):
+    if not isinstance(rule, dict):
+        return [((), "rule must be a JSON object with conditions and actions")]
+    errors = []
+    if "conditions" in rule:
+        _validate_condition(rule["conditions"], ("conditions",), errors)
+    else:
+        errors.append((("conditions",), "missing"))
+    actions = rule.get("actions")
+    if "actions" not in rule:
+        errors.append((("actions",), "missing"))
+    elif not isinstance(actions, dict) or not actions:
+        errors.append((("actions",), "must be a non-empty object such as {\"message\": ...}"))
+    if not errors:
+        try:
+            compile_condition(rule["conditions"])
+        except (ValueError, TypeError) as e:
+            errors.append((("conditions",), str(e)))
+    return errors
+
+
+def _validate_condition(node, path, errors):
+    if not isinstance(node, dict):
+        errors.append((path, "condition must be an object"))
+        return
+    groups = [group for group in GROUPS if group in node]
+    if groups:
+        if len(groups) > 1 or any(key in node for key in LEAF_KEYS):
+            errors.append((path, "a group has exactly one of all/any/not and no leaf fields"))
+            return
+        group = groups[0]
+        children = node[group]
+        if group == "not":
+            _validate_condition(children, path + ("not",), errors)
+        elif not isinstance(children, list) or not children:
+            errors.append((path + (group,), "must be a non-empty list of conditions"))
+        else:
+            for i, child in enumerate(children):
+                _validate_condition(child, path + (group, i), errors)
+        return
+    _validate_leaf(node, path, errors)
+
+
+def _validate_leaf(node, path, errors):
+    fact = node.get("fact")
+    if not isinstance(fact, str) or not fact.strip():
+        errors.append((path + ("fact",), "missing fact name"))
+    operator = node.get("operator")
+    operator = operator if isinstance(operator, str) else repr(operator)
+    if operator not in OPERATORS:
+        errors.append((path + ("operator",), f"unknown operator {node.get('operator')!r}"))
+    if "value" not in node:
+        errors.append((path + ("value",), "missing"))
+    elif operator in OPERATORS:
+        problem = _value_problem(operator, node["value"])
+        if problem:
+            errors.append((path + ("value",), problem))
+    position = node.get("position")
+    if position is not None and not _valid_position(position):
+        errors.append((path + ("position",), f"must be a 1-based position like \"4\" or \"1-3\", got {position!r}"))
+    if "groupBy" in node and not isinstance(node["groupBy"], str):
+        errors.append((path + ("groupBy",), "must be a fact name"))
+
+
+def _valid_position(position):
+    if not isinstance(position, str) or not POSITION_RE.match(position):
+        return False
+    first, _, last = position.partition("-")
+    return 1 <= int(first) <= int(last or first)
+
+
+def _is_scalar(value):
+    return isinstance(value, (str, int, float, bool))
+
+
+# What is wrong with an operator's value, or None
+def _value_problem(operator, value):
+    if isinstance(value, dict):
+        return None if isinstance(value.get("fact"), str) else "a value object must be a fact reference {\"fact\": name}"
+    if operator == "within":
+        if isinstance(value, list):
+            return None if len(value) == 2 and all(_is_scalar(item) for item in value) else \
+                "within takes a [start, end] pair"
+        if isinstance(value, str) and (parse_duration(value) or _is_reference(value)):
+            return None
+        return "within takes a [start, end] pair, a duration like \"6 months\" or a fact name"
+    if operator in ORDERING_OPERATORS:
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            return f"{operator} takes a number, date, duration or fact name"
+        if isinstance(value, str) and not _is_ordered_text(value):
+            return f"{operator} takes a number, date, duration or fact name, got {value!r}"
+        return None
+    if operator in ("in", "notInRange"):
+        if isinstance(value, list):
+            return None if value and all(_is_scalar(item) for item in value) else \
+                f"{operator} takes a non-empty list of values"
+        return None if _is_scalar(value) else f"{operator} takes a list of values"
+    if not _is_scalar(value):
+        return f"{operator} takes a single string, number or boolean"
+    return None
+
+
+def _is_reference(value):
+    return bool(IDENTIFIER_RE.match(value) or OFFSET_RE.match(value))
+
+
+def _is_ordered_text(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        pass
+    return parse_date(value) is not None or parse_duration(value) is not None or _is_reference(value)
+
+
+# Local fixes for problems with one right answer: rule wrappers and key spellings, operator aliases,
+# AND/OR group keys, a bare list of conditions, numeric strings for lessThan/greaterThan, comma-separated
+# lists, inclusive comparisons and loose position formats. Returns (rule, list of what was changed); the
+# input is left as it was
+def normalize_rule(rule):
+    fixes = []
+    if not isinstance(rule, dict):
+        return rule, fixes
+    rule = copy.deepcopy(rule)
+    for wrapper in RULE_WRAPPERS:
+        inner = rule.get(wrapper)
+        if "conditions" not in rule and isinstance(inner, dict) and \
+                any(_key(key) in ("conditions", "condition", "when", "if") for key in inner):
+            rule = inner
+            fixes.append(f"unwrapped {wrapper}")
+            break
+    rule = _rename(rule, RULE_KEY_ALIASES, "", fixes)
+    if "conditions" in rule:
+        rule["conditions"] = _normalize_condition(rule["conditions"], ("conditions",), fixes)
+    actions = rule.get("actions")
+    if isinstance(actions, str) and actions.strip():
+        rule["actions"] = {"message": actions}
+        fixes.append("actions: text -> {\"message\": ...}")
+    elif isinstance(actions, dict) and set(actions) <= {"type", "params"} and isinstance(actions.get("params"), dict):
+        rule["actions"] = dict(actions["params"], **({"type": actions["type"]} if "type" in actions else {}))
+        fixes.append("actions: event params flattened")
+    return rule, fixes
+
+
+# Copy of an object with aliased keys renamed in place, unless the canonical key is already there
+def _rename(node, aliases, where, fixes):
+    renamed = {}
+    for key, value in node.items():
+        canonical = aliases.get(_key(key), key)
+        if canonical != key and (canonical in node or canonical in renamed):
+            canonical = key
+        if canonical != key:
+            fixes.append(f"{where}: {key} -> {canonical}" if where else f"{key} -> {canonical}")
+        renamed[canonical] = value
+    return renamed
+
+
+def _normalize_condition(node, path, fixes):
+    where = format_path(path)
+    if isinstance(node, list):
+        fixes.append(f"{where}: list -> all")
+        node = {"all": node}
+    if not isinstance(node, dict):
+        return node
+    node = _rename(node, GROUP_ALIASES, where, fixes)
+    if "none" in node and not any(group in node for group in GROUPS):
+        node = {"not": {"any": node.pop("none")}}
+        fixes.append(f"{where}: none -> not any")
+    groups = [group for group in GROUPS if group in node]
+    if groups and not any(key in node for key in LEAF_KEYS):
+        for group in groups:
+            children = node[group]
+            if group == "not":
+                if isinstance(children, list):
+                    children = children[0] if len(children) == 1 else {"all": children}
+                    fixes.append(f"{where}.not: list -> condition")
+                node["not"] = _normalize_condition(children, path + ("not",), fixes)
+                continue
+            if isinstance(children, dict):
+                children = [children]
+                fixes.append(f"{where}.{group}: condition -> list")
+            if isinstance(children, list):
+                node[group] = [_normalize_condition(child, path + (group, i), fixes)
+                               for i, child in enumerate(children)]
+        return node
+    return _normalize_leaf(node, path, fixes)
+
+
+def _normalize_leaf(node, path, fixes):
+    where = format_path(path)
+    node = _rename(node, LEAF_KEY_ALIASES, where, fixes)
+
+    operator = node.get("operator")
+    if isinstance(operator, str) and operator not in OPERATORS:
+        text = operator.strip()
+        inclusive = INCLUSIVE_ALIASES.get(text) or INCLUSIVE_ALIASES.get(_key(text))
+        canonical = OPERATOR_ALIASES.get(text) or _CANONICAL_OPERATORS.get(_key(text)) or \
+            OPERATOR_ALIASES.get(_key(text))
+        if inclusive and _is_scalar(node.get("value")):
+            fixes.append(f"{where}: {operator} -> any of {inclusive}, equal")
+            strict = _normalize_leaf(dict(node, operator=inclusive), path, [])
+            equal = dict(node, operator="equal", value=strict.get("value"))
+            return {"any": [strict, equal]}
+        if canonical:
+            node["operator"] = operator = canonical
+            fixes.append(f"{where}: {text} -> {canonical}")
+
+    if "value" in node:
+        value = _normalize_value(operator, node["value"])
+        if value is not node["value"]:
+            fixes.append(f"{where}.value: {node['value']!r} -> {value!r}")
+            node["value"] = value
+
+    if "position" in node:
+        position = _normalize_position(node["position"])
+        if position is None:
+            del node["position"]
+            fixes.append(f"{where}: empty position dropped")
+        elif position != node["position"]:
+            fixes.append(f"{where}.position: {node['position']!r} -> {position!r}")
+            node["position"] = position
+    return node
+
+
+def _normalize_value(operator, value):
+    if operator in ("lessThan", "greaterThan") and isinstance(value, str):
+        number = _number(value)
+        if number is not None:
+            return number
+    if operator in ("in", "notInRange"):
+        if isinstance(value, str) and "," in value:
+            return [item.strip() for item in value.split(",") if item.strip()]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return [value]
+    if operator == "within" and isinstance(value, str) and parse_duration(value) is None:
+        match = LOOSE_DURATION_RE.match(value)
+        if match and DURATION_RE.match(match.group(1)):
+            return match.group(1).strip()
+    return value
+
+
+# "3.5" -> 3.5, "1,200" -> 1200; None for text that is not a plain number
+def _number(text):
+    text = text.strip().replace(",", "")
+    try:
+        number = float(text)
+    except ValueError:
+        return None
+    return int(number) if number.is_integer() and re.match(r"^-?\d+$", text) else number
+
+
+# "1-3" from "1 - 3", "1:3", "1..3", "1 to 3", [1, 3], 4 and "3-1"; None for an empty position, the
+# value unchanged when it cannot be read as positions
+def _normalize_position(position):
+    if position in (None, "", []):
+        return None
+    if isinstance(position, bool):
+        return position
+    if isinstance(position, int):
+        return str(position)
+    if isinstance(position, list) and 1 <= len(position) <= 2 and all(isinstance(item, int) for item in position):
+        first, last = position[0], position[-1]
+    elif isinstance(position, str) and LOOSE_POSITION_RE.match(position):
+        match = LOOSE_POSITION_RE.match(position)
+        first, last = int(match.group(1)), int(match.group(2) or match.group(1))
+    else:
+        return position
+    first, last = min(first, last), max(first, last)
+    return str(first) if first == last else f"{first}-{last}"
+
+
+# Parse model output into a rule, closing the open containers of a truncated object; None if no JSON
+# object can be recovered
+def parse_rule_text(text):
+    rule = extract_json(text)
+    if rule is not None and "conditions" in rule:
+        return rule
+    # Cut off mid-rule, extract_json only finds the complete objects inside it
+    parser = IncrementalJSONParser()
+    parser.feed(text)
+    partial = parser.partial()
+    if parser.incomplete:
+        return partial  # An object found inside one that never closed is a fragment of it, not the rule
+    return partial if partial is not None and (rule is None or "conditions" in partial) else rule
+
+
+# Local pass over model output: (rule or None, fixes applied, remaining (path, message) errors)
+def repair_rule(rule):
+    if isinstance(rule, str):
+        rule = parse_rule_text(rule)
+    if rule is None:
+        return None, [], [((), "no JSON object found")]
+    rule, fixes = normalize_rule(rule)
+    return rule, fixes, validate_rule(rule)
+
+
+# The condition or actions object enclosing every error, as a path: the part a repair call resends
+def fragment_path(errors):
+    paths = [path for path, _ in errors]
+    common = paths[0]
+    for path in paths[1:]:
+        length = 0
+        while length < min(len(common), len(path)) and common[length] == path[length]:
+            length += 1
+        common = common[:length]
+    while common and not (isinstance(common[-1], int) or common[-1] in ("conditions", "not", "actions")):
+        common = common[:-1]
+    return common
+
+
+def _get(rule, path):
+    for part in path:
+        if isinstance(rule, dict) and part in rule:
+            rule = rule[part]
+        elif isinstance(rule, list) and isinstance(part, int) and part < len(rule):
+            rule = rule[part]
+        else:
+            return None
+    return rule
+
+
+def _set(rule, path, value):
+    if not path:
+        return value
+    rule = copy.deepcopy(rule)
+    parent = _get(rule, path[:-1])
+    parent[path[-1]] = value
+    return rule
+
+
+# Short prompt for the model to fix what local repair could not: the broken fragment (or the raw output
+# when nothing parsed) and its errors, without the few-shot examples. Returns (prompt, fragment path)
+def repair_prompt(rule, errors, text=None, statement=None):
+    statement = f' for the statement "{statement}"' if statement else ""
+    operators = ", ".join(sorted(OPERATORS))
+    if rule is None:
+        return REPAIR_TEMPLATE.format(
+            statement=statement, errors="the output is not valid JSON", operators=operators,
+            subject="Output", fragment=(text or "")[:REPAIR_TEXT_LENGTH],
+            kind='rule {"conditions": ..., "actions": ...}'), ()
+    path = fragment_path(errors)
+    fragment = _get(rule, path)
+    problems = "; ".join(f"{format_path(error_path)}: {message}" for error_path, message in errors)
+    if not path:
+        subject, kind = "Rule", 'rule {"conditions": ..., "actions": ...}'
+    elif path == ("actions",):
+        subject, kind = "actions", 'actions object, e.g. {"message": ...}'
+    else:
+        subject, kind = format_path(path), "condition"
+    compact = json.dumps(fragment, separators=(",", ":"), ensure_ascii=False) if fragment is not None else "(missing)"
+    return REPAIR_TEMPLATE.format(statement=statement, errors=problems, operators=operators, subject=subject,
+                                  fragment=compact, kind=kind), path
+
+
+# Splice a repair reply into the rule at the fragment's path; a reply that is a whole rule replaces it
+def apply_repair(rule, path, reply_text):
+    fixed = parse_rule_text(reply_text)
+    if not isinstance(fixed, dict):
+        return rule
+    if not path or rule is None or ("conditions" in fixed and "actions" in fixed):
+        return fixed
+    if path == ("actions",) and "actions" in fixed and len(fixed) == 1:
+        fixed = fixed["actions"]
+    return _set(rule, path, fixed)
+
+
+# Validate model output and repair it: local fixes first, then at most `attempts` short repair calls
+# through `complete(prompt) -> text` for what is still broken. Returns (rule, errors) with errors as
+# "path: message" strings, empty when the rule is valid
+async def arepair_rule(text, complete, statement=None, attempts=REPAIR_ATTEMPTS):
+    rule, fixes, errors = repair_rule(text)
+    outcome = "fixed locally" if fixes else "valid"
+    for _ in range(attempts):
+        if not errors:
+            break
+        prompt, path = repair_prompt(rule, errors, text if isinstance(text, str) else None, statement)
+        rule, _, errors = repair_rule(apply_repair(rule, path, await complete(prompt)))
+        outcome = "repaired by model"
+    outcome = "invalid" if errors else outcome
+    REPAIR_STATS[outcome] += 1
+    return rule, [f"{format_path(path)}: {message}" for path, message in errors]
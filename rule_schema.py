@@ -0,0 +1,191 @@
+import os
+import json
+
+from prompts import load_examples
+from rule_engine import OPERATORS
+
+# Size limits the schema states; generated rules use one to four conditions and sentence-length messages
+MAX_CONDITIONS = 6  # Conditions in the top-level group
+NESTED_CONDITIONS = 2  # Conditions in a group inside another, so nesting cannot multiply the rule's length
+MAX_DEPTH = 3  # Nested all/any/not groups
+FACT_LENGTH = 40
+TEXT_LENGTH = 60  # String values
+LIST_ITEMS = 8  # in / notInRange members
+ITEM_LENGTH = 16
+MESSAGE_LENGTH = 160
+ACTION_FIELDS = 4
+ACTION_KEY_LENGTH = 24
+ACTION_LENGTH = 48  # Action fields other than the message
+CHARS_PER_TOKEN = 3  # Conservative for compact JSON: short keys and punctuation tokenize densely
+MAX_TOKENS_MARGIN = 2.0  # RULE_MAX_TOKENS headroom over the examples' p99 rule
+
+RULE_TOOL_NAME = "emit_rule"
+STRUCTURED_MODES = ("tools", "json_schema", "json_object", "guided", "grammar", "off")
+
+
+def _string(max_length):
+    return {"type": "string", "maxLength": max_length}
+
+
+SCALAR_SCHEMA = {"anyOf": [_string(TEXT_LENGTH), {"type": "number"}, {"type": "boolean"}]}
+
+LEAF_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "fact": _string(FACT_LENGTH),
+        "operator": {"enum": sorted(OPERATORS)},
+        "value": {"anyOf": SCALAR_SCHEMA["anyOf"] + [{
+            "type": "array", "maxItems": LIST_ITEMS,
+            "items": {"anyOf": [_string(ITEM_LENGTH), {"type": "number"}]},
+        }]},
+        "position": {"type": "string", "pattern": r"^\d{1,3}(-\d{1,3})?$", "maxLength": 7},
+        "groupBy": _string(FACT_LENGTH),
+    },
+    "required": ["fact", "operator", "value"],
+    "additionalProperties": False,
+}
+
+
+# all/any/not groups written out to MAX_DEPTH levels rather than through a recursive $ref, which not
+# every function-calling or guided-decoding backend resolves. Only the top-level group takes MAX_CONDITIONS
+def condition_schema(depth=MAX_DEPTH, max_items=MAX_CONDITIONS):
+    if depth == 0:
+        return LEAF_SCHEMA
+    child = condition_schema(depth - 1, NESTED_CONDITIONS)
+    groups = [{
+        "type": "object",
+        "properties": {group: {"type": "array", "items": child, "minItems": 1, "maxItems": max_items}},
+        "required": [group],
+        "additionalProperties": False,
+    } for group in ("all", "any")]
+    negation = {"type": "object", "properties": {"not": child}, "required": ["not"], "additionalProperties": False}
+    return {"anyOf": [LEAF_SCHEMA] + groups + [negation]}
+
+
+ACTION_SCALAR_SCHEMA = {"anyOf": [_string(ACTION_LENGTH), {"type": "number"}, {"type": "boolean"}]}
+
+# A message and/or fact/operator/value-style fields, with an optional follow-up action of the same flat form
+ACTIONS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "message": _string(MESSAGE_LENGTH),
+        "next_action": {"type": "object", "properties": {}, "additionalProperties": ACTION_SCALAR_SCHEMA,
+                        "propertyNames": {"maxLength": ACTION_KEY_LENGTH}, "maxProperties": ACTION_FIELDS - 1},
+    },
+    "additionalProperties": ACTION_SCALAR_SCHEMA,
+    "propertyNames": {"maxLength": ACTION_KEY_LENGTH},
+    "maxProperties": ACTION_FIELDS,
+}
+
+RULE_SCHEMA = {
+    "type": "object",
+    "description": f"A business rule: conditions on record facts (at most {MAX_CONDITIONS} in a group, "
+                   f"{NESTED_CONDITIONS} in a nested group) and the actions to take when they hold",
+    "properties": {"conditions": condition_schema(), "actions": ACTIONS_SCHEMA},
+    "required": ["conditions", "actions"],
+    "additionalProperties": False,
+}
+
+RULE_TOOL = {
+    "type": "function",
+    "function": {
+        "name": RULE_TOOL_NAME,
+        "description": "Return the structured JSON rule for the statement",
+        "parameters": RULE_SCHEMA,
+    },
+}
+
+
+# Completion tokens for a rule: the example corpus's p99 rule, pretty-printed as tool arguments may be,
+# with MAX_TOKENS_MARGIN headroom. A runaway completion stops near a real rule's length; the schema's own
+# worst case (every group at its item limit) is thousands of tokens. Used as max_tokens in structured
+# modes and for repair calls
+def max_rule_tokens(examples):
+    lengths = sorted(len(json.dumps(example['output'], indent=2)) for example in examples)
+    p99 = lengths[min(len(lengths) - 1, len(lengths) * 99 // 100)]
+    return -(-int(p99 * MAX_TOKENS_MARGIN) // CHARS_PER_TOKEN)
+
+
+RULE_MAX_TOKENS = int(os.getenv("RULE_MAX_TOKENS") or max_rule_tokens(load_examples()))
+
+
+def _literal(text):
+    return json.dumps(json.dumps(text))  # A GBNF literal matching the JSON string "text"
+
+
+# GBNF grammar (llama.cpp) for compact rule JSON, so a self-hosted model can only emit a conforming rule.
+# Lengths and counts are left to max_tokens and validation; keys come out in a fixed order
+def rule_gbnf():
+    operators = " | ".join(_literal(name) for name in sorted(OPERATORS))
+    return "\n".join([
+        'root ::= "{" ' + _literal("conditions") + ' ":" condition "," ' + _literal("actions") + ' ":" actions "}"',
+        "condition ::= leaf | group | negation",
+        'group ::= "{" (' + _literal("all") + " | " + _literal("any") + ') ":[" condition ("," condition)* "]}"',
+        'negation ::= "{" ' + _literal("not") + ' ":" condition "}"',
+        'leaf ::= "{" ' + _literal("fact") + ' ":" string "," ' + _literal("operator") + ' ":" operator "," '
+        + _literal("value") + ' ":" value ("," ' + _literal("position") + ' ":" position)? ("," '
+        + _literal("groupBy") + ' ":" string)? "}"',
+        "operator ::= " + operators,
+        'value ::= scalar | "[" (scalar ("," scalar)*)? "]"',
+        'scalar ::= string | number | "true" | "false"',
+        'actions ::= "{" (action ("," action)*)? "}"',
+        'action ::= pair | ' + _literal("next_action") + ' ":{" (pair ("," pair)*)? "}"',
+        'pair ::= string ":" scalar',
+        'position ::= "\\"" [0-9] [0-9]? [0-9]? ("-" [0-9] [0-9]? [0-9]?)? "\\""',
+        'string ::= "\\"" ([^"\\\\\\x00-\\x1f] | "\\\\" ["\\\\/bfnrt])* "\\""',
+        'number ::= "-"? ("0" | [1-9] [0-9]*) ("." [0-9]+)? ([eE] [-+]? [0-9]+)?',
+    ]) + "\n"
+
+
+RULE_GBNF = rule_gbnf()
+
+
+# Structured-output mode for OpenAI-compatible endpoints (STRUCTURED_OUTPUT):
+#   tools        function calling with the rule schema as parameters (hosted OpenAI/Groq models)
+#   json_schema  response_format json_schema (models with native structured outputs)
+#   json_object  JSON mode: any JSON object, the schema only enforced by validation
+#   guided       vLLM guided decoding against the schema
+#   grammar      llama.cpp server sampling under RULE_GBNF
+#   off          free-form text, rule pulled out by json_utils.extract_json
+def structured_mode(default="tools"):
+    mode = os.getenv("STRUCTURED_OUTPUT", default)
+    if mode not in STRUCTURED_MODES:
+        raise ValueError(f"Unknown STRUCTURED_OUTPUT mode: {mode}")
+    return mode
+
+
+# Extra chat.completions.create arguments for a mode, including the max_tokens cap
+def request_options(mode):
+    if mode == "off":
+        return {}
+    options = {"max_tokens": RULE_MAX_TOKENS}
+    if mode == "tools":
+        options["tools"] = [RULE_TOOL]
+        options["tool_choice"] = {"type": "function", "function": {"name": RULE_TOOL_NAME}}
+    elif mode == "json_schema":
+        options["response_format"] = {"type": "json_schema",
+                                      "json_schema": {"name": "rule", "schema": RULE_SCHEMA, "strict": False}}
+    elif mode == "json_object":
+        options["response_format"] = {"type": "json_object"}
+    elif mode == "guided":
+        options["extra_body"] = {"guided_json": RULE_SCHEMA}
+    elif mode == "grammar":
+        options["extra_body"] = {"grammar": RULE_GBNF}
+    return options
+
+
+# Text of a chat completion message: the forced tool call's arguments, else the content
+def message_text(message):
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        return tool_calls[0].function.arguments or ""
+    return message.content or ""
+
+
+# Text carried by one streamed delta: tool-call argument fragments or content
+def delta_text(delta):
+    tool_calls = getattr(delta, "tool_calls", None)
+    if tool_calls:
+        function = tool_calls[0].function
+        return (function.arguments or "") if function is not None else ""
+    return delta.content or ""
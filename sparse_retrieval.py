@@ -0,0 +1,109 @@
+import re
+import numpy as np
+from scipy import sparse
+
+WORD_RE = re.compile(r"[a-z0-9_]+")
+
+
+# Split text into lowercase word tokens, dropping punctuation
+def tokenize_words(text):
+    return WORD_RE.findall(text.lower())
+
+
+# TF-IDF / BM25 example index backed by a sparse document-term matrix
+class SparseIndex:
+    def __init__(self, vocabulary, matrix, idf, scheme="bm25"):
+        self.vocabulary = vocabulary
+        self.matrix = matrix
+        self.idf = idf
+        self.scheme = scheme
+        self.size = matrix.shape[0]
+
+    @classmethod
+    def build(cls, texts, scheme="bm25", k1=1.5, b=0.75):
+        if scheme not in ("bm25", "tfidf"):
+            raise ValueError(f"Unknown scoring scheme: {scheme}")
+
+        vocabulary = {}
+        rows, cols = [], []
+        for row, text in enumerate(texts):
+            for token in tokenize_words(text):
+                rows.append(row)
+                cols.append(vocabulary.setdefault(token, len(vocabulary)))
+
+        # Raw term counts (duplicate (row, col) entries are summed)
+        shape = (len(texts), max(len(vocabulary), 1))
+        counts = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)), shape=shape
+        )
+        counts.sum_duplicates()
+
+        doc_freq = np.bincount(counts.indices, minlength=shape[1]).astype(np.float32)
+        num_docs = max(shape[0], 1)
+        tf = counts.data
+        row_of_entry = np.repeat(np.arange(shape[0]), np.diff(counts.indptr))
+
+        if scheme == "bm25":
+            idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype(np.float32)
+            doc_len = np.asarray(counts.sum(axis=1)).ravel()
+            avg_len = doc_len.mean() if shape[0] else 1.0
+            norm = k1 * (1 - b + b * doc_len[row_of_entry] / avg_len)
+            weights = idf[counts.indices] * tf * (k1 + 1) / (tf + norm)
+        else:
+            idf = (np.log((1 + num_docs) / (1 + doc_freq)) + 1).astype(np.float32)
+            weights = (1 + np.log(tf)) * idf[counts.indices]
+            # L2-normalize each document row so scores are cosine similarities
+            row_norms = np.sqrt(np.bincount(row_of_entry, weights=weights ** 2, minlength=shape[0]))
+            weights = weights / np.maximum(row_norms[row_of_entry], 1e-12)
+
+        matrix = sparse.csr_matrix(
+            (weights.astype(np.float32), counts.indices, counts.indptr), shape=shape
+        )
+        return cls(vocabulary, matrix, idf, scheme)
+
+    # Sparse query matrix (vocabulary x prompts) for a batch of prompts
+    def _query_matrix(self, prompts):
+        rows, cols, values = [], [], []
+        for col, prompt in enumerate(prompts):
+            term_ids = {}
+            for token in tokenize_words(prompt):
+                term_id = self.vocabulary.get(token)
+                if term_id is not None:
+                    term_ids[term_id] = term_ids.get(term_id, 0) + 1
+            if self.scheme == "bm25":
+                # BM25 weights already live in the document matrix; each query term counts once
+                weights = {term_id: 1.0 for term_id in term_ids}
+            else:
+                weights = {term_id: (1 + np.log(tf)) * self.idf[term_id] for term_id, tf in term_ids.items()}
+                norm = np.sqrt(sum(w * w for w in weights.values())) or 1.0
+                weights = {term_id: w / norm for term_id, w in weights.items()}
+            for term_id, weight in weights.items():
+                rows.append(term_id)
+                cols.append(col)
+                values.append(weight)
+        return sparse.csr_matrix(
+            (np.asarray(values, dtype=np.float32), (rows, cols)),
+            shape=(self.matrix.shape[1], len(prompts)),
+        )
+
+    # Score every example against every prompt with one sparse mat-mat product (examples x prompts)
+    def score_batch(self, prompts):
+        return (self.matrix @ self._query_matrix(prompts)).toarray()
+
+    # Return the ids of the k best examples for each prompt in the batch
+    def search_batch(self, prompts, k=5):
+        if not self.size:
+            return [[] for _ in prompts]
+        scores = self.score_batch(prompts)
+        k = min(k, self.size)
+        results = []
+        for col in range(scores.shape[1]):
+            column = scores[:, col]
+            top = np.argpartition(-column, k - 1)[:k]
+            # Highest score first, earlier examples first on ties
+            top = top[np.lexsort((top, -column[top]))]
+            results.append(top.tolist())
+        return results
+
+    def search(self, prompt, k=5):
+        return self.search_batch([prompt], k)[0]
@@ -0,0 +1,120 @@
+import json
+import asyncio
+
+import pytest
+
+import bulk
+from bulk import BulkRunner, completed_ids, open_checkpoint, read_sentences
+
+SENTENCES = [f"If SB{n:02d} is {n}, flag it." for n in range(1, 11)]
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    class response:
+        headers = {"retry-after": "0"}
+
+
+# A generator that records its calls and, optionally, is rate limited on the first few
+class FakeGenerator:
+    def __init__(self, rate_limited=0):
+        self.calls = []
+        self.rate_limited = rate_limited
+
+    async def __call__(self, sentence):
+        self.calls.append(sentence)
+        if self.rate_limited:
+            self.rate_limited -= 1
+            raise RateLimited("slow down")
+        return {"conditions": {"fact": "sentence", "operator": "equal", "value": sentence},
+                "actions": {"message": "flag"}}
+
+
+# The resume flow of bulk.main: skip completed ids, append to the checkpoint
+def run(input_path, output_path, generate):
+    done = completed_ids(output_path)
+    items = ((item_id, sentence) for item_id, sentence in read_sentences(input_path) if item_id not in done)
+    with open_checkpoint(output_path) as output:
+        asyncio.run(BulkRunner(generate, concurrency=3, max_retries=3).run(items, output))
+
+
+def read_results(output_path):
+    with open(output_path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def test_resume_converts_only_what_is_left(tmp_path):
+    input_path, output_path = tmp_path / "sentences.txt", tmp_path / "results.jsonl"
+    input_path.write_text("\n".join(SENTENCES) + "\n", encoding='utf-8')
+    first = FakeGenerator()
+    run(str(input_path), str(output_path), first)
+    results = read_results(output_path)
+    # Keep four results, one of them an error, and tear the last line as a crash would
+    kept = results[:3] + [dict(results[3], output={"error": "RuntimeError: boom"})]
+    output_path.write_text("".join(json.dumps(record) + "\n" for record in kept) +
+                           json.dumps(results[4])[:20], encoding='utf-8')
+
+    second = FakeGenerator()
+    run(str(input_path), str(output_path), second)
+    assert sorted(second.calls) == sorted(SENTENCES[record["id"] - 1] for record in results[3:])
+    latest = {}
+    with open(output_path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            latest[record["id"]] = record
+    assert sorted(latest) == list(range(1, len(SENTENCES) + 1))
+    assert all("error" not in record["output"] for record in latest.values())
+    assert completed_ids(str(output_path)) == set(latest)
+
+
+def test_completed_ids_skips_lines_that_are_not_results(tmp_path):
+    output_path = tmp_path / "results.jsonl"
+    output_path.write_text("\n".join([
+        json.dumps({"id": 1, "output": {"conditions": {}}}),
+        json.dumps({"id": 2, "output": {"error": "ValueError: bad"}}),
+        json.dumps([3]),
+        json.dumps({"output": {"conditions": {}}}),
+        json.dumps({"id": 5, "output": "text"}),
+        "{not json",
+    ]), encoding='utf-8')
+    assert completed_ids(str(output_path)) == {1}
+    assert completed_ids(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_rate_limit_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, "BASE_BACKOFF", 0)
+    generate = FakeGenerator(rate_limited=3)
+    output_path = tmp_path / "results.jsonl"
+    with open_checkpoint(str(output_path)) as output:
+        runner = BulkRunner(generate, concurrency=1, max_retries=3)
+        asyncio.run(runner.run([(1, SENTENCES[0])], output))
+    assert len(generate.calls) == 4 and runner.failed == 0
+    assert read_results(output_path)[0]["output"]["conditions"]["value"] == SENTENCES[0]
+
+
+def test_exhausted_retries_record_an_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk, "BASE_BACKOFF", 0)
+    generate = FakeGenerator(rate_limited=2)
+    output_path = tmp_path / "results.jsonl"
+    with open_checkpoint(str(output_path)) as output:
+        runner = BulkRunner(generate, concurrency=1, max_retries=1)
+        asyncio.run(runner.run([(1, SENTENCES[0])], output))
+    assert runner.failed == 1
+    assert read_results(output_path)[0]["output"] == {"error": "RateLimited: slow down"}
+    assert completed_ids(str(output_path)) == set()
+
+
+def test_read_sentences_from_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / "sentences.csv"
+    csv_path.write_text("id,text\n1,First rule.\n2,\n3,Third rule.\n", encoding='utf-8')
+    assert list(read_sentences(str(csv_path), "text")) == [(1, "First rule."), (3, "Third rule.")]
+    with pytest.raises(ValueError, match="'input'"):
+        read_sentences(str(csv_path))
+    jsonl_path = tmp_path / "sentences.jsonl"
+    jsonl_path.write_text('{"input": "First rule."}\n[1]\n{bad\n{"other": 1}\n{"input": "Fifth rule."}\n',
+                          encoding='utf-8')
+    assert list(read_sentences(str(jsonl_path))) == [(1, "First rule."), (5, "Fifth rule.")]
@@ -0,0 +1,86 @@
+import itertools
+
+import pytest
+
+import cache
+from cache import ResponseCache, SkeletonCache, cache_key, cache_scope
+
+RULE = {"conditions": {"fact": "GPA", "operator": "lessThan", "value": 2.0}, "actions": {"message": "probation"}}
+WORDS = ["alpha", "beta", "gamma", "delta", "omega", "kappa", "sigma", "theta", "zeta", "iota", "lambda", "rho"]
+
+
+# A settable stand-in for time.time
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+
+def test_response_cache_round_trip_and_ttl(tmp_path, clock):
+    responses = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    key = cache_key("If GPA is below 2.0, place on probation.", "model", 0, "examples")
+    assert responses.get(key) is None
+    responses.set(key, RULE)
+    assert responses.get(key) == RULE
+    clock.now += 61
+    assert responses.get(key) is None
+    assert responses.stats()["hits"] == 1 and responses.stats()["misses"] == 2
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path, clock):
+    responses = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=50, ttl=0)
+    for i in range(cache.EVICT_EVERY - 1):
+        clock.now += 1
+        responses.set(f"k{i}", {"i": i})
+    clock.now += cache.ACCESS_RESOLUTION + 1
+    assert responses.get("k0") == {"i": 0}  # Refreshes its LRU timestamp
+    clock.now += 1
+    responses.set("last", {"i": -1})  # The EVICT_EVERY-th write runs eviction
+    assert responses.stats()["entries"] == 50
+    assert responses.get("k0") == {"i": 0} and responses.get("last") == {"i": -1}
+    assert responses.get("k1") is None and responses.get("k50") is None
+    assert responses.get(f"k{cache.EVICT_EVERY - 2}") is not None
+
+
+def test_cache_key_and_scope_cover_model_temperature_and_examples():
+    prompt = "If GPA is below 2.0, place on probation."
+    keys = {cache_key(prompt, model, temperature, digest)
+            for model, temperature, digest in itertools.product(("a", "b"), (0, 0.7), ("x", "y"))}
+    scopes = {cache_scope(model, temperature, digest)
+              for model, temperature, digest in itertools.product(("a", "b"), (0, 0.7), ("x", "y"))}
+    assert len(keys) == len(scopes) == 8
+
+
+def test_skeleton_cache_reuses_a_rule_within_its_scope_only(tmp_path):
+    skeletons = SkeletonCache(str(tmp_path / "cache.sqlite"))
+    scope, other_scope = cache_scope("model", 0, "x"), cache_scope("model", 0.7, "x")
+    assert skeletons.set("If GPA is below 2.0, place on probation.", scope, RULE)
+    assert skeletons.get("If GPA is below 3.1, place on probation.", scope) == {
+        "conditions": {"fact": "GPA", "operator": "lessThan", "value": 3.1}, "actions": {"message": "probation"}}
+    assert skeletons.get("If GPA is below 3.1, place on probation.", other_scope) is None
+
+
+def test_skeleton_cache_is_bounded_and_expires(tmp_path, clock):
+    path = str(tmp_path / "cache.sqlite")
+    skeletons = SkeletonCache(path, max_entries=50, ttl=3600)
+    scope = cache_scope("model", 0, "x")
+    names = [" ".join(words) for words in itertools.permutations(WORDS, 3)][:2 * cache.EVICT_EVERY]
+    for name in names:
+        clock.now += 1
+        skeletons.set(f"If {name} count is above 5, flag it.", scope,
+                      {"conditions": {"fact": name.replace(" ", "_"), "operator": "greaterThan", "value": 5},
+                       "actions": {"message": "flag"}})
+    assert skeletons._conn.execute("SELECT COUNT(*) FROM skeletons").fetchone()[0] == 50
+    prompt = f"If {names[-1]} count is above 7, flag it."
+    assert skeletons.get(prompt, scope)["conditions"]["value"] == 7
+    clock.now += 3601
+    assert SkeletonCache(path, max_entries=50, ttl=3600).get(prompt, scope) is None
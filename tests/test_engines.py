@@ -0,0 +1,94 @@
+import random
+
+import pytest
+
+from columnar import ColumnarRuleSet, ColumnBatch
+from rule_engine import RuleSet
+from rule_network import RuleNetwork
+
+# Fact generators for the differential runs, each with a missing (None) value among its choices
+FACTS = {
+    "SB11": lambda rng: rng.choice([10000, 3, 20000, 7, None]),
+    "SB01": lambda rng: rng.choice(["S", "X", "SS", None]),
+    "gpa": lambda rng: rng.choice([1.5, 2.0, 3.7, None]),
+    "flag": lambda rng: rng.choice([True, False, None]),
+}
+OPERATORS = ["equal", "notEqual", "lessThan", "greaterThan", "in", "notInRange", "startsWith"]
+VALUES = [10000, "10000", 3, "S", 2.0, "X", True, [3, 10000], ["S", "X"], "1"]
+
+
+def random_leaf(rng):
+    fact = rng.choice(list(FACTS))
+    operator = rng.choice(OPERATORS)
+    value = rng.choice(VALUES)
+    if operator in ("in", "notInRange") and not isinstance(value, list):
+        value = [value]
+    if operator not in ("in", "notInRange") and isinstance(value, list):
+        value = value[0]
+    if operator in ("lessThan", "greaterThan") and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        value = 2.5
+    leaf = {"fact": fact, "operator": operator, "value": value}
+    if rng.random() < 0.2 and fact in ("SB01", "SB11", "flag"):
+        leaf["position"] = "1"
+    return leaf
+
+
+def random_case(rng):
+    rules = [{
+        "conditions": rng.choice([random_leaf(rng), {"not": random_leaf(rng)},
+                                  {"all": [random_leaf(rng), random_leaf(rng)]},
+                                  {"any": [random_leaf(rng), random_leaf(rng)]}]),
+        "actions": {"i": i},
+    } for i in range(10)]
+    records = [{fact: make(rng) for fact, make in FACTS.items() if rng.random() < 0.9} for _ in range(10)]
+    return rules, records
+
+
+# (record index, actions) per match, the part every evaluator reports the same way
+def matches(results):
+    return [(i, actions) for i, _, actions in results]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_network_and_columnar_match_rule_engine(seed):
+    rng = random.Random(seed)
+    for _ in range(60):
+        rules, records = random_case(rng)
+        expected = matches(RuleSet(rules).run(records))
+        assert matches(RuleNetwork(rules).run(records)) == expected, rules
+        batch = ColumnBatch.from_records(records, list(FACTS))
+        assert matches(ColumnarRuleSet(rules).run(batch)) == expected, rules
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_columnar_from_arrow_matches_rule_engine(seed):
+    pa = pytest.importorskip("pyarrow")
+    rng = random.Random(seed)
+    for _ in range(60):
+        rules, records = random_case(rng)
+        expected = matches(RuleSet(rules).run(records))
+        table = pa.table({fact: pa.array([record.get(fact) for record in records]) for fact in FACTS})
+        assert matches(ColumnarRuleSet(rules).run(ColumnBatch.from_arrow(table))) == expected, rules
+
+
+def test_none_fact_is_missing_on_every_path():
+    rules = [
+        {"conditions": {"fact": "SB01", "operator": "notEqual", "value": "S"}, "actions": {"i": 0}},
+        {"conditions": {"fact": "SB01", "operator": "notEqual", "value": "S", "position": "1"}, "actions": {"i": 1}},
+        {"conditions": {"not": {"fact": "SB01", "operator": "equal", "value": "S"}}, "actions": {"i": 2}},
+    ]
+    records = [{"SB01": None}, {}]
+    expected = matches(RuleSet(rules).run(records))
+    assert [actions["i"] for _, actions in expected] == [2, 2]  # Only the negation holds for a missing fact
+    assert matches(RuleNetwork(rules).run(records)) == expected
+    assert matches(ColumnarRuleSet(rules).run(ColumnBatch.from_records(records, ["SB01"]))) == expected
+
+
+def test_nullable_arrow_ints_stay_ints():
+    pa = pytest.importorskip("pyarrow")
+    rules = [{"conditions": {"fact": "SB11", "operator": "in", "value": ["10000"]}, "actions": {"i": 0}}]
+    records = [{"SB11": 10000}, {"SB11": None}, {"SB11": 3}]
+    table = pa.table({"SB11": pa.array([record["SB11"] for record in records], type=pa.int64())})
+    expected = matches(RuleSet(rules).run(records))
+    assert [index for index, _ in expected] == [0]
+    assert matches(ColumnarRuleSet(rules).run(ColumnBatch.from_arrow(table))) == expected
@@ -0,0 +1,68 @@
+import pytest
+
+from fast_path import fact_vocabulary, fast_rule, resolve_fact
+from prompts import load_examples
+
+GOLDEN_COVERAGE = 12  # Bundled examples the fast path converts today; a drop is a regression
+
+
+# A condition group of one ({"any": [leaf]}) is the leaf itself
+def unwrapped(node):
+    if isinstance(node, dict):
+        if len(node) == 1 and next(iter(node)) in ("all", "any") and len(next(iter(node.values()))) == 1:
+            return unwrapped(next(iter(node.values()))[0])
+        return {key: unwrapped(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [unwrapped(value) for value in node]
+    return node
+
+
+def test_bundled_examples_get_their_own_conditions():
+    covered = 0
+    for example in load_examples():
+        rule = fast_rule(example['input'])
+        if rule is None:
+            continue
+        covered += 1
+        assert unwrapped(rule["conditions"]) == unwrapped(example['output']["conditions"]), example['input']
+    assert covered >= GOLDEN_COVERAGE
+
+
+@pytest.mark.parametrize("prompt, rule", [
+    ("If this field is coded as 7YYYY, 7XXXX, 8YYYY, or 8XXXX, then Student Enrollment Status (SB15) must not be "
+     "coded as 1.",
+     {"conditions": {"fact": "field_value", "operator": "in", "value": ["7YYYY", "7XXXX", "8YYYY", "8XXXX"]},
+      "actions": {"fact": "SB15", "operator": "notEqual", "value": "1"}}),
+    ("If Student Education Status (SB11) = 10000, then the student’s computed age must be less than 22.",
+     {"conditions": {"all": [{"fact": "SB11", "operator": "equal", "value": 10000},
+                             {"fact": "computed_age", "operator": "lessThan", "value": 22}]},
+      "actions": {"message": "The student's computed age must be less than 22."}}),
+    ("If the student’s email domain is '.edu', classify them as a university-affiliated student.",
+     {"conditions": {"fact": "email", "operator": "endsWith", "value": ".edu"},
+      "actions": {"message": "classify them as a university-affiliated student."}}),
+    ("If the student's email domain ends in .edu, flag it.",
+     {"conditions": {"fact": "email", "operator": "endsWith", "value": ".edu"},
+      "actions": {"message": "flag it."}}),
+])
+def test_golden_rules(prompt, rule):
+    assert fast_rule(prompt) == rule
+
+
+@pytest.mark.parametrize("prompt", [
+    "If the student's favourite colour is 'blue', send a welcome pack.",  # No such fact
+    "If the GPA is low, warn them.",  # A value that needs interpreting
+    "If SB11 is 10000, then SB15 must be coded as 1 unless SB01 is S.",  # A nested clause
+])
+def test_sentences_left_to_the_model(prompt):
+    assert fast_rule(prompt) is None
+
+
+def test_resolve_fact_uses_the_known_facts():
+    facts = fact_vocabulary(load_examples())
+    assert resolve_fact("Student Enrollment Status", facts) == "SB15"
+    assert resolve_fact("the student's GPA", facts) == "GPA"
+    assert resolve_fact("the student's declared major", facts) == "declared_major"
+    assert resolve_fact("the student's intended major", facts) == "major"  # The known fact it names
+    assert resolve_fact("the student's email domain", facts) == "email"
+    assert resolve_fact("the student's shoe size", facts) is None
+    assert resolve_fact("the student's shoe size", facts | {"shoe_size"}) == "shoe_size"
@@ -0,0 +1,80 @@
+import json
+import time
+
+import pytest
+
+from json_utils import IncrementalJSONParser, extract_json, extract_json_objects
+from prompts import load_examples
+from rule_repair import parse_rule_text
+
+RULE = {"conditions": {"fact": "GPA", "operator": "lessThan", "value": 2.0}, "actions": {"message": "probation"}}
+RULE_TEXT = json.dumps(RULE)
+
+
+# Feed text in chunks of size until the parser reports the object closed
+def feed(text, size):
+    parser = IncrementalJSONParser()
+    for i in range(0, len(text), size):
+        if parser.feed(text[i:i + size]):
+            break
+    return parser
+
+
+@pytest.mark.parametrize("text", [
+    RULE_TEXT,
+    "Here is the rule:\n" + RULE_TEXT + "\nLet me know if it needs changes.",
+    "```json\n" + RULE_TEXT + "\n```",
+    "Note {like this} first. " + RULE_TEXT,
+    'text "quote { not json" ' + RULE_TEXT,
+    RULE_TEXT.replace('"probation"}', '"probation",}'),  # Trailing comma
+    "{'conditions': {'fact': 'GPA', 'operator': 'lessThan', 'value': 2.0}, 'actions': {'message': 'probation'}}",
+])
+def test_extract_json_finds_the_rule(text):
+    assert extract_json(text) == RULE
+
+
+def test_extract_json_rescans_past_a_prose_span():
+    assert extract_json('text "quote { not json" {"a": "b}"}') == {"a": "b}"}
+    assert extract_json_objects('pre {like this} {"a":1} mid {"b":{"c":2}} {bad {"d":3}') == \
+        [{"a": 1}, {"b": {"c": 2}}, {"d": 3}]
+
+
+def test_truncated_object_yields_no_fragment():
+    truncated = RULE_TEXT[:RULE_TEXT.index('"actions"') + 14]
+    assert extract_json_objects(truncated) == []  # The closed conditions leaf is part of the cut-off rule
+    assert parse_rule_text(truncated)["conditions"] == RULE["conditions"]
+    assert parse_rule_text('Sure { here {"fact": "x", "operator": "equal", "value": 1} and') is None
+
+
+@pytest.mark.parametrize("text", ["{ " * 40000, '{"a" ' * 4000 + "}" * 4000, "{'a' " * 4000 + "}" * 4000,
+                                  '{"a": ' * 2000 + "1" + "} x" * 2000])
+def test_extraction_is_linear(text):
+    start = time.perf_counter()
+    extract_json(text)
+    feed(text, 50)
+    assert time.perf_counter() - start < 2.0
+
+
+@pytest.mark.parametrize("size", [1, 7, 64])
+def test_incremental_parser_matches_extract_json_on_examples(size):
+    for example in load_examples():
+        for indent in (None, 2):
+            text = "Rule: " + json.dumps(example['output'], indent=indent) + " {trailing}"
+            parser = feed(text, size)
+            assert parser.complete
+            assert json.loads(parser.object_text()) == example['output'] == extract_json(text)
+
+
+def test_incremental_parser_partial_closes_open_containers():
+    parser = IncrementalJSONParser()
+    parser.feed(RULE_TEXT[:RULE_TEXT.index('"actions"') + 5])
+    assert not parser.complete and parser.incomplete
+    assert parser.partial() == {"conditions": RULE["conditions"]}
+    parser.feed(RULE_TEXT[RULE_TEXT.index('"actions"') + 5:])
+    assert parser.complete and parser.partial() == RULE
+
+
+def test_incremental_parser_skips_prose_braces():
+    parser = feed("Note {like this} then {x: {" + RULE_TEXT[1:] + " }", 3)
+    assert parser.complete
+    assert json.loads(parser.object_text())["conditions"] == RULE["conditions"]
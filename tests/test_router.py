@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from prompts import load_examples
+from router import RuleRouter, Tier, TemplateMatcher, TierMetrics, pattern_tier, score_rule, template_tier
+
+PROMPT = "If a student has more than 3 concurrent incomplete grades, flag for advisor review."
+RULE = {"conditions": {"fact": "incomplete_grades", "operator": "greaterThan", "value": 3},
+        "actions": {"fact": "review", "operator": "flag", "value": "advisor_review"}}
+HOSTED_RULE = {"conditions": {"fact": "GPA", "operator": "lessThan", "value": 2.0}, "actions": {"message": "probation"}}
+
+
+@pytest.fixture(scope="module")
+def matcher():
+    return TemplateMatcher(load_examples())
+
+
+# A last tier that stands in for the hosted model and counts its calls
+def hosted_tier(calls, rule=HOSTED_RULE, error=None):
+    async def generate(prompt):
+        calls.append(prompt)
+        if error is not None:
+            raise error
+        return rule
+    return Tier("hosted", generate, 0.0)
+
+
+def test_template_fills_in_a_near_identical_sentence(matcher):
+    assert matcher.match(PROMPT) == RULE
+    assert matcher.match(PROMPT.replace("3", "4")) == dict(RULE, conditions=dict(RULE["conditions"], value=4))
+    assert matcher.match(PROMPT.replace("more", "less")) is None  # A changed comparison is not a template
+    assert matcher.match("If the library is closed, send an email.") is None
+
+
+def test_router_accepts_a_confident_template(matcher):
+    calls, metrics = [], TierMetrics()
+    router = RuleRouter(matcher, [template_tier(matcher), hosted_tier(calls)], metrics)
+    rule, tier, confidence = asyncio.run(router.aroute(PROMPT.replace("3", "5")))
+    assert tier == "template" and rule["conditions"]["value"] == 5 and confidence >= 0.8
+    assert calls == [] and metrics.stats()["template"]["accepted"] == 1
+
+
+def test_router_escalates_to_the_last_tier(matcher):
+    calls, metrics = [], TierMetrics()
+    prompt = "If the library is closed, send an email."
+
+    async def raises(prompt):
+        raise RuntimeError("local model down")
+    tiers = [template_tier(matcher), pattern_tier(), Tier("local", raises, 0.8), hosted_tier(calls)]
+    rule, tier, _ = asyncio.run(RuleRouter(matcher, tiers, metrics).aroute(prompt))
+    assert (rule, tier, calls) == (HOSTED_RULE, "hosted", [prompt])
+    stats = metrics.stats()
+    assert stats["template"]["escalated"] == stats["pattern"]["escalated"] == stats["local"]["errors"] == 1
+    assert stats["hosted"]["accepted"] == 1 and stats["hosted"]["share"] == 1.0
+
+
+def test_router_without_fallback_leaves_the_last_tier_to_the_caller(matcher):
+    calls = []
+    router = RuleRouter(matcher, [template_tier(matcher), hosted_tier(calls)], TierMetrics())
+    assert asyncio.run(router.aroute("If the library is closed, send an email.", fallback=False)) == (None, None, 0.0)
+    assert calls == []
+
+
+def test_last_tier_errors_propagate(matcher):
+    router = RuleRouter(matcher, [template_tier(matcher), hosted_tier([], error=TimeoutError("slow"))], TierMetrics())
+    with pytest.raises(TimeoutError):
+        asyncio.run(router.aroute("If the library is closed, send an email."))
+
+
+def test_score_rule():
+    assert score_rule({"error": "No matching template"}, RULE) == 0.0
+    assert score_rule({"conditions": {"fact": "GPA"}, "actions": {}}, RULE) == 0.0  # Fails validation
+    assert score_rule(HOSTED_RULE) == 0.5
+    assert score_rule(RULE, RULE, similarity=1.0) == 1.0
+    assert score_rule(RULE, RULE, similarity=0.5) == 0.5  # A copy of a merely similar example
+    assert score_rule(HOSTED_RULE, RULE) < 0.8